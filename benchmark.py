@@ -0,0 +1,446 @@
+#!/usr/bin/python3
+
+import argparse
+import contextlib
+import csv
+import json
+import os.path
+import platform
+import random
+import re
+import shlex
+import shutil
+import signal
+import string
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+APPLICATION_ID = "com.accelleran.terminal"
+OBJECT_PATH    = "/com/accelleran/terminal"
+WINDOW_TITLE   = "My Terminal"
+POLL_INTERVAL  = 0.02
+TIMEOUT        = 120.0
+
+def write_png(path, width, height, rgba):
+    # A minimal encoder keeps the harness free of dependencies beyond the ones of the terminal itself.
+    def chunk(chunk_type, data):
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+    rows = b"".join(b"\x00" + bytes(rgba) * width for _ in range(height))
+
+    with open(path, "wb") as png_file:
+        png_file.write(b"\x89PNG\r\n\x1a\n")
+        png_file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        png_file.write(chunk(b"IDAT", zlib.compress(rows)))
+        png_file.write(chunk(b"IEND", b""))
+
+def write_flood_file(path, size):
+    generator = random.Random(0)
+    alphabet  = string.ascii_letters + string.digits + " "
+
+    with open(path, "w") as flood_file:
+        lines = ["".join(generator.choice(alphabet) for _ in range(99)) + "\n" for _ in range(1024)]
+        written = 0
+
+        while written < size:
+            line = lines[written // 100 % len(lines)]
+            flood_file.write(line)
+            written += len(line)
+
+def wait_for(condition, timeout=TIMEOUT):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        result = condition()
+
+        if result:
+            return result
+
+        time.sleep(POLL_INTERVAL)
+
+    raise TimeoutError("timed out waiting for the terminal")
+
+def read_timestamp(path):
+    try:
+        with open(path) as timestamp_file:
+            return float(timestamp_file.read().split()[-1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+def count_lines(path):
+    try:
+        with open(path) as lines_file:
+            return sum(1 for _ in lines_file)
+    except OSError:
+        return 0
+
+def get_rss(pid):
+    with open(f"/proc/{pid:d}/status") as status_file:
+        for line in status_file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+
+    return 0
+
+def get_git_revision(directory):
+    try:
+        return subprocess.run(["git", "-C", directory, "describe", "--always", "--dirty"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@contextlib.contextmanager
+def start_display(backend):
+    environment = {}
+
+    if backend == "xvfb":
+        server = subprocess.Popen(["Xvfb", "-displayfd", "1", "-screen", "0", "1920x1080x24", "-nolisten", "tcp"], stdout=subprocess.PIPE, text=True)
+        environment["DISPLAY"]     = ":" + server.stdout.readline().strip()
+        environment["GDK_BACKEND"] = "x11"
+    else:
+        display = f":{random.randint(10, 99):d}"
+        server  = subprocess.Popen(["broadwayd", display], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        environment["BROADWAY_DISPLAY"] = display
+        environment["GDK_BACKEND"]      = "broadway"
+        time.sleep(0.5)
+
+    bus = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address=1"], stdout=subprocess.PIPE, text=True)
+    environment["DBUS_SESSION_BUS_ADDRESS"] = bus.stdout.readline().strip()
+
+    try:
+        yield environment
+    finally:
+        for process in (bus, server):
+            process.terminate()
+            process.wait()
+
+class Benchmark:
+    def __init__(self, arguments, display_environment):
+        self.__arguments           = arguments
+        self.__display_environment = display_environment
+        self.__directory           = tempfile.mkdtemp(prefix="terminal-benchmark-")
+        self.__flood_path          = os.path.join(self.__directory, "flood.txt")
+        self.__has_diagnostics     = False
+
+        write_flood_file(self.__flood_path, arguments.flood_size * 1024 * 1024)
+
+    def close(self):
+        shutil.rmtree(self.__directory, ignore_errors=True)
+
+    def run(self):
+        results = {}
+
+        home = self.__create_home("startup", [self.__idle_row(f"Idle {tab_index:d}") for tab_index in range(self.__arguments.tabs)])
+        results["cold_startup"] = self.__measure_startup(home)
+        results["warm_startup"] = self.__measure_startup(home)
+
+        results["foreground_throughput"] = self.__measure_throughput([self.__idle_row("Idle"), self.__flood_row("Flood", "flood")])
+        results["background_throughput"] = self.__measure_throughput([self.__flood_row("Flood", "flood"), self.__idle_row("Idle")])
+        results["snippet_latency"]       = self.__measure_snippet_latency()
+        results["rss_per_tab"]           = self.__measure_rss()
+        results["open_tab"]              = self.__measure_open_tab()
+        return results
+
+    def __idle_row(self, title):
+        return [title, "false", f"Icon {len(title) % 32:d}", shlex.join(["/bin/sh", "-c", "printf '$ '; exec cat"]), self.__directory]
+
+    def __flood_row(self, title, marker):
+        script = f"date +%s.%N > {marker:s}.start; cat {shlex.quote(self.__flood_path):s}; date +%s.%N > {marker:s}.done; exec cat"
+        return [title, "false", f"Icon {len(title) % 32:d}", shlex.join(["/bin/sh", "-c", script]), self.__directory]
+
+    def __create_home(self, name, rows, scrollback_lines=10000, snippets="", commands=""):
+        home                    = os.path.join(self.__directory, name)
+        configuration_directory = os.path.join(home, ".terminal")
+        icon_directory          = os.path.join(configuration_directory, "icons")
+        os.makedirs(icon_directory)
+
+        for icon_index in range(32):
+            write_png(os.path.join(icon_directory, f"Icon {icon_index:d}.png"), 256, 256, (icon_index * 8, 128, 255 - icon_index * 8, 255))
+
+        # Only the columns that every version reads are written, so that older versions can be benchmarked as well.
+        with open(os.path.join(configuration_directory, "tabs.csv"), "w", newline="") as tabs_file:
+            csv.writer(tabs_file).writerows(rows)
+
+        with open(os.path.join(configuration_directory, "commands.ini"), "w") as commands_file:
+            commands_file.write(f"[DEFAULT]\nScrollback Lines = {scrollback_lines:d}\n{commands:s}")
+
+        with open(os.path.join(configuration_directory, "snippets.ini"), "w") as snippets_file:
+            snippets_file.write(snippets)
+
+        with open(os.path.join(configuration_directory, "settings.ini"), "w") as settings_file:
+            settings_file.write(f"[Session]\nFlush Interval = {self.__arguments.flush_interval:f}\n")
+
+        return home
+
+    @contextlib.contextmanager
+    def __start_terminal(self, home):
+        environment = dict(os.environ)
+        environment.update(self.__display_environment)
+        environment["HOME"] = home
+
+        start_time = time.monotonic()
+        process    = subprocess.Popen([sys.executable, self.__arguments.terminal], env=environment, cwd=self.__directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        try:
+            yield process, start_time
+        finally:
+            process.send_signal(signal.SIGTERM)
+
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def __call_application(self, interface, method, parameters):
+        return subprocess.run(
+            ["gdbus", "call", "--session", "--dest", APPLICATION_ID, "--object-path", OBJECT_PATH, "--method", f"{interface:s}.{method:s}", *parameters],
+            env=dict(os.environ, **self.__display_environment),
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=TIMEOUT).stdout
+
+    def __list_actions(self):
+        try:
+            return re.findall(r"'([^']*)'", self.__call_application("org.gtk.Actions", "List", []))
+        except subprocess.CalledProcessError:
+            return None
+
+    def __wait_for_application(self):
+        # Actions are only dispatched once the startup handler has returned. Versions without diagnostics are measured
+        # from the outside only, through wall clock time, their memory use and the timestamps their tabs write.
+        self.__has_diagnostics = "dump-diagnostics" in wait_for(self.__list_actions)
+
+    def __dump_diagnostics(self, home):
+        path = os.path.join(home, f"diagnostics-{time.monotonic_ns():d}.json")
+
+        try:
+            self.__call_application("org.gtk.Actions", "Activate", ["dump-diagnostics", f"[<'{path:s}'>]", "{}"])
+        except subprocess.CalledProcessError:
+            return None
+
+        try:
+            with open(path) as diagnostics_file:
+                return json.load(diagnostics_file)
+        except (OSError, ValueError):
+            return None
+
+    def __wait_for_tabs(self, home, predicate):
+        def condition():
+            diagnostics = self.__dump_diagnostics(home)
+            return diagnostics if diagnostics is not None and predicate(diagnostics["tabs"]) else None
+
+        return wait_for(condition)
+
+    def __measure_startup(self, home):
+        with self.__start_terminal(home) as (process, start_time):
+            self.__wait_for_application()
+            startup_time = time.monotonic() - start_time
+
+            if not self.__has_diagnostics:
+                return {
+                    "tabs":      self.__arguments.tabs,
+                    "startup_s": startup_time,
+                    "rss_bytes": get_rss(process.pid)}
+
+            # The last restored tab is the one that is shown.
+            self.__wait_for_tabs(home, lambda tabs: tabs[-1]["output_bytes"] > 0)
+            first_prompt_time = time.monotonic() - start_time
+
+            self.__wait_for_tabs(home, lambda tabs: all(tab["output_bytes"] > 0 for tab in tabs))
+            all_prompts_time = time.monotonic() - start_time
+
+            # Restoring the tabs schedules a session save, whose cost on the main loop is reported by the profiler.
+            time.sleep(self.__arguments.flush_interval * 2)
+            diagnostics = self.__dump_diagnostics(home)
+            rss         = get_rss(process.pid)
+
+        return {
+            "tabs":            self.__arguments.tabs,
+            "startup_s":       startup_time,
+            "rss_bytes":       rss,
+            "first_prompt_s":  first_prompt_time,
+            "all_prompts_s":   all_prompts_time,
+            "session_save":    diagnostics["handlers"].get("SessionStore.handle_flush_timeout_expiry"),
+            "startup_handler": diagnostics["handlers"].get("Application.handle_application_startup_event"),
+            "main_loop":       diagnostics["main_loop"]}
+
+    def __measure_throughput(self, rows):
+        home       = self.__create_home(f"throughput-{time.monotonic_ns():d}", rows)
+        start_path = os.path.join(self.__directory, "flood.start")
+        done_path  = os.path.join(self.__directory, "flood.done")
+
+        for path in (start_path, done_path):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+
+        with self.__start_terminal(home) as (process, start_time):
+            self.__wait_for_application()
+            flood_start = wait_for(lambda: read_timestamp(start_path))
+            flood_done  = wait_for(lambda: read_timestamp(done_path))
+            diagnostics = self.__dump_diagnostics(home) if self.__has_diagnostics else None
+            rss         = get_rss(process.pid)
+
+        size    = os.path.getsize(self.__flood_path)
+        results = {
+            "bytes":       size,
+            "duration_s":  flood_done - flood_start,
+            "bytes_per_s": size / (flood_done - flood_start),
+            "rss_bytes":   rss}
+
+        if diagnostics is not None:
+            results["pty_readable"] = diagnostics["handlers"].get("Terminal.handle_pty_readable")
+            results["main_loop"]    = diagnostics["main_loop"]
+
+        return results
+
+    def __measure_snippet_latency(self):
+        if "DISPLAY" not in self.__display_environment or shutil.which("xdotool") is None:
+            return {"skipped": "requires the xvfb backend and xdotool"}
+
+        marker_path = os.path.join(self.__directory, "snippet.marker")
+        script      = f"while read line; do date +%s.%N >> {shlex.quote(marker_path):s}; done"
+        home        = self.__create_home("snippets", [["Snippets", "false", "Icon 0", shlex.join(["/bin/sh", "-c", script]), self.__directory]], snippets="[F12]\nSnippet = echo $PWD\\n\n")
+        environment = dict(os.environ, **self.__display_environment)
+        latencies   = []
+
+        with self.__start_terminal(home) as (process, start_time):
+            self.__wait_for_application()
+            window = subprocess.run(["xdotool", "search", "--sync", "--name", f"^{WINDOW_TITLE:s}$"], env=environment, capture_output=True, text=True, check=True).stdout.split()[0]
+            subprocess.run(["xdotool", "windowfocus", "--sync", window], env=environment, check=True)
+
+            for iteration in range(self.__arguments.snippet_iterations):
+                key_time = time.time()
+                subprocess.run(["xdotool", "key", "F12"], env=environment, check=True)
+                wait_for(lambda: count_lines(marker_path) > iteration)
+                latencies.append(read_timestamp(marker_path) - key_time)
+
+            diagnostics = self.__dump_diagnostics(home) if self.__has_diagnostics else None
+
+        latencies.sort()
+
+        results = {
+            "iterations": len(latencies),
+            "median_s":   latencies[len(latencies) // 2],
+            "maximum_s":  latencies[-1]}
+
+        if diagnostics is not None:
+            results["key_press"] = diagnostics["handlers"].get("Terminal.handle_terminal_key_press_event")
+
+        return results
+
+    def __measure_open_tab(self):
+        # Both ways of opening a tab from outside, the Open of a directory and the open-command action of terminal-client.py, also serve as a smoke check.
+        command = shlex.join(["/bin/sh", "-c", "printf '$ '; exec cat"])
+        home    = self.__create_home("open", [self.__idle_row("Idle")], commands=f"\n[Opened]\nIcon = Icon 0\nCommand = {command:s}\nWorking Dir = {self.__directory:s}\n")
+
+        with self.__start_terminal(home) as (process, start_time):
+            self.__wait_for_application()
+
+            # Without diagnostics, there is no telling from the outside when a tab has been opened.
+            if not self.__has_diagnostics:
+                return {"skipped": "requires the dump-diagnostics action"}
+
+            directory_time = time.monotonic()
+            self.__call_application("org.gtk.Application", "Open", [f"['file://{self.__directory:s}']", "", "{}"])
+            self.__wait_for_tabs(home, lambda tabs: len(tabs) == 2)
+            directory_time = time.monotonic() - directory_time
+
+            command_time = time.monotonic()
+            self.__call_application("org.gtk.Actions", "Activate", ["open-command", "[<'Opened'>]", "{}"])
+            self.__wait_for_tabs(home, lambda tabs: len(tabs) == 3 and tabs[-1]["output_bytes"] > 0)
+            command_time = time.monotonic() - command_time
+
+        return {
+            "directory_s": directory_time,
+            "command_s":   command_time}
+
+    def __measure_rss(self):
+        idle_home = self.__create_home("rss-idle", [self.__idle_row("Idle")], self.__arguments.scrollback_lines)
+
+        with self.__start_terminal(idle_home) as (process, start_time):
+            self.__wait_for_application()
+            baseline_rss = get_rss(process.pid)
+
+        rows      = [self.__idle_row("Idle")] + [self.__flood_row(f"Flood {tab_index:d}", f"rss-{tab_index:d}") for tab_index in range(self.__arguments.rss_tabs)]
+        full_home = self.__create_home("rss-full", rows, self.__arguments.scrollback_lines)
+
+        with self.__start_terminal(full_home) as (process, start_time):
+            for tab_index in range(self.__arguments.rss_tabs):
+                wait_for(lambda: read_timestamp(os.path.join(self.__directory, f"rss-{tab_index:d}.done")))
+
+            self.__wait_for_application()
+            full_rss = get_rss(process.pid)
+
+        return {
+            "tabs":             self.__arguments.rss_tabs,
+            "scrollback_lines": self.__arguments.scrollback_lines,
+            "baseline_bytes":   baseline_rss,
+            "total_bytes":      full_rss,
+            "per_tab_bytes":    (full_rss - baseline_rss) / self.__arguments.rss_tabs}
+
+def flatten(results, prefix=""):
+    values = {}
+
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix:s}{key:s}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[prefix + key] = value
+
+    return values
+
+def compare(baseline_path, candidate_path):
+    with open(baseline_path) as baseline_file, open(candidate_path) as candidate_file:
+        baseline  = flatten(json.load(baseline_file)["results"])
+        candidate = flatten(json.load(candidate_file)["results"])
+
+    for key in sorted(baseline.keys() & candidate.keys()):
+        change = (candidate[key] - baseline[key]) / baseline[key] * 100 if baseline[key] else 0.0
+        print(f"{key:60s} {baseline[key]:16.4f} {candidate[key]:16.4f} {change:+8.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the terminal under a virtual display")
+    parser.add_argument("--backend", choices=("xvfb", "broadway"), default="xvfb", help="virtual display to run the terminal on")
+    parser.add_argument("--terminal", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "terminal.py"), help="terminal to benchmark")
+    parser.add_argument("--tabs", type=int, default=20, help="number of tabs restored at startup")
+    parser.add_argument("--flood-size", type=int, default=64, help="MiB of output written by flooding tabs")
+    parser.add_argument("--rss-tabs", type=int, default=4, help="number of flooding tabs when measuring memory")
+    parser.add_argument("--scrollback-lines", type=int, default=100000, help="scrollback of the tabs when measuring memory")
+    parser.add_argument("--snippet-iterations", type=int, default=20, help="number of snippet expansions to time")
+    parser.add_argument("--flush-interval", type=float, default=0.2, help="session flush interval of the terminal")
+    parser.add_argument("--output", help="file to write the results to instead of standard output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="compare two result files instead of benchmarking")
+    arguments = parser.parse_args()
+
+    if arguments.compare:
+        compare(*arguments.compare)
+        return
+
+    with start_display(arguments.backend) as display_environment:
+        benchmark = Benchmark(arguments, display_environment)
+
+        try:
+            results = benchmark.run()
+        finally:
+            benchmark.close()
+
+    report = {
+        "revision": get_git_revision(os.path.dirname(os.path.abspath(arguments.terminal))),
+        "time":     time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python":   platform.python_version(),
+        "backend":  arguments.backend,
+        "results":  results}
+
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(report, output_file, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+
+main()
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# Hands requests to a running terminal over D-Bus without loading GTK, VTE or anything else the full application needs,
+# and only starts the full application when no instance is running yet.
+
+import argparse
+import gi
+import os.path
+import sys
+
+gi.require_version("Gio", "2.0")
+import gi.repository.Gio as gio
+
+gi.require_version("GLib", "2.0")
+import gi.repository.GLib as glib
+
+APPLICATION_ID = "com.accelleran.terminal"
+OBJECT_PATH    = "/com/accelleran/terminal"
+TERMINAL       = os.path.join(os.path.dirname(os.path.realpath(__file__)), "terminal.py")
+
+def get_platform_data():
+    platform_data = {}
+    startup_id    = os.environ.get("DESKTOP_STARTUP_ID")
+
+    # Passing the startup notification on lets the window manager give the running instance focus.
+    if startup_id:
+        platform_data["desktop-startup-id"] = glib.Variant("s", startup_id)
+
+    return platform_data
+
+def is_running(connection):
+    result = connection.call_sync(
+        "org.freedesktop.DBus",
+        "/org/freedesktop/DBus",
+        "org.freedesktop.DBus",
+        "NameHasOwner",
+        glib.Variant("(s)", (APPLICATION_ID,)),
+        glib.VariantType.new("(b)"),
+        gio.DBusCallFlags.NONE,
+        -1,
+        None)
+    return result.unpack()[0]
+
+def call(connection, interface_name, method_name, parameters):
+    connection.call_sync(APPLICATION_ID, OBJECT_PATH, interface_name, method_name, parameters, None, gio.DBusCallFlags.NONE, -1, None)
+
+def main():
+    parser = argparse.ArgumentParser(description="Open a tab in the running terminal")
+    parser.add_argument("-c", "--command", metavar="NAME", help="open a tab for the commands.ini entry NAME")
+    parser.add_argument("directories", nargs="*", help="open a tab in each of these directories")
+    arguments = parser.parse_args()
+
+    try:
+        connection = gio.bus_get_sync(gio.BusType.SESSION, None)
+        running    = is_running(connection)
+    except glib.Error:
+        running = False
+
+    if not running:
+        os.execv(sys.executable, [sys.executable, TERMINAL] + sys.argv[1:])
+
+    platform_data = get_platform_data()
+
+    if arguments.command is not None:
+        call(connection, "org.gtk.Actions", "Activate", glib.Variant("(sava{sv})", ("open-command", [glib.Variant("s", arguments.command)], platform_data)))
+
+    if arguments.directories:
+        uris = [gio.File.new_for_commandline_arg(directory).get_uri() for directory in arguments.directories]
+        call(connection, "org.gtk.Application", "Open", glib.Variant("(assa{sv})", (uris, "", platform_data)))
+
+    if arguments.command is None and not arguments.directories:
+        call(connection, "org.gtk.Application", "Activate", glib.Variant("(a{sv})", (platform_data,)))
+
+main()
@@ -1,14 +1,33 @@
 #!/usr/bin/python3
 
+import array
+import bisect
+import codecs
+import collections
+import concurrent.futures
 import configparser
 import csv
+import functools
 import gi
+import gzip
+import hashlib
 import html
+import json
 import os.path
-import pykeepass
+import queue
+import re
 import shlex
+import shutil
+import signal
+import struct
+import subprocess
 import sys
+import termios
+import threading
+import time
 import urllib.parse
+import uuid
+import zlib
 
 gi.require_version("Gdk", "3.0")
 import gi.repository.Gdk as gdk
@@ -31,14 +50,258 @@ import gi.repository.Gtk as gtk
 gi.require_version("Notify", "0.7")
 import gi.repository.Notify as notify
 
+gi.require_version("Pango", "1.0")
+import gi.repository.Pango as pango
+
 gi.require_version("Vte", "2.91")
 import gi.repository.Vte as vte
 
-def return_character(character):
-    return lambda lookup_variable: character
+def format_size(byte_count):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if byte_count < 1024:
+            break
+
+        byte_count /= 1024
+
+    return f"{byte_count:.1f} {unit:s}"
+
+def search_text(expression, first_line_number, text):
+    results         = []
+    line_number     = first_line_number
+    position        = 0
+    last_line_start = -1
+
+    for match in expression.finditer(text):
+        line_start = text.rfind("\n", 0, match.start()) + 1
+
+        # Report every line only once, however many times it matches.
+        if line_start == last_line_start:
+            continue
+
+        line_end = text.find("\n", match.start())
+        if line_end < 0:
+            line_end = len(text)
+
+        line_number     += text.count("\n", position, line_start)
+        position         = line_start
+        last_line_start  = line_start
+        results.append((line_number, text[line_start:line_end]))
+
+    return reversed(results)
+
+TRIGRAM_FILTER_BITS = 65536
+
+def get_trigram_bits(text):
+    # Trigrams are folded so that one filter serves searches with and without case sensitivity.
+    text = text.casefold()
+    return {hash(trigram) % TRIGRAM_FILTER_BITS for trigram in set(zip(text, text[1:], text[2:]))}
+
+def get_trigram_filter(text):
+    trigram_filter = bytearray(TRIGRAM_FILTER_BITS // 8)
+
+    for bit in get_trigram_bits(text):
+        trigram_filter[bit >> 3] |= 1 << (bit & 7)
+
+    return bytes(trigram_filter)
+
+def search_scrollback(expression, snapshot, literal=None):
+    # The results are produced a block at a time, so that a search that is no longer wanted can stop in between.
+    blocks, open_block_first_line_number, open_block_text = snapshot
+
+    yield search_text(expression, open_block_first_line_number, open_block_text)
+
+    # Sealed blocks get a filter of the trigrams in their text when they are first searched. A literal query skips
+    # the blocks that lack one of its trigrams without decompressing them; other queries search every block.
+    query_bits = get_trigram_bits(literal) if literal is not None and len(literal) >= 3 else None
+
+    for first_line_number, compressed_text, trigram_filter in reversed(blocks):
+        if query_bits is not None and trigram_filter[0] is not None and not all(trigram_filter[0][bit >> 3] & 1 << (bit & 7) for bit in query_bits):
+            yield ()
+            continue
+
+        text = zlib.decompress(compressed_text).decode()
+
+        if trigram_filter[0] is None:
+            trigram_filter[0] = get_trigram_filter(text)
+
+        yield search_text(expression, first_line_number, text)
+
+SSH_OPTIONS_WITH_ARGUMENT = "BbcDEeFIiJLlmOoPpQRSWw"
+
+def get_ssh_destination(command, wrapper=False):
+    # Commands either run ssh itself or, when their entry says so, a wrapper such as ssh_loop.sh that passes its
+    # arguments on to ssh. The arguments of anything else, like git@github.com:x/y, are no ssh destinations.
+    if not command or not (wrapper or os.path.basename(command[0]) == "ssh"):
+        return None
+
+    options   = []
+    arguments = iter(command[1:])
+
+    for argument in arguments:
+        if argument.startswith("-") and len(argument) > 1 and argument != "--":
+            options.append(argument)
+
+            for index, option in enumerate(argument[1:], 2):
+                if option in SSH_OPTIONS_WITH_ARGUMENT:
+                    if index == len(argument):
+                        options.append(next(arguments, ""))
+
+                    break
+        elif argument != "--":
+            return tuple(options), argument
+
+    return None
+
+def get_remote_host(ssh_destination):
+    if ssh_destination is None:
+        return ""
+
+    destination = ssh_destination[1]
+
+    if destination.startswith("ssh://"):
+        destination = destination[len("ssh://"):].rstrip("/")
 
-def get_variable(name):
-    return lambda lookup_variable: lookup_variable(name)
+        if destination.rfind(":") > destination.rfind("]"):
+            destination = destination[:destination.rfind(":")]
+
+    return destination.rsplit("@", 1)[-1].strip("[]")
+
+def remove_path_directory(search_path, directory):
+    return os.pathsep.join(entry for entry in search_path.split(os.pathsep) if os.path.realpath(entry) != os.path.realpath(directory))
+
+def get_git_branch(working_dir):
+    try:
+        result = subprocess.run(["git", "-C", working_dir, "rev-parse", "--abbrev-ref", "HEAD"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+
+    return result.stdout.strip() if result.returncode == 0 else ""
+
+class Profiler:
+    __LATENCY_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+    def __init__(self):
+        self.__handlers          = {}
+        self.__probe_interval    = None
+        self.__probe_time        = None
+        self.__latency_count     = 0
+        self.__latency_total     = 0.0
+        self.__latency_maximum   = 0.0
+        self.__latency_histogram = [0] * (len(self.__LATENCY_BUCKETS) + 1)
+
+    def instrument(self, cls):
+        # Callbacks follow the __handle_ naming convention, so a class can be instrumented as a whole. They all run on
+        # the main loop, which is why the statistics need no locking.
+        prefix = f"_{cls.__name__:s}__handle_"
+
+        for attribute_name, function in list(vars(cls).items()):
+            if attribute_name.startswith(prefix) and callable(function):
+                setattr(cls, attribute_name, self.__wrap(f"{cls.__name__:s}.{attribute_name[len(prefix) - len('handle_'):]:s}", function))
+
+        return cls
+
+    def start_latency_probe(self, interval):
+        self.__probe_interval = interval
+        self.__probe_time     = time.monotonic()
+        glib.timeout_add(int(interval * 1000), self.__handle_probe_timeout_expiry)
+
+    def reset(self):
+        self.__handlers.clear()
+        self.__latency_count     = 0
+        self.__latency_total     = 0.0
+        self.__latency_maximum   = 0.0
+        self.__latency_histogram = [0] * (len(self.__LATENCY_BUCKETS) + 1)
+
+    def get_report(self):
+        handlers = {}
+
+        for name, (call_count, total_time, maximum_time) in sorted(self.__handlers.items(), key=lambda item: -item[1][1]):
+            handlers[name] = {
+                "calls":    call_count,
+                "total_ms": total_time * 1000,
+                "mean_ms":  total_time * 1000 / call_count,
+                "max_ms":   maximum_time * 1000}
+
+        histogram = {f"<{bound:d}ms": count for bound, count in zip(self.__LATENCY_BUCKETS, self.__latency_histogram)}
+        histogram[f">={self.__LATENCY_BUCKETS[-1]:d}ms"] = self.__latency_histogram[-1]
+
+        return {
+            "main_loop": {
+                "probe_interval_ms": (self.__probe_interval or 0) * 1000,
+                "samples":           self.__latency_count,
+                "mean_latency_ms":   self.__latency_total * 1000 / self.__latency_count if self.__latency_count else 0.0,
+                "max_latency_ms":    self.__latency_maximum * 1000,
+                "histogram":         histogram},
+            "handlers": handlers}
+
+    def __wrap(self, name, function):
+        @functools.wraps(function)
+        def wrapper(*arguments, **keyword_arguments):
+            start_time = time.perf_counter()
+
+            try:
+                return function(*arguments, **keyword_arguments)
+            finally:
+                elapsed    = time.perf_counter() - start_time
+                statistics = self.__handlers.get(name)
+
+                if statistics is None:
+                    self.__handlers[name] = [1, elapsed, elapsed]
+                else:
+                    statistics[0] += 1
+                    statistics[1] += elapsed
+
+                    if elapsed > statistics[2]:
+                        statistics[2] = elapsed
+
+        return wrapper
+
+    def __handle_probe_timeout_expiry(self):
+        # The probe is due every interval, so whatever it arrives late was spent blocking the main loop.
+        now     = time.monotonic()
+        latency = max(0.0, now - self.__probe_time - self.__probe_interval)
+        self.__probe_time = now
+
+        self.__latency_count += 1
+        self.__latency_total += latency
+        self.__latency_maximum = max(self.__latency_maximum, latency)
+        self.__latency_histogram[bisect.bisect_right(self.__LATENCY_BUCKETS, latency * 1000)] += 1
+        return True
+
+PROFILER = Profiler()
+
+def write_diagnostics(path, report):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, "w") as diagnostics_file:
+            json.dump(report, diagnostics_file, indent=4)
+    except OSError as exception:
+        print(f"Failed to write diagnostics to '{path:s}': {exception}", file=sys.stderr)
+
+class SnippetTemplate:
+    def __init__(self):
+        self.__parts     = []
+        self.__variables = []
+
+    def get_variables(self):
+        return self.__variables
+
+    def append_text(self, text):
+        # Adjacent text is merged into a single pre-encoded part.
+        if self.__parts and isinstance(self.__parts[-1], bytes):
+            self.__parts[-1] += text.encode()
+        else:
+            self.__parts.append(text.encode())
+
+    def append_variable(self, name):
+        self.__parts.append(name)
+
+        if name not in self.__variables:
+            self.__variables.append(name)
+
+    def render(self, values):
+        return b"".join(part if isinstance(part, bytes) else values.get(part, "").encode() for part in self.__parts)
 
 def compile_snippet(snippet):
     ESCAPE_CHARS = {
@@ -52,7 +315,7 @@ def compile_snippet(snippet):
         "'":  "'",
         "\"": "\""}
 
-    result = []
+    result = SnippetTemplate()
 
     try:
         iterator = enumerate(snippet)
@@ -70,14 +333,14 @@ def compile_snippet(snippet):
                         if not 0 <= control_character < 0x20:
                             raise Exception(f"invalid control character '{character:s}' at position {position:d} of snippet '{snippet:s}'")
 
-                        result.append(return_character(chr(control_character)))
+                        result.append_text(chr(control_character))
                     else:
                         escape_char = ESCAPE_CHARS.get(character)
 
                         if escape_char is None:
                             raise Exception(f"invalid escape character '{character:s}' at position {position:d} of snippet '{snippet:s}'")
 
-                        result.append(return_character(escape_char))
+                        result.append_text(escape_char)
                 except StopIteration:
                     raise Exception(f"unexpected end of snippet '{snippet:s}'")
 
@@ -102,7 +365,7 @@ def compile_snippet(snippet):
                             if character != "}":
                                 raise Exception(f"unexpected character '{character:s}' at position {position:d} of snippet '{snippet:s}'")
 
-                            result.append(get_variable(name))
+                            result.append_variable(name)
                         except StopIteration:
                             raise Exception(f"unexpected end of snippet '{snippet:s}'")
 
@@ -119,220 +382,3465 @@ def compile_snippet(snippet):
                             break
                         finally:
                             # Append the variable to the result regardless of whether the end of the input has been reached or not.
-                            result.append(get_variable(name))
+                            result.append_variable(name)
                     else:
                         raise Exception(f"unexpected character '{character:s}' at position {position:d} of snippet '{snippet:s}'")
                 except StopIteration:
                     raise Exception(f"unexpected end of snippet '{snippet:s}'")
             else:
-                result.append(return_character(character))
+                result.append_text(character)
                 position, character = next(iterator)
     except StopIteration:
         pass
 
-    return tuple(result)
+    return result
 
-class Terminal(gtk.ScrolledWindow):
-    __NOTIFICATION_TRIGGER_TIME = 4000
-    __COLOR_PALETTE = (
-        gdk.RGBA(0.00, 0.00, 0.00), # Black
-        gdk.RGBA(0.80, 0.19, 0.19), # Red
-        gdk.RGBA(0.05, 0.74, 0.47), # Green
-        gdk.RGBA(0.90, 0.90, 0.06), # Yellow
-        gdk.RGBA(0.14, 0.45, 0.78), # Blue
-        gdk.RGBA(0.74, 0.25, 0.74), # Magenta
-        gdk.RGBA(0.07, 0.66, 0.80), # Cyan
-        gdk.RGBA(0.90, 0.90, 0.90), # White
-        gdk.RGBA(0.40, 0.40, 0.40), # Bright Black (Gray)
-        gdk.RGBA(0.95, 0.30, 0.30), # Bright Red
-        gdk.RGBA(0.14, 0.82, 0.55), # Bright Green
-        gdk.RGBA(0.96, 0.96, 0.26), # Bright Yellow
-        gdk.RGBA(0.23, 0.56, 0.92), # Bright Blue
-        gdk.RGBA(0.84, 0.44, 0.84), # Bright Magenta
-        gdk.RGBA(0.16, 0.72, 0.86), # Bright Cyan
-        gdk.RGBA(0.90, 0.90, 0.90)) # Bright White
-        #gdk.RGBA(0.20, 0.20, 0.20), # Black
-        #gdk.RGBA(0.80, 0.00, 0.00), # Red
-        #gdk.RGBA(0.00, 0.80, 0.00), # Green
-        #gdk.RGBA(0.80, 0.80, 0.00), # Yellow
-        #gdk.RGBA(0.00, 0.00, 0.93), # Blue
-        #gdk.RGBA(0.80, 0.00, 0.80), # Magenta
-        #gdk.RGBA(0.00, 0.80, 0.80), # Cyan
-        #gdk.RGBA(0.90, 0.90, 0.90), # White
-        #gdk.RGBA(0.50, 0.50, 0.50), # Bright Black (Gray)
-        #gdk.RGBA(1.00, 0.00, 0.00), # Bright Red
-        #gdk.RGBA(0.00, 1.00, 0.00), # Bright Green
-        #gdk.RGBA(1.00, 1.00, 0.00), # Bright Yellow
-        #gdk.RGBA(0.36, 0.36, 1.00), # Bright Blue
-        #gdk.RGBA(1.00, 0.00, 1.00), # Bright Magenta
-        #gdk.RGBA(0.00, 1.00, 1.00), # Bright Cyan
-        #gdk.RGBA(1.00, 1.00, 1.00)) # Bright White
+@PROFILER.instrument
+class VariableProviders:
+    __RESOLVE_TIMEOUT = 1000
 
-    __gsignals__ = {
-        "changed": (gobject.SignalFlags.RUN_LAST, gobject.TYPE_NONE, ()),
-        "duplicated": (gobject.SignalFlags.RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_STRING, gobject.TYPE_BOOLEAN, gobject.TYPE_STRING, gobject.TYPE_PYOBJECT, gobject.TYPE_STRING)),
-        "closed": (gobject.SignalFlags.RUN_LAST, gobject.TYPE_NONE, ())}
+    def __init__(self):
+        self.__providers  = {}
+        self.__cache      = {}
+        self.__refreshing = set()
+        self.__requests   = []
+        self.__executor   = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="Variable provider")
 
-    def __init__(self, window, icons, snippets, title, notifications_enabled, icon_name, command, working_dir):
-        super(Terminal, self).__init__()
+    def register(self, name, function, key_variable, time_to_live):
+        # The value of the variable is cached per value of the key variable, e.g. per working directory.
+        self.__providers[name] = (function, key_variable, time_to_live)
 
-        self.__window                = window
-        self.__icons                 = icons
-        self.__snippets              = snippets
-        self.__title                 = title
-        self.__icon_name             = icon_name
-        self.__command               = command
-        self.__initial_working_dir   = os.path.expanduser(working_dir)
-        self.__notifications_enabled = notifications_enabled
-        self.__notification_timeout  = None
-        self.__stored_password       = None
+    def prefetch(self, context):
+        for name in self.__providers:
+            self.__get_value(name, context)
 
-        self.__notification = notify.Notification.new("SHOULD HAVE BEEN UPDATED", "SHOULD HAVE BEEN UPDATED", "dialog-error")
+    def resolve(self, names, context, callback, *arguments):
+        values  = {}
+        missing = set()
 
-        self.__properties_item = gtk.MenuItem.new_with_label("Properties")
-        self.__properties_item.connect("activate", self.__handle_properties_item_activated)
-        self.__properties_item.show()
+        for name in names:
+            if name in context:
+                values[name] = context[name]
+            elif name in self.__providers:
+                value = self.__get_value(name, context)
 
-        self.__duplicate_item = gtk.MenuItem.new_with_label("Duplicate")
-        self.__duplicate_item.connect("activate", self.__handle_duplicate_item_activated)
-        self.__duplicate_item.show()
+                if value is None:
+                    missing.add(self.__get_cache_key(name, context))
+                else:
+                    values[name] = value
 
-        self.__close_item = gtk.ImageMenuItem.new_from_stock(gtk.STOCK_CLOSE)
-        self.__close_item.connect("activate", self.__handle_close_item_activated)
-        self.__close_item.show()
+        if not missing:
+            callback(values, *arguments)
+            return
 
-        self.__tab_label_menu = gtk.Menu()
-        self.__tab_label_menu.append(self.__properties_item)
-        self.__tab_label_menu.append(self.__duplicate_item)
-        self.__tab_label_menu.append(self.__close_item)
+        # Variables that have never been evaluated for this context are waited for, but not indefinitely.
+        request = (values, missing, callback, arguments)
+        self.__requests.append(request)
+        glib.timeout_add(self.__RESOLVE_TIMEOUT, self.__complete_request, request)
 
-        self.__tab_icon = gtk.Image.new_from_pixbuf(self.__icons[self.__icon_name])
-        self.__tab_icon.show()
+    def __get_cache_key(self, name, context):
+        function, key_variable, time_to_live = self.__providers[name]
+        return name, context.get(key_variable, "")
 
-        self.__tab_title = gtk.Label.new(self.__title)
-        self.__tab_title.show()
+    def __get_value(self, name, context):
+        cache_key = self.__get_cache_key(name, context)
+        value, expiry_time = self.__cache.get(cache_key, (None, 0.0))
 
-        tab_layout = gtk.Box.new(gtk.Orientation.HORIZONTAL, 4)
-        tab_layout.pack_start(self.__tab_icon, False, True, 0)
-        tab_layout.pack_start(self.__tab_title, True, True, 0)
-        tab_layout.show()
+        # Stale values are still used while they are being refreshed in the background.
+        if expiry_time <= time.monotonic() and cache_key not in self.__refreshing:
+            self.__refreshing.add(cache_key)
+            self.__executor.submit(self.__run_provider, cache_key)
 
-        self.__tab_label = gtk.EventBox.new()
-        self.__tab_label.add(tab_layout)
-        self.__tab_label.connect("button-press-event", self.__handle_tab_label_button_press)
-        self.__tab_label.show()
+        return value
 
-        self.__copy_item = gtk.MenuItem.new_with_label("Copy")
-        self.__copy_item.connect("activate", self.__handle_copy_item_activated)
-        self.__copy_item.show()
+    def __run_provider(self, cache_key):
+        name, key = cache_key
+        function, key_variable, time_to_live = self.__providers[name]
 
-        self.__paste_item = gtk.MenuItem.new_with_label("Paste")
-        self.__paste_item.connect("activate", self.__handle_paste_item_activated)
-        self.__paste_item.show()
+        try:
+            value = function(key)
+        except Exception:
+            value = ""
 
-        self.__copy_and_paste_item = gtk.MenuItem.new_with_label("Copy and paste")
-        self.__copy_and_paste_item.connect("activate", self.__handle_copy_and_paste_item_activated)
-        self.__copy_and_paste_item.show()
+        glib.idle_add(self.__handle_provider_finished, cache_key, value, time_to_live)
 
-        self.__insert_password_item = gtk.MenuItem.new_with_label("Insert password")
-        self.__insert_password_item.connect("activate", self.__handle_insert_password_item_activated)
-        self.__insert_password_item.show()
+    def __handle_provider_finished(self, cache_key, value, time_to_live):
+        self.__refreshing.discard(cache_key)
+        self.__cache[cache_key] = (value, time.monotonic() + time_to_live)
 
-        self.__terminal_menu = gtk.Menu.new()
-        self.__terminal_menu.append(self.__copy_item)
-        self.__terminal_menu.append(self.__paste_item)
-        self.__terminal_menu.append(self.__copy_and_paste_item)
-        self.__terminal_menu.append(self.__insert_password_item)
+        for request in list(self.__requests):
+            values, missing, callback, arguments = request
 
-        self.__terminal = vte.Terminal()
-        self.__terminal.set_events(gdk.EventMask.KEY_PRESS_MASK | gdk.EventMask.BUTTON_PRESS_MASK)
-        self.__terminal.set_audible_bell(True)
-        self.__terminal.set_allow_bold(True)
-        self.__terminal.set_scroll_on_output(False)
-        self.__terminal.set_scroll_on_keystroke(True)
-        self.__terminal.set_rewrap_on_resize(True)
-        self.__terminal.set_colors(gdk.RGBA(0.75, 0.75, 0.75), gdk.RGBA(0, 0, 0), self.__COLOR_PALETTE) # Do this before configuring the cursor's color
-        self.__terminal.set_cursor_shape(vte.CursorShape.BLOCK)
-        self.__terminal.set_cursor_blink_mode(vte.CursorBlinkMode.ON)
-        self.__terminal.set_color_cursor(gdk.RGBA(1, 0, 0))
-        self.__terminal.set_color_highlight(gdk.RGBA(0, 0, 1))
-        self.__terminal.set_color_highlight_foreground(gdk.RGBA(1, 1, 1))
-        self.__terminal.set_scrollback_lines(-1)
-        self.__terminal.connect("child-exited", self.__handle_terminal_child_exited)
-        self.__terminal.connect("key-press-event", self.__handle_terminal_key_press_event)
-        self.__terminal.connect("contents-changed", self.__handle_terminal_contents_changed)
-        self.__terminal.connect("selection-changed", self.__handle_terminal_selection_changed)
-        self.__terminal.connect("button-press-event", self.__handle_terminal_button_press)
-        self.__terminal.connect("current-directory-uri-changed", self.__handle_terminal_directory_changed)
-        self.__terminal.show()
+            if cache_key in missing:
+                values[cache_key[0]] = value
+                missing.discard(cache_key)
 
-        self.__password_entry = gtk.Entry.new()
-        self.__password_entry.set_visibility(False)
-        self.__password_entry.connect("activate", self.__handle_password_entry_activated)
-        self.__password_entry.show()
+                if not missing:
+                    self.__complete_request(request)
 
-        self.__password_dialog = gtk.Dialog(
-            "Password",
-            self.__window,
-            gtk.DialogFlags.MODAL | gtk.DialogFlags.DESTROY_WITH_PARENT,
-            (gtk.STOCK_CANCEL, gtk.ResponseType.CANCEL, gtk.STOCK_OK, gtk.ResponseType.OK))
-        self.__password_dialog.get_content_area().pack_start(self.__password_entry, True, True, 0)
+        return False
+
+    def __complete_request(self, request):
+        if request in self.__requests:
+            self.__requests.remove(request)
+            values, missing, callback, arguments = request
+            callback(values, *arguments)
+
+        return False
+
+class IconRegistry:
+    __CACHE_HEADER = struct.Struct("<qiiiii?")
+
+    def __init__(self, directory, cache_directory, size):
+        self.__cache_directory = cache_directory
+        self.__size            = size
+        self.__paths           = {os.path.splitext(icon_file.name)[0]: icon_file.path for icon_file in os.scandir(directory)}
+        self.__icons           = {}
+        self.__model           = None
+
+    def get(self, name):
+        icon = self.__icons.get(name)
+
+        if icon is None:
+            path = self.__paths.get(name)
+
+            if path is None:
+                return None
+
+            icon = self.__load_icon(path)
+            self.__icons[name] = icon
+
+        return icon
+
+    def get_model(self):
+        # The model is shared by all icon pickers, so the icons only have to be loaded the first time it is requested.
+        if self.__model is None:
+            self.__model = gtk.ListStore(str, pixbuf.Pixbuf)
+
+            for name in sorted(self.__paths):
+                self.__model.append((name, self.get(name)))
+
+        return self.__model
+
+    def update(self, path):
+        name = os.path.splitext(os.path.basename(path))[0]
+
+        if os.path.isfile(path):
+            self.__paths[name] = path
+        elif self.__paths.get(name) == path:
+            del self.__paths[name]
+        else:
+            return None
+
+        self.__icons.pop(name, None)
+
+        # Icon pickers that are open keep showing the shared model, so it is patched rather than rebuilt.
+        if self.__model is not None:
+            position = 0
+
+            for row in self.__model:
+                if row[0] >= name:
+                    break
+
+                position += 1
+
+            row_exists = position < len(self.__model) and self.__model[position][0] == name
+
+            if name not in self.__paths:
+                if row_exists:
+                    del self.__model[position]
+            elif row_exists:
+                self.__model[position][1] = self.get(name)
+            else:
+                self.__model.insert(position, (name, self.get(name)))
+
+        return name
+
+    def __get_cache_path(self, path):
+        return os.path.join(self.__cache_directory, f"{hashlib.sha1(path.encode()).hexdigest():s}-{self.__size:d}.bin")
+
+    def __load_icon(self, path):
+        modification_time = os.stat(path).st_mtime_ns
+        cache_path        = self.__get_cache_path(path)
+
+        try:
+            with open(cache_path, "rb") as cache_file:
+                cached_modification_time, width, height, rowstride, bits_per_sample, has_alpha = self.__CACHE_HEADER.unpack(cache_file.read(self.__CACHE_HEADER.size))
+
+                if cached_modification_time == modification_time:
+                    return pixbuf.Pixbuf.new_from_bytes(glib.Bytes.new(cache_file.read()), pixbuf.Colorspace.RGB, has_alpha, bits_per_sample, width, height, rowstride)
+        except (OSError, struct.error):
+            pass
+
+        icon = pixbuf.Pixbuf.new_from_file_at_scale(path, self.__size, self.__size, True)
+
+        try:
+            os.makedirs(self.__cache_directory, exist_ok=True)
+
+            with open(f"{cache_path:s}.tmp", "wb") as cache_file:
+                cache_file.write(self.__CACHE_HEADER.pack(modification_time, icon.get_width(), icon.get_height(), icon.get_rowstride(), icon.get_bits_per_sample(), icon.get_has_alpha()))
+                cache_file.write(icon.get_pixels())
+
+            os.replace(f"{cache_path:s}.tmp", cache_path)
+        except OSError:
+            pass
+
+        return icon
+
+@PROFILER.instrument
+class FileWatcher:
+    __IGNORED_EVENTS = (gio.FileMonitorEvent.ATTRIBUTE_CHANGED, gio.FileMonitorEvent.PRE_UNMOUNT, gio.FileMonitorEvent.UNMOUNTED)
+
+    def __init__(self, path, debounce_time, changed_callback):
+        self.__debounce_time    = debounce_time
+        self.__changed_callback = changed_callback
+        self.__changed_paths    = set()
+        self.__debounce_source  = None
+
+        monitored_file = gio.File.new_for_path(path)
+
+        if os.path.isdir(path):
+            self.__monitor = monitored_file.monitor_directory(gio.FileMonitorFlags.NONE, None)
+        else:
+            self.__monitor = monitored_file.monitor_file(gio.FileMonitorFlags.NONE, None)
+
+        self.__monitor.connect("changed", self.__handle_monitor_changed)
+
+    def __handle_monitor_changed(self, monitor, changed_file, other_file, event_type):
+        assert self.__monitor is monitor
+
+        if event_type in self.__IGNORED_EVENTS:
+            return
+
+        self.__changed_paths.add(changed_file.get_path())
+
+        if other_file is not None:
+            self.__changed_paths.add(other_file.get_path())
+
+        # Editors save through a burst of writes, renames and deletions, which are reported once they have settled.
+        if self.__debounce_source is not None:
+            glib.source_remove(self.__debounce_source)
+
+        self.__debounce_source = glib.timeout_add(int(self.__debounce_time * 1000), self.__handle_debounce_timeout_expiry)
+
+    def __handle_debounce_timeout_expiry(self):
+        assert self.__debounce_source is not None
+        self.__debounce_source = None
+
+        changed_paths = self.__changed_paths
+        self.__changed_paths = set()
+        self.__changed_callback(changed_paths)
+        return False
+
+@PROFILER.instrument
+class SessionStore:
+    def __init__(self, path, flush_interval, collect_rows):
+        self.__path           = path
+        self.__flush_interval = flush_interval
+        self.__collect_rows   = collect_rows
+        self.__flush_timeout  = None
+        self.__pending_rows   = None
+        self.__writing        = False
+        self.__condition      = threading.Condition()
+
+        self.__writer = threading.Thread(target=self.__run_writer, name="Session store", daemon=True)
+        self.__writer.start()
+
+    def load(self):
+        try:
+            with open(self.__path, newline="") as session_file:
+                return list(csv.reader(session_file))
+        except FileNotFoundError:
+            return []
+
+    def mark_dirty(self):
+        # Changes that arrive while a flush is scheduled are picked up by that flush.
+        if self.__flush_timeout is None:
+            self.__flush_timeout = glib.timeout_add(int(self.__flush_interval * 1000), self.__handle_flush_timeout_expiry)
+
+    def flush(self):
+        if self.__flush_timeout is not None:
+            glib.source_remove(self.__flush_timeout)
+            self.__flush_timeout = None
+
+        self.__queue_rows(self.__collect_rows())
+
+        with self.__condition:
+            while self.__pending_rows is not None or self.__writing:
+                self.__condition.wait()
+
+    def __handle_flush_timeout_expiry(self):
+        assert self.__flush_timeout is not None
+        self.__flush_timeout = None
+        self.__queue_rows(self.__collect_rows())
+        return False
+
+    def __queue_rows(self, rows):
+        with self.__condition:
+            self.__pending_rows = rows
+            self.__condition.notify_all()
+
+    def __run_writer(self):
+        while True:
+            with self.__condition:
+                while self.__pending_rows is None:
+                    self.__condition.wait()
+
+                rows = self.__pending_rows
+                self.__pending_rows = None
+                self.__writing = True
+
+            try:
+                self.__write_rows(rows)
+            except OSError as exception:
+                print(f"Failed to save tabs to '{self.__path:s}': {exception}", file=sys.stderr)
+            finally:
+                with self.__condition:
+                    self.__writing = False
+                    self.__condition.notify_all()
+
+    def __write_rows(self, rows):
+        temporary_path = f"{self.__path:s}.tmp"
+
+        with open(temporary_path, "w", newline="") as session_file:
+            csv.writer(session_file).writerows(rows)
+            session_file.flush()
+            os.fsync(session_file.fileno())
+
+        # Replacing the file atomically ensures that a crash never leaves a partially written session behind.
+        os.replace(temporary_path, self.__path)
+
+class SnapshotStore:
+    # Compressing and writing the scrollback of many tabs takes a while, so it happens on a writer thread while the
+    # main loop only dumps the contents of the widgets. Reading a snapshot first waits for what is queued for it.
+    def __init__(self, directory, maximum_size):
+        self.__directory    = directory
+        self.__maximum_size = maximum_size
+        self.__queue        = queue.SimpleQueue()
+        self.__pending   = collections.Counter()
+        self.__condition = threading.Condition()
+
+        self.__writer = threading.Thread(target=self.__run_writer, name="Snapshot store", daemon=True)
+        self.__writer.start()
+
+    def get_path(self, tab_id):
+        return os.path.join(self.__directory, f"{tab_id:s}.gz")
+
+    def exists(self, tab_id):
+        self.wait(tab_id)
+        return os.path.exists(self.get_path(tab_id))
+
+    def open(self, tab_id):
+        self.wait(tab_id)
+        return gzip.open(self.get_path(tab_id), "rb")
+
+    def write(self, tab_id, contents):
+        self.__submit(tab_id, self.__write, contents)
+
+    def append(self, tab_id, chunks, maximum_lines):
+        self.__submit(tab_id, self.__append, chunks, maximum_lines)
+
+    def remove(self, tab_id):
+        self.__submit(tab_id, self.__remove)
+
+    def wait(self, tab_id=None):
+        with self.__condition:
+            while self.__pending[tab_id] if tab_id is not None else self.__pending:
+                self.__condition.wait()
+
+    def __submit(self, tab_id, function, *arguments):
+        with self.__condition:
+            self.__pending[tab_id] += 1
+
+        self.__queue.put((tab_id, function, arguments))
+
+    def __run_writer(self):
+        while True:
+            tab_id, function, arguments = self.__queue.get()
+
+            try:
+                function(self.get_path(tab_id), *arguments)
+            except (OSError, EOFError) as exception:
+                print(f"Failed to save the scrollback of tab {tab_id:s}: {exception}", file=sys.stderr)
+            finally:
+                with self.__condition:
+                    self.__pending[tab_id] -= 1
+
+                    if not self.__pending[tab_id]:
+                        del self.__pending[tab_id]
+
+                    self.__condition.notify_all()
+
+    def __write(self, path, contents):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = path + ".tmp"
+
+        with gzip.open(temporary_path, "wb", compresslevel=1) as snapshot:
+            snapshot.write(contents)
+
+        os.replace(temporary_path, path)
+
+    def __append(self, path, chunks, maximum_lines):
+        # Output of a hibernated tab is added to its snapshot as another gzip member, which reads back as one stream.
+        with gzip.open(path, "ab", compresslevel=1) as snapshot:
+            for data in chunks:
+                snapshot.write(data)
+
+        if os.path.getsize(path) > self.__maximum_size:
+            self.__trim(path, maximum_lines)
+
+    def __trim(self, path, maximum_lines):
+        # A hidden tab that keeps producing output would grow its snapshot forever, so it is cut back to the last lines
+        # that the restored widget could hold anyway, and to at most the size limit before compression.
+        lines = collections.deque()
+        size  = 0
+
+        with gzip.open(path, "rb") as snapshot:
+            for line in snapshot:
+                lines.append(line)
+                size += len(line)
+
+                while len(lines) > 1 and (size > self.__maximum_size or (maximum_lines is not None and len(lines) > maximum_lines)):
+                    size -= len(lines.popleft())
+
+        # The cut may fall in the middle of colored output.
+        lines.appendleft(b"\x1B[0m")
+        self.__write(path, b"".join(lines))
+
+    def __remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+class Activity:
+    IDLE   = 0
+    ACTIVE = 1
+    QUIET  = 2
+
+    __RATE_SMOOTHING = 0.5
+
+    def __init__(self, state_changed_callback, flood_changed_callback):
+        self.__state_changed_callback  = state_changed_callback
+        self.__flood_changed_callback  = flood_changed_callback
+        self.__byte_count              = 0
+        self.__acknowledged_byte_count = 0
+        self.__previous_byte_count     = 0
+        self.__last_output_time        = 0.0
+        self.__rate                    = 0.0
+        self.__state                   = self.IDLE
+        self.__flooding                = False
+        self.watched                   = False
+        self.flood_threshold           = None
+
+    def get_byte_count(self):
+        return self.__byte_count
+
+    def get_rate(self):
+        return self.__rate
+
+    def get_state(self):
+        return self.__state
+
+    def is_flooding(self):
+        return self.__flooding
+
+    def record(self, byte_count):
+        self.__byte_count       += byte_count
+        self.__last_output_time  = time.monotonic()
+
+    def reset(self):
+        self.__state                   = self.IDLE
+        self.__acknowledged_byte_count = self.__byte_count
+
+    def update(self, now, elapsed, quiet_time):
+        self.__rate = self.__RATE_SMOOTHING * self.__rate + (1 - self.__RATE_SMOOTHING) * (self.__byte_count - self.__previous_byte_count) / elapsed
+        self.__previous_byte_count = self.__byte_count
+
+        # Flooding only ends well below the rate it started at, so a tab hovering around the threshold does not flap.
+        if self.flood_threshold is None:
+            flooding = False
+        elif self.__flooding:
+            flooding = self.__rate >= self.flood_threshold / 2
+        else:
+            flooding = self.__rate > self.flood_threshold
+
+        if flooding != self.__flooding:
+            self.__flooding = flooding
+            self.__flood_changed_callback(self)
+
+        # Output that was produced while the tab was shown, or while nobody asked to be told, is not news later on.
+        if not self.watched:
+            self.__acknowledged_byte_count = self.__byte_count
+            return
+
+        # Only transitions are reported, so tabs that keep producing output cost nothing beyond the counters.
+        if self.__byte_count != self.__acknowledged_byte_count:
+            self.__acknowledged_byte_count = self.__byte_count
+
+            if self.__state != self.ACTIVE:
+                self.__state = self.ACTIVE
+                self.__state_changed_callback(self)
+        elif self.__state == self.ACTIVE and now - self.__last_output_time >= quiet_time:
+            self.__state = self.QUIET
+            self.__state_changed_callback(self)
+
+@PROFILER.instrument
+class ActivityMonitor:
+    def __init__(self, tick_interval, quiet_time):
+        self.__quiet_time     = quiet_time
+        self.__activities     = set()
+        self.__last_tick_time = time.monotonic()
+
+        glib.timeout_add(int(tick_interval * 1000), self.__handle_tick)
+
+    def register(self, state_changed_callback, flood_changed_callback):
+        activity = Activity(state_changed_callback, flood_changed_callback)
+        self.__activities.add(activity)
+        return activity
+
+    def unregister(self, activity):
+        self.__activities.discard(activity)
+
+    def __handle_tick(self):
+        now     = time.monotonic()
+        elapsed = now - self.__last_tick_time
+        self.__last_tick_time = now
+
+        # A single tick drives all tabs instead of every tab rescheduling its own timer on each change.
+        for activity in list(self.__activities):
+            activity.update(now, elapsed, self.__quiet_time)
+
+        return True
+
+@PROFILER.instrument
+class NotificationDispatcher:
+    PRIORITIES = {"low": notify.Urgency.LOW, "normal": notify.Urgency.NORMAL, "critical": notify.Urgency.CRITICAL}
+
+    __MAXIMUM_ACTIONS = 3
+
+    def __init__(self, batch_window, minimum_interval, activate_callback):
+        self.__batch_window      = batch_window
+        self.__minimum_interval  = minimum_interval
+        self.__activate_callback = activate_callback
+        self.__pending           = {}
+        self.__shown             = []
+        self.__last_shown_time   = -minimum_interval
+        self.__batch_source      = None
+
+        # A single notification is updated in place, so a burst of tabs never stacks up notifications.
+        self.__notification = notify.Notification.new("", "", "dialog-information")
+        self.__notification.connect("closed", self.__handle_notification_closed)
+
+    def notify(self, terminal, title, priority, message=None):
+        self.__pending[terminal] = (title, priority, message)
+
+        if self.__batch_source is None:
+            self.__batch_source = glib.timeout_add(int(self.__batch_window * 1000), self.__handle_batch_timeout_expiry)
+
+    def withdraw(self, terminal):
+        self.__pending.pop(terminal, None)
+
+        if any(shown_terminal is terminal for shown_terminal, title, priority, message in self.__shown):
+            self.__shown = [(shown_terminal, title, priority, message) for shown_terminal, title, priority, message in self.__shown if shown_terminal is not terminal]
+
+            if not self.__shown:
+                try:
+                    self.__notification.close()
+                except glib.Error:
+                    pass
+
+    def __show(self):
+        # The tabs of the previous notification that have not been looked at yet are folded into this one.
+        tabs = {terminal: (title, priority, message) for terminal, title, priority, message in self.__shown}
+        tabs.update(self.__pending)
+        self.__pending.clear()
+
+        self.__shown = sorted(((terminal, title, priority, message) for terminal, (title, priority, message) in tabs.items()), key=lambda tab: -tab[2])
+
+        if len(self.__shown) == 1:
+            summary = self.__shown[0][1]
+            body    = self.__shown[0][3] or f"New input was received in tab '{self.__shown[0][1]:s}'."
+        else:
+            summary = f"New input in {len(self.__shown):d} tabs"
+            body    = "\n".join(title if message is None else f"{title:s}: {message:s}" for terminal, title, priority, message in self.__shown)
+
+        self.__notification.clear_actions()
+        self.__notification.update(summary, body, "dialog-information")
+        self.__notification.set_urgency(self.__shown[0][2])
+        self.__notification.add_action("default", "Show", self.__handle_notification_action, self.__shown[0][0])
+
+        if len(self.__shown) > 1:
+            for terminal, title, priority, message in self.__shown[:self.__MAXIMUM_ACTIONS]:
+                self.__notification.add_action(f"show-{id(terminal):d}", title, self.__handle_notification_action, terminal)
+
+        try:
+            self.__notification.show()
+        except glib.Error as error:
+            print(f"Failed to show notification: {error.message:s}", file=sys.stderr)
+
+        self.__last_shown_time = time.monotonic()
+
+    def __handle_batch_timeout_expiry(self):
+        self.__batch_source = None
+
+        if not self.__pending:
+            return False
+
+        # Tabs going quiet while notifications are rate limited are collected into the next one.
+        delay = self.__last_shown_time + self.__minimum_interval - time.monotonic()
+
+        if delay > 0:
+            self.__batch_source = glib.timeout_add(int(delay * 1000), self.__handle_batch_timeout_expiry)
+            return False
+
+        self.__show()
+        return False
+
+    def __handle_notification_action(self, notification, action, terminal):
+        self.__activate_callback(terminal)
+
+    def __handle_notification_closed(self, notification):
+        self.__shown = []
+
+@PROFILER.instrument
+class ProcessSampler:
+    __PAGE_SIZE   = os.sysconf("SC_PAGE_SIZE")
+    __CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+    def __init__(self, interval):
+        self.__interval  = interval
+        self.__callbacks = {}
+        self.__lock      = threading.Lock()
+
+        self.__sampler = threading.Thread(target=self.__run_sampler, name="Process sampler", daemon=True)
+        self.__sampler.start()
+
+    def add(self, child_pid, callback):
+        with self.__lock:
+            self.__callbacks[child_pid] = callback
+
+    def remove(self, child_pid):
+        with self.__lock:
+            self.__callbacks.pop(child_pid, None)
+
+    def __read_processes(self):
+        processes = {}
+
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit():
+                continue
+
+            try:
+                with open(os.path.join(entry.path, "stat"), "rb") as stat_file:
+                    stat = stat_file.read()
+            except OSError:
+                continue
+
+            # The command name is enclosed in parentheses but may contain any character, including parentheses.
+            name_end = stat.rfind(b")")
+            fields   = stat[name_end + 2:].split()
+            processes[int(entry.name)] = (
+                stat[stat.find(b"(") + 1:name_end].decode(errors="replace"),
+                int(fields[1]), # Parent
+                int(fields[2]), # Process group
+                int(fields[5]), # Foreground process group of the controlling terminal
+                int(fields[11]) + int(fields[12]), # User and system time
+                int(fields[21]) * self.__PAGE_SIZE) # Resident set size
+
+        return processes
+
+    def __run_sampler(self):
+        previous_times = {}
+        previous_time  = time.monotonic()
+
+        while True:
+            time.sleep(self.__interval)
+
+            with self.__lock:
+                child_pids = list(self.__callbacks)
+
+            if not child_pids:
+                previous_times.clear()
+                continue
+
+            # A single walk of /proc serves all tabs, so a tick costs the same however many tabs there are.
+            now       = time.monotonic()
+            elapsed   = now - previous_time
+            processes = self.__read_processes()
+            children  = {}
+            samples   = {}
+            times     = {}
+
+            for pid, (name, parent_pid, process_group, foreground_group, cpu_time, rss) in processes.items():
+                children.setdefault(parent_pid, []).append(pid)
+
+            for child_pid in child_pids:
+                process = processes.get(child_pid)
+
+                if process is None:
+                    continue
+
+                cpu_time  = 0
+                total_rss = 0
+                pending   = [child_pid]
+
+                while pending:
+                    pid = pending.pop()
+                    cpu_time  += processes[pid][4]
+                    total_rss += processes[pid][5]
+                    pending.extend(children.get(pid, ()))
+
+                foreground_group = process[3]
+                foreground_name  = processes[foreground_group][0] if foreground_group in processes else process[0]
+
+                try:
+                    working_dir = os.readlink(f"/proc/{child_pid:d}/cwd")
+                except OSError:
+                    working_dir = None
+
+                cpu_percent        = max(0, cpu_time - previous_times.get(child_pid, cpu_time)) / self.__CLOCK_TICKS / elapsed * 100
+                times[child_pid]   = cpu_time
+                samples[child_pid] = (cpu_percent, total_rss, foreground_name, working_dir)
+
+            previous_times = times
+            previous_time  = now
+            glib.idle_add(self.__handle_samples_ready, samples)
+
+    def __handle_samples_ready(self, samples):
+        for child_pid, sample in samples.items():
+            callback = self.__callbacks.get(child_pid)
+
+            # The tab may have gone away while its sample was taken.
+            if callback is not None:
+                callback(*sample)
+
+        return False
+
+@PROFILER.instrument
+class Broadcaster:
+    SELECTION = "Selection"
+
+    def __init__(self):
+        self.__groups        = {}
+        self.__active_groups = set()
+        self.__pending_input = {}
+        self.__flush_source  = None
+
+    def add(self, terminal, group_names):
+        for group_name in group_names:
+            self.__groups.setdefault(group_name, []).append(terminal)
+
+        self.__update_indicators()
+
+    def remove(self, terminal):
+        for group_name, terminals in list(self.__groups.items()):
+            if terminal in terminals:
+                terminals.remove(terminal)
+
+                if not terminals:
+                    del self.__groups[group_name]
+                    self.__active_groups.discard(group_name)
+
+        self.__pending_input.pop(terminal, None)
+        self.__update_indicators()
+
+    def get_groups(self, terminal):
+        return [(group_name, len(terminals), group_name in self.__active_groups) for group_name, terminals in sorted(self.__groups.items()) if terminal in terminals]
+
+    def is_selected(self, terminal):
+        return terminal in self.__groups.get(self.SELECTION, ())
+
+    def set_selected(self, terminal, selected):
+        if selected and not self.is_selected(terminal):
+            self.add(terminal, (self.SELECTION,))
+        elif not selected and self.is_selected(terminal):
+            self.__groups[self.SELECTION].remove(terminal)
+
+            if not self.__groups[self.SELECTION]:
+                del self.__groups[self.SELECTION]
+                self.__active_groups.discard(self.SELECTION)
+
+            self.__update_indicators()
+
+    def set_active(self, group_name, active):
+        if active and group_name in self.__groups:
+            self.__active_groups.add(group_name)
+        else:
+            self.__active_groups.discard(group_name)
+
+        self.__update_indicators()
+
+    def stop(self, terminal):
+        self.__active_groups.difference_update(group_name for group_name, terminals in self.__groups.items() if terminal in terminals)
+        self.__update_indicators()
+
+    def get_active_groups(self, terminal):
+        return [group_name for group_name in sorted(self.__active_groups) if terminal in self.__groups[group_name]]
+
+    def write(self, source, data):
+        # Keystrokes are collected per target and written once per main loop iteration, so that the cost of typing
+        # into a large group does not grow with every key.
+        for target in self.__get_targets(source):
+            pending_input = self.__pending_input.get(target)
+
+            if pending_input is None:
+                self.__pending_input[target] = bytearray(data)
+            else:
+                pending_input += data
+
+        if self.__pending_input and self.__flush_source is None:
+            self.__flush_source = glib.idle_add(self.__handle_flush_idle, priority=glib.PRIORITY_HIGH_IDLE)
+
+    def paste(self, source, data, bracketed):
+        # Pastes already go through the chunked pipeline of each target.
+        for target in self.__get_targets(source):
+            target.paste(data, bracketed)
+
+    def __get_targets(self, source):
+        targets = []
+
+        for group_name in self.__active_groups:
+            terminals = self.__groups[group_name]
+
+            if source in terminals:
+                targets.extend(terminal for terminal in terminals if terminal is not source and terminal not in targets)
+
+        return targets
+
+    def __update_indicators(self):
+        for terminal in {terminal for terminals in self.__groups.values() for terminal in terminals}:
+            terminal.set_broadcast_groups(self.get_active_groups(terminal))
+
+    def __handle_flush_idle(self):
+        self.__flush_source = None
+        pending_input, self.__pending_input = self.__pending_input, {}
+
+        for target, data in pending_input.items():
+            target.write_input(bytes(data))
+
+        return False
+
+class SshPool:
+    __CHECK_TIMEOUT   = 5
+    __CONNECT_TIMEOUT = 30
+
+    def __init__(self, ssh_path, control_directory, shim_directory, persist_time):
+        # A wrapper that runs itself would never get to ssh.
+        if os.path.realpath(os.path.dirname(ssh_path)) == os.path.realpath(shim_directory):
+            raise ValueError(f"{ssh_path:s} is the connection sharing wrapper itself")
+
+        self.__ssh_path       = ssh_path
+        self.__control_path   = os.path.join(control_directory, "%C")
+        self.__shim_directory = shim_directory
+        self.__persist_time   = persist_time
+        self.__destinations   = []
+        self.__connecting     = set()
+        self.__executor       = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="SSH pool")
+
+        self.__install_shim()
+
+    def get_shim_directory(self):
+        return self.__shim_directory
+
+    def add(self, ssh_destination):
+        if ssh_destination not in self.__destinations:
+            self.__destinations.append(ssh_destination)
+
+    def connect(self, ssh_destination):
+        self.add(ssh_destination)
+
+        if ssh_destination not in self.__connecting:
+            self.__connecting.add(ssh_destination)
+            self.__executor.submit(self.__run_connect, ssh_destination)
+
+    def disconnect(self, ssh_destination):
+        self.__executor.submit(self.__run_ssh, ssh_destination, ("-O", "exit"), self.__CHECK_TIMEOUT)
+
+    def check(self, callback):
+        # The state is queried from the masters themselves, so connections that were opened by tabs show up as well.
+        destinations = list(self.__destinations)
+        futures      = [self.__executor.submit(self.__run_check, ssh_destination) for ssh_destination in destinations]
+
+        def run():
+            glib.idle_add(callback, [(ssh_destination, future.result()) for ssh_destination, future in zip(destinations, futures)])
+
+        threading.Thread(target=run, name="SSH pool check", daemon=True).start()
+
+    def __install_shim(self):
+        # Children of tabs that connect to an ssh destination find this ssh first on their PATH, so every connection they
+        # open, including those of wrappers and of tools such as rsync, shares the master connection of its destination and keeps it alive after it exits.
+        os.makedirs(self.__shim_directory, mode=0o700, exist_ok=True)
+
+        shim_path      = os.path.join(self.__shim_directory, "ssh")
+        temporary_path = shim_path + ".tmp"
+
+        with open(temporary_path, "w") as shim_file:
+            shim_file.write(f"#!/bin/sh\nexec {shlex.join([self.__ssh_path] + self.__get_multiplexing_options('auto')):s} \"$@\"\n")
+
+        os.chmod(temporary_path, 0o755)
+        os.replace(temporary_path, shim_path)
+
+    def __get_multiplexing_options(self, master_mode):
+        return ["-o", f"ControlMaster={master_mode:s}", "-o", f"ControlPath={self.__control_path:s}", "-o", f"ControlPersist={self.__persist_time:d}"]
+
+    def __run_ssh(self, ssh_destination, arguments, timeout, capture_output=True):
+        options, destination = ssh_destination
+
+        # A master that forks into the background keeps its standard error open, so it must not be a pipe that is read
+        # until the end.
+        try:
+            return subprocess.run(
+                [self.__ssh_path] + self.__get_multiplexing_options("auto") + list(arguments) + list(options) + [destination],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE if capture_output else subprocess.DEVNULL,
+                text=True,
+                timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+
+    def __run_check(self, ssh_destination):
+        if ssh_destination in self.__connecting:
+            return "Connecting"
+
+        result = self.__run_ssh(ssh_destination, ("-O", "check"), self.__CHECK_TIMEOUT)
+
+        if result is None or result.returncode != 0:
+            return "Not connected"
+
+        return result.stderr.strip() or "Master running"
+
+    def __run_connect(self, ssh_destination):
+        # Masters are only opened in the background when no password is needed. Otherwise the first tab for the
+        # destination becomes the master.
+        try:
+            result = self.__run_ssh(ssh_destination, ("-O", "check"), self.__CHECK_TIMEOUT)
+
+            if result is None or result.returncode != 0:
+                self.__run_ssh(ssh_destination, ("-o", "BatchMode=yes", "-o", f"ConnectTimeout={self.__CONNECT_TIMEOUT:d}", "-f", "-N"), self.__CONNECT_TIMEOUT * 2, False)
+        finally:
+            self.__connecting.discard(ssh_destination)
+
+@PROFILER.instrument
+class SshPoolPanel(gtk.Window):
+    def __init__(self, window, ssh_pool):
+        super(SshPoolPanel, self).__init__()
+
+        self.__ssh_pool = ssh_pool
+
+        self.__connection_model = gtk.ListStore(gobject.TYPE_PYOBJECT, str, str)
+
+        self.__connection_view = gtk.TreeView.new_with_model(self.__connection_model)
+        self.__connection_view.append_column(gtk.TreeViewColumn("Destination", gtk.CellRendererText(), text=1))
+        self.__connection_view.append_column(gtk.TreeViewColumn("State", gtk.CellRendererText(), text=2))
+        self.__connection_view.show()
+
+        scrollbars = gtk.ScrolledWindow()
+        scrollbars.add(self.__connection_view)
+        scrollbars.show()
+
+        self.__refresh_button = gtk.Button.new_with_label("Refresh")
+        self.__refresh_button.connect("clicked", self.__handle_refresh_button_clicked)
+        self.__refresh_button.show()
+
+        self.__connect_button = gtk.Button.new_with_label("Connect")
+        self.__connect_button.connect("clicked", self.__handle_connect_button_clicked)
+        self.__connect_button.show()
+
+        self.__disconnect_button = gtk.Button.new_with_label("Disconnect")
+        self.__disconnect_button.connect("clicked", self.__handle_disconnect_button_clicked)
+        self.__disconnect_button.show()
+
+        button_layout = gtk.Box.new(gtk.Orientation.HORIZONTAL, 4)
+        button_layout.pack_end(self.__disconnect_button, False, True, 0)
+        button_layout.pack_end(self.__connect_button, False, True, 0)
+        button_layout.pack_end(self.__refresh_button, False, True, 0)
+        button_layout.show()
+
+        layout = gtk.Box.new(gtk.Orientation.VERTICAL, 4)
+        layout.set_border_width(4)
+        layout.pack_start(scrollbars, True, True, 0)
+        layout.pack_start(button_layout, False, True, 0)
+        layout.show()
+
+        self.set_title("SSH connections")
+        self.set_transient_for(window)
+        self.set_default_size(700, 400)
+        self.add(layout)
+        self.connect("map", self.__handle_map)
+        self.connect("delete-event", self.__handle_delete)
+
+    def __refresh(self):
+        self.__ssh_pool.check(self.__show_states)
+
+    def __show_states(self, states):
+        self.__connection_model.clear()
+
+        for ssh_destination, state in states:
+            options, destination = ssh_destination
+            self.__connection_model.append((ssh_destination, shlex.join(options + (destination,)), state))
+
+        return False
+
+    def __get_selected_destination(self):
+        model, selected_row = self.__connection_view.get_selection().get_selected()
+        return None if selected_row is None else model[selected_row][0]
+
+    def __handle_map(self, widget):
+        assert self is widget
+        self.__refresh()
+
+    def __handle_refresh_button_clicked(self, refresh_button):
+        assert self.__refresh_button is refresh_button
+        self.__refresh()
+
+    def __handle_connect_button_clicked(self, connect_button):
+        assert self.__connect_button is connect_button
+
+        ssh_destination = self.__get_selected_destination()
+
+        if ssh_destination is not None:
+            self.__ssh_pool.connect(ssh_destination)
+            self.__refresh()
+
+    def __handle_disconnect_button_clicked(self, disconnect_button):
+        assert self.__disconnect_button is disconnect_button
+
+        ssh_destination = self.__get_selected_destination()
+
+        if ssh_destination is not None:
+            self.__ssh_pool.disconnect(ssh_destination)
+            glib.timeout_add_seconds(1, self.__refresh)
+
+    def __handle_delete(self, widget, event):
+        assert self is widget
+        return self.hide_on_delete()
+
+class ScrollbackSpill:
+    __SEGMENT_SIZE = 4 * 1024 * 1024
+    __QUEUE_SIZE   = 1024
+
+    def __init__(self, directory, maximum_size):
+        self.__directory     = directory
+        self.__maximum_size  = maximum_size
+        self.__first_segment = 0
+        self.__segment_count = 0
+        self.__segment_sizes = collections.deque()
+        self.__queue         = queue.Queue(self.__QUEUE_SIZE)
+        self.__dropped       = 0
+
+        self.__writer = threading.Thread(target=self.__run_writer, name="Scrollback spill", daemon=True)
+        self.__writer.start()
+
+    def write(self, data):
+        # Like a recording, the spill must never slow down the terminal, so output that the writer cannot keep up
+        # with is dropped and accounted for in the history instead.
+        try:
+            self.__queue.put_nowait((self.__dropped, data))
+            self.__dropped = 0
+        except queue.Full:
+            self.__dropped += len(data)
+
+    def sync(self, callback, *arguments):
+        # Seal the segment that is being written so that everything spilled so far can be read back, and report the
+        # segments that can be read from the main loop.
+        self.__queue.put((callback, arguments))
+
+    def close(self):
+        self.__queue.put(None)
+
+    def join(self):
+        self.__writer.join()
+
+    def read_segment(self, segment_index):
+        with gzip.open(self.__get_segment_path(segment_index), "rb") as segment:
+            return segment.read()
+
+    def __get_segment_path(self, segment_index):
+        return os.path.join(self.__directory, f"{segment_index:08d}.gz")
+
+    def __seal_segment(self):
+        try:
+            self.__segment_sizes.append(os.path.getsize(self.__get_segment_path(self.__segment_count)))
+        except OSError:
+            self.__segment_sizes.append(0)
+
+        self.__segment_count += 1
+
+        # The oldest segments are removed once the history passes "Spill Size", but the newest one is always kept.
+        while len(self.__segment_sizes) > 1 and sum(self.__segment_sizes) > self.__maximum_size:
+            try:
+                os.remove(self.__get_segment_path(self.__first_segment))
+            except OSError as exception:
+                print(f"Failed to remove spilled scrollback from '{self.__directory:s}': {exception}", file=sys.stderr)
+
+            self.__segment_sizes.popleft()
+            self.__first_segment += 1
+
+    def __run_writer(self):
+        segment      = None
+        segment_size = 0
+
+        while True:
+            item = self.__queue.get()
+
+            if item is None or callable(item[0]) or segment_size >= self.__SEGMENT_SIZE:
+                if segment is not None:
+                    segment.close()
+                    segment = None
+                    self.__seal_segment()
+
+                if item is None:
+                    shutil.rmtree(self.__directory, ignore_errors=True)
+                    return
+
+                if callable(item[0]):
+                    callback, arguments = item
+                    glib.idle_add(callback, self.__first_segment, self.__segment_count, *arguments)
+                    continue
+
+            dropped, data = item
+
+            if dropped:
+                data = f"\r\n[{format_size(dropped):s} of output not kept in the history]\r\n".encode() + data
+
+            try:
+                if segment is None:
+                    os.makedirs(self.__directory, exist_ok=True)
+                    segment      = gzip.open(self.__get_segment_path(self.__segment_count), "wb", compresslevel=1)
+                    segment_size = 0
+
+                segment.write(data)
+                segment_size += len(data)
+            except OSError as exception:
+                print(f"Failed to spill scrollback to '{self.__directory:s}': {exception}", file=sys.stderr)
+
+class SessionRecorder:
+    __QUEUE_SIZE = 1024
+
+    def __init__(self, directory, name, rotate_size, rotate_interval):
+        self.__directory       = directory
+        self.__name            = re.sub(r"[^\w.-]+", "_", name).strip("_") or "session"
+        self.__rotate_size     = rotate_size
+        self.__rotate_interval = rotate_interval
+        self.__queue           = queue.Queue(self.__QUEUE_SIZE)
+        self.__dropped         = 0
+
+        self.__writer = threading.Thread(target=self.__run_writer, name="Session recorder", daemon=True)
+        self.__writer.start()
+
+    def write(self, data):
+        # Recording must never slow down the terminal, so output that the writer cannot keep up with is dropped and
+        # accounted for in the recording instead.
+        try:
+            self.__queue.put_nowait((time.time(), self.__dropped, data))
+            self.__dropped = 0
+        except queue.Full:
+            self.__dropped += len(data)
+
+    def close(self):
+        self.__queue.put(None)
+
+    def join(self):
+        self.__writer.join()
+
+    def __open_files(self, start_time):
+        os.makedirs(self.__directory, exist_ok=True)
+        base_path = os.path.join(self.__directory, f"{self.__name:s}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(start_time)):s}-{uuid.uuid4().hex[:8]:s}")
+        return gzip.open(base_path + ".typescript.gz", "wb", compresslevel=1), gzip.open(base_path + ".timing.gz", "wt", compresslevel=1)
+
+    def __run_writer(self):
+        typescript    = None
+        timing        = None
+        file_size     = 0
+        file_started  = 0
+        previous_time = None
+
+        while True:
+            item = self.__queue.get()
+
+            if item is None or (typescript is not None and (file_size >= self.__rotate_size or item[0] - file_started >= self.__rotate_interval)):
+                if typescript is not None:
+                    typescript.close()
+                    timing.close()
+                    typescript = None
+                    timing     = None
+
+                if item is None:
+                    return
+
+            timestamp, dropped, data = item
+
+            if dropped:
+                data = f"\r\n[{format_size(dropped):s} of output not recorded]\r\n".encode() + data
+
+            try:
+                if typescript is None:
+                    typescript, timing = self.__open_files(timestamp)
+                    file_size    = 0
+                    file_started = timestamp
+
+                # The timing file follows the format of script(1) so that recordings can be played back with scriptreplay.
+                typescript.write(data)
+                timing.write(f"{0 if previous_time is None else timestamp - previous_time:.6f} {len(data):d}\n")
+                file_size    += len(data)
+                previous_time = timestamp
+            except OSError as exception:
+                print(f"Failed to record session to '{self.__directory:s}': {exception}", file=sys.stderr)
+
+class OutputDecoder:
+    __ESCAPE_SEQUENCE  = re.compile(r"\x1B(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1B]*(?:\x07|\x1B\\)|[PX^_][^\x1B]*\x1B\\|[ -/]*[0-OQ-WYZ\\`-~])")
+    __CONTROL_SEQUENCE = re.compile(__ESCAPE_SEQUENCE.pattern + r"|[\x00-\x08\x0B-\x1F\x7F]")
+    __MAXIMUM_CARRY    = 4096
+
+    def __init__(self):
+        self.__decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self.__carry   = ""
+
+    def decode(self, data):
+        text = self.__carry + self.__decoder.decode(data)
+        self.__carry = ""
+
+        # An escape sequence that is split across reads is completed by the next chunk of output.
+        escape_index = text.rfind("\x1B")
+
+        if escape_index >= 0 and len(text) - escape_index < self.__MAXIMUM_CARRY and self.__ESCAPE_SEQUENCE.match(text, escape_index) is None:
+            self.__carry = text[escape_index:]
+            text         = text[:escape_index]
+
+        return self.__CONTROL_SEQUENCE.sub("", text)
+
+@functools.lru_cache(maxsize=None)
+def compile_triggers(rules):
+    RULE           = re.compile(r"(.*?)\s+=>\s+(notify|highlight|snippet|password)(?:\s+(.*))?")
+    GLOBAL_FLAGS   = re.compile(r"\(\?([aiLmsux]+)\)")
+    GROUP_NUMBERS  = re.compile(r"\[\^?\]?(?:\\.|[^\\\]])*\]|\\[0-7]{3}|\\([1-9][0-9]?)|\\.|\(\?\(([0-9]+)\)", re.DOTALL)
+    MAXIMUM_NUMBER = 99
+
+    patterns         = []
+    actions          = []
+    group_count      = 0
+    combined_pattern = re.compile("", re.MULTILINE)
+
+    for rule in rules.splitlines():
+        rule = rule.strip()
+
+        if not rule:
+            continue
+
+        match = RULE.fullmatch(rule)
+
+        if match is None:
+            raise ValueError(f"invalid trigger '{rule:s}'")
+
+        pattern, action, argument = match.groups()
+
+        # Each pattern is checked on its own first, so that errors point at the rule rather than the combined pattern.
+        try:
+            pattern_groups = re.compile(pattern).groups
+        except re.error as exception:
+            raise ValueError(f"invalid pattern in trigger '{rule:s}': {exception}")
+
+        # Flags that would apply to the whole combined pattern only apply to the rule that sets them.
+        flags = ""
+
+        while (flags_match := GLOBAL_FLAGS.match(pattern)) is not None:
+            flags  += flags_match.group(1)
+            pattern = pattern[flags_match.end():]
+
+        # A verbose pattern can end in a comment, which must not swallow the end of the group.
+        if flags:
+            pattern = f"(?{flags:s}:{pattern:s}{chr(10) if 'x' in flags else '':s})"
+
+        # The groups of a rule come after those of the rules before it and after its own group, so numbered
+        # backreferences and conditions are renumbered to match.
+        group_offset = group_count + 1
+
+        def renumber(group_match):
+            if group_match.group(1) is None and group_match.group(2) is None:
+                return group_match.group()
+
+            number = int(group_match.group(1) or group_match.group(2)) + group_offset
+
+            if number > MAXIMUM_NUMBER:
+                raise ValueError(f"too many groups before trigger '{rule:s}'")
+
+            return f"\\{number:d}" if group_match.group(1) is not None else f"(?({number:d})"
+
+        pattern      = GROUP_NUMBERS.sub(renumber, pattern)
+        group_count += 1 + pattern_groups
+
+        if action == "snippet":
+            try:
+                argument = compile_snippet(argument or "")
+            except Exception as exception:
+                raise ValueError(f"invalid snippet in trigger '{rule:s}': {exception}")
+        elif action == "password" and not argument:
+            raise ValueError(f"missing password entry in trigger '{rule:s}'")
+
+        patterns.append(f"(?P<trigger_{len(patterns):d}>{pattern:s})")
+        actions.append((action, argument))
+
+        # What is valid on its own can still clash with the other rules, like a group name that is used twice.
+        try:
+            combined_pattern = re.compile("|".join(patterns), re.MULTILINE)
+        except re.error as exception:
+            raise ValueError(f"invalid pattern in trigger '{rule:s}': {exception}")
+
+    return combined_pattern, tuple(actions)
+
+class TriggerMatcher:
+    __MAXIMUM_CARRY = 4096
+
+    def __init__(self, rules):
+        self.__pattern, self.__actions = compile_triggers(rules)
+        self.__carry                   = ""
+        self.__reported_end            = 0
+
+    def scan(self, text):
+        # All rules are matched in a single pass over the new text. Only the unfinished last line is scanned again, so
+        # that prompts, which do not end their line, are matched without reporting the same match twice.
+        text    = self.__carry + text
+        matches = []
+
+        for match in self.__pattern.finditer(text):
+            if match.start() >= self.__reported_end and match.end() > match.start():
+                action, argument = self.__actions[int(match.lastgroup.rpartition("_")[2])]
+                matches.append((action, argument, match.group()))
+                self.__reported_end = match.end()
+
+        line_start = max(text.rfind("\n") + 1, len(text) - self.__MAXIMUM_CARRY)
+
+        self.__carry        = text[line_start:]
+        self.__reported_end = max(self.__reported_end - line_start, 0)
+        return matches
+
+class ScrollbackIndex:
+    __BLOCK_LINES = 2048
+
+    def __init__(self, maximum_size):
+        self.__maximum_size          = maximum_size
+        self.__blocks                = collections.deque()
+        self.__size                  = 0
+        self.__pieces                = []
+        self.__open_block_first_line = 0
+        self.__open_block_line_count = 0
+
+    def append(self, text):
+        self.__pieces.append(text)
+        self.__open_block_line_count += text.count("\n")
+
+        if self.__open_block_line_count >= self.__BLOCK_LINES:
+            self.__seal_block()
+
+    def get_snapshot(self):
+        # Sealed blocks are immutable, so searches can run on a snapshot outside of the main loop.
+        open_block_text = "".join(self.__pieces)
+        self.__pieces   = [open_block_text]
+        return tuple(self.__blocks), self.__open_block_first_line, open_block_text
+
+    def __seal_block(self):
+        text       = "".join(self.__pieces)
+        line_break = text.rfind("\n") + 1
+
+        compressed_text = zlib.compress(text[:line_break].encode(), 1)
+        self.__blocks.append((self.__open_block_first_line, compressed_text, [None]))
+        self.__size += len(compressed_text) + TRIGRAM_FILTER_BITS // 8
+
+        # Only the most recent history is kept searchable, so that the index stays as bounded as the scrollback.
+        while self.__size > self.__maximum_size and len(self.__blocks) > 1:
+            self.__size -= len(self.__blocks.popleft()[1]) + TRIGRAM_FILTER_BITS // 8
+
+        self.__open_block_first_line += self.__open_block_line_count
+        self.__open_block_line_count  = 0
+        self.__pieces                 = [text[line_break:]]
+
+class PrivateModeParser:
+    # Programs switch modes such as bracketed paste and the alternate screen with DEC private mode sequences.
+    __MODE_CHANGE   = re.compile(rb"\x1B\[\?([0-9;]*)([hl])")
+    __UNFINISHED    = re.compile(rb"\x1B(?:\[(?:\?[0-9;]*)?)?")
+    __MAXIMUM_CARRY = 64
+
+    def __init__(self):
+        self.__carry = b""
+
+    def parse(self, data):
+        data       = self.__carry + data
+        tail_start = data.rfind(b"\x1B", max(len(data) - self.__MAXIMUM_CARRY, 0))
+
+        # A sequence that is split across reads is completed by the next chunk of output.
+        if tail_start >= 0 and self.__UNFINISHED.fullmatch(data, tail_start) is not None:
+            self.__carry = data[tail_start:]
+            data         = data[:tail_start]
+        else:
+            self.__carry = b""
+
+        if b"\x1B[?" not in data:
+            return []
+
+        return [(parameter, mode == b"h") for parameters, mode in self.__MODE_CHANGE.findall(data) for parameter in parameters.split(b";")]
+
+class SemanticMarkParser:
+    # Shells with semantic prompt support emit OSC 133 marks around their prompts, command lines and command output.
+    __MARK          = re.compile(rb"\x1B\]133;([A-D])([^\x07\x1B]*)(?:\x07|\x1B\\)")
+    __MARK_PREFIX   = b"\x1B]133;"
+    __MAXIMUM_CARRY = 256
+
+    def __init__(self):
+        self.__carry = b""
+
+    def parse(self, data):
+        if not self.__carry and b"\x1B]" not in data and not data.endswith(b"\x1B"):
+            return []
+
+        carry_size = len(self.__carry)
+        data       = self.__carry + data
+        marks      = []
+        mark_end   = 0
+
+        # Marks are reported with the offset just past them in the data that was passed in.
+        for match in self.__MARK.finditer(data):
+            marks.append((match.end() - carry_size, match.group(1), match.group(2)))
+            mark_end = match.end()
+
+        # A mark that is split across reads is completed by the next chunk of output.
+        tail_start = data.rfind(self.__MARK_PREFIX, mark_end)
+
+        if tail_start < 0:
+            tail_start = data.rfind(b"\x1B", mark_end)
+
+        tail = data[tail_start:] if tail_start >= 0 else b""
+
+        if tail and len(tail) < self.__MAXIMUM_CARRY and (tail.startswith(self.__MARK_PREFIX) or self.__MARK_PREFIX.startswith(tail)) and b"\x07" not in tail and b"\x1B\\" not in tail:
+            self.__carry = tail
+        else:
+            self.__carry = b""
+
+        return marks
+
+class CommandMarks:
+    def __init__(self):
+        self.__prompt_rows          = array.array("q")
+        self.__output_start_rows    = array.array("q")
+        self.__output_start_columns = array.array("q")
+        self.__output_end_rows      = array.array("q")
+        self.__output_end_columns   = array.array("q")
+        self.__output_start         = None
+        self.__exit_codes           = array.array("i")
+        self.__durations            = array.array("d")
+
+    def add(self, kind, row, column):
+        # Rows only go back when the widget was reset or a prompt is redrawn, which invalidates the marks below it.
+        if kind == b"A":
+            del self.__prompt_rows[bisect.bisect_left(self.__prompt_rows, row):]
+            self.__prompt_rows.append(row)
+        elif kind == b"C":
+            self.__output_start = (row, column)
+        elif kind == b"D" and self.__output_start is not None:
+            output_count = bisect.bisect_left(self.__output_start_rows, self.__output_start[0])
+
+            for rows in (self.__output_start_rows, self.__output_start_columns, self.__output_end_rows, self.__output_end_columns):
+                del rows[output_count:]
+
+            self.__output_start_rows.append(self.__output_start[0])
+            self.__output_start_columns.append(self.__output_start[1])
+            self.__output_end_rows.append(row)
+            self.__output_end_columns.append(column)
+            self.__output_start = None
+
+    def add_status(self, exit_code, duration):
+        self.__exit_codes.append(exit_code)
+        self.__durations.append(duration)
+
+    def shift(self, row_count):
+        # Marks that end up above the first row were dropped from the scrollback.
+        for rows in (self.__prompt_rows, self.__output_start_rows, self.__output_end_rows):
+            for index in range(len(rows)):
+                rows[index] += row_count
+
+        del self.__prompt_rows[:bisect.bisect_left(self.__prompt_rows, 0)]
+        output_count = bisect.bisect_left(self.__output_start_rows, 0)
+
+        for rows in (self.__output_start_rows, self.__output_start_columns, self.__output_end_rows, self.__output_end_columns):
+            del rows[:output_count]
+
+        self.__output_start = None
+
+    def get_previous_prompt(self, row):
+        index = bisect.bisect_left(self.__prompt_rows, row)
+        return self.__prompt_rows[index - 1] if index > 0 else None
+
+    def get_next_prompt(self, row):
+        index = bisect.bisect_right(self.__prompt_rows, row)
+        return self.__prompt_rows[index] if index < len(self.__prompt_rows) else None
+
+    def get_last_output(self):
+        if not self.__output_end_rows:
+            return None
+
+        return self.__output_start_rows[-1], self.__output_start_columns[-1], self.__output_end_rows[-1], self.__output_end_columns[-1]
+
+    def get_last_status(self):
+        if not self.__exit_codes:
+            return None
+
+        return self.__exit_codes[-1], self.__durations[-1]
+
+@PROFILER.instrument
+class SearchPanel(gtk.Window):
+    __MAXIMUM_RESULTS = 1000
+    __BATCH_SIZE      = 100
+
+    __gsignals__ = {
+        "activated": (gobject.SignalFlags.RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT, gobject.TYPE_INT, gobject.TYPE_STRING))}
+
+    def __init__(self, window, collect_sources):
+        super(SearchPanel, self).__init__()
+
+        self.__collect_sources = collect_sources
+        self.__generation      = 0
+
+        self.__query_entry = gtk.SearchEntry.new()
+        self.__query_entry.connect("search-changed", self.__handle_query_entry_search_changed)
+        self.__query_entry.show()
+
+        self.__regex_checkbox = gtk.CheckButton.new_with_label("Regular expression")
+        self.__regex_checkbox.connect("toggled", self.__handle_option_toggled)
+        self.__regex_checkbox.show()
+
+        self.__case_checkbox = gtk.CheckButton.new_with_label("Match case")
+        self.__case_checkbox.connect("toggled", self.__handle_option_toggled)
+        self.__case_checkbox.show()
+
+        query_layout = gtk.Box.new(gtk.Orientation.HORIZONTAL, 4)
+        query_layout.pack_start(self.__query_entry, True, True, 0)
+        query_layout.pack_start(self.__regex_checkbox, False, True, 0)
+        query_layout.pack_start(self.__case_checkbox, False, True, 0)
+        query_layout.show()
+
+        self.__result_model = gtk.ListStore(gobject.TYPE_PYOBJECT, str, int, str)
+
+        result_view = gtk.TreeView.new_with_model(self.__result_model)
+        result_view.append_column(gtk.TreeViewColumn("Tab", gtk.CellRendererText(), text=1))
+        result_view.append_column(gtk.TreeViewColumn("Line", gtk.CellRendererText(), text=2))
+        result_view.append_column(gtk.TreeViewColumn("Text", gtk.CellRendererText(), text=3))
+        result_view.connect("row-activated", self.__handle_result_view_row_activated)
+        result_view.show()
+
+        scrollbars = gtk.ScrolledWindow()
+        scrollbars.add(result_view)
+        scrollbars.show()
+
+        self.__status_label = gtk.Label.new("")
+        self.__status_label.set_xalign(0)
+        self.__status_label.show()
+
+        layout = gtk.Box.new(gtk.Orientation.VERTICAL, 4)
+        layout.set_border_width(4)
+        layout.pack_start(query_layout, False, True, 0)
+        layout.pack_start(scrollbars, True, True, 0)
+        layout.pack_start(self.__status_label, False, True, 0)
+        layout.show()
+
+        self.set_title("Search all tabs")
+        self.set_transient_for(window)
+        self.set_default_size(1000, 600)
+        self.add(layout)
+        self.connect("delete-event", self.__handle_delete)
+
+    def present_query(self):
+        self.__query_entry.grab_focus()
+        self.present()
+
+    def __start_search(self):
+        # Results of a search that has been superseded are discarded, and its worker stops after the block it is searching.
+        self.__generation += 1
+        self.__result_model.clear()
+
+        query = self.__query_entry.get_text()
+
+        if not query:
+            self.__status_label.set_text("")
+            return
+
+        try:
+            expression = re.compile(
+                query if self.__regex_checkbox.get_active() else re.escape(query),
+                re.MULTILINE if self.__case_checkbox.get_active() else re.MULTILINE | re.IGNORECASE)
+        except re.error as exception:
+            self.__status_label.set_text(f"Invalid regular expression: {exception}")
+            return
+
+        self.__status_label.set_text("Searching...")
+        literal = None if self.__regex_checkbox.get_active() else query
+        threading.Thread(target=self.__run_search, args=(self.__generation, expression, literal, self.__collect_sources()), name="Search", daemon=True).start()
+
+    def __run_search(self, generation, expression, literal, sources):
+        results = []
+        result_count = 0
+
+        for terminal, title, snapshot in sources:
+            for block_results in search_scrollback(expression, snapshot, literal):
+                if generation != self.__generation:
+                    return
+
+                for line_number, line in block_results:
+                    results.append((terminal, title, line_number + 1, line))
+                    result_count += 1
+
+                    if result_count == self.__MAXIMUM_RESULTS:
+                        glib.idle_add(self.__add_results, generation, results, True)
+                        return
+
+                    if len(results) == self.__BATCH_SIZE:
+                        glib.idle_add(self.__add_results, generation, results, False)
+                        results = []
+
+        glib.idle_add(self.__add_results, generation, results, True)
+
+    def __add_results(self, generation, results, finished):
+        if generation == self.__generation:
+            for result in results:
+                self.__result_model.append(result)
+
+            if finished:
+                self.__status_label.set_text(f"{len(self.__result_model):d} matching lines")
+
+        return False
+
+    def __handle_query_entry_search_changed(self, query_entry):
+        assert self.__query_entry is query_entry
+        self.__start_search()
+
+    def __handle_option_toggled(self, checkbox):
+        self.__start_search()
+
+    def __handle_result_view_row_activated(self, result_view, path, column):
+        terminal, title, line_number, line = self.__result_model[path]
+        self.emit("activated", terminal, line_number - 1, line)
+
+    def __handle_delete(self, widget, event):
+        assert self is widget
+        return self.hide_on_delete()
+
+def get_fuzzy_score(query, text):
+    # The characters of the query have to appear in order. Runs of consecutive characters and characters that start a
+    # word score higher, as does a query that appears as a whole.
+    score    = 2 * len(query) if query in text else 0
+    position = 0
+    previous = -2
+
+    for character in query:
+        index = text.find(character, position)
+
+        if index < 0:
+            return None
+
+        if index == previous + 1:
+            score += 3
+        elif index == 0 or not text[index - 1].isalnum():
+            score += 2
+        else:
+            score += 1
+
+        previous = index
+        position = index + 1
+
+    return score
+
+class TabIndex:
+    __KEYWORD        = re.compile(r"\w{3,}")
+    __FIELD_WEIGHTS  = (1.0, 0.6, 0.5)
+    __KEYWORD_WEIGHT = 0.5
+
+    def __init__(self, tabs):
+        # Tabs are passed in the order they were last used in, which breaks ties between equally good matches.
+        self.__tabs  = []
+        keyword_tabs = {}
+
+        for tab_rank, (terminal, title, command, working_dir, recent_output) in enumerate(tabs):
+            self.__tabs.append((terminal, title, (title.lower(), command.lower(), working_dir.lower())))
+
+            for keyword in set(self.__KEYWORD.findall(recent_output.lower())):
+                keyword_tabs.setdefault(keyword, set()).add(tab_rank)
+
+        # Keywords are kept sorted, so that all keywords starting with a word of the query are found with a bisection.
+        self.__keywords     = sorted(keyword_tabs)
+        self.__keyword_tabs = [keyword_tabs[keyword] for keyword in self.__keywords]
+
+    def search(self, query, maximum_results):
+        words   = query.lower().split()
+        results = []
+
+        if not words:
+            return [(terminal, title) for terminal, title, fields in self.__tabs[:maximum_results]]
+
+        word_keyword_tabs = [self.__find_keyword_tabs(word) for word in words]
+
+        for tab_rank, (terminal, title, fields) in enumerate(self.__tabs):
+            score = 0.0
+
+            for word, keyword_tabs in zip(words, word_keyword_tabs):
+                field_scores = []
+
+                for field, weight in zip(fields, self.__FIELD_WEIGHTS):
+                    field_score = get_fuzzy_score(word, field)
+
+                    if field_score is not None:
+                        field_scores.append(field_score * weight)
+
+                if tab_rank in keyword_tabs:
+                    field_scores.append(len(word) * self.__KEYWORD_WEIGHT)
+
+                # Every word of the query has to match somewhere.
+                if not field_scores:
+                    break
+
+                score += max(field_scores)
+            else:
+                results.append((-score, tab_rank, terminal, title))
+
+        results.sort(key=lambda result: result[:2])
+        return [(terminal, title) for score, tab_rank, terminal, title in results[:maximum_results]]
+
+    def __find_keyword_tabs(self, word):
+        tabs  = set()
+        index = bisect.bisect_left(self.__keywords, word)
+
+        while index < len(self.__keywords) and self.__keywords[index].startswith(word):
+            tabs |= self.__keyword_tabs[index]
+            index += 1
+
+        return tabs
+
+@PROFILER.instrument
+class TabSwitcher(gtk.Window):
+    __MAXIMUM_RESULTS = 50
+
+    __gsignals__ = {
+        "activated": (gobject.SignalFlags.RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,))}
+
+    def __init__(self, window, collect_tabs):
+        super(TabSwitcher, self).__init__()
+
+        self.__collect_tabs = collect_tabs
+        self.__index        = None
+
+        self.__query_entry = gtk.SearchEntry.new()
+        self.__query_entry.connect("search-changed", self.__handle_query_entry_search_changed)
+        self.__query_entry.connect("activate", self.__handle_query_entry_activated)
+        self.__query_entry.connect("key-press-event", self.__handle_query_entry_key_press_event)
+        self.__query_entry.show()
+
+        self.__result_model = gtk.ListStore(gobject.TYPE_PYOBJECT, str)
+
+        self.__result_view = gtk.TreeView.new_with_model(self.__result_model)
+        self.__result_view.set_headers_visible(False)
+        self.__result_view.append_column(gtk.TreeViewColumn("Tab", gtk.CellRendererText(), text=1))
+        self.__result_view.connect("row-activated", self.__handle_result_view_row_activated)
+        self.__result_view.show()
+
+        scrollbars = gtk.ScrolledWindow()
+        scrollbars.add(self.__result_view)
+        scrollbars.show()
+
+        layout = gtk.Box.new(gtk.Orientation.VERTICAL, 4)
+        layout.set_border_width(4)
+        layout.pack_start(self.__query_entry, False, True, 0)
+        layout.pack_start(scrollbars, True, True, 0)
+        layout.show()
+
+        self.set_title("Switch to tab")
+        self.set_transient_for(window)
+        self.set_modal(True)
+        self.set_position(gtk.WindowPosition.CENTER_ON_PARENT)
+        self.set_default_size(600, 400)
+        self.add(layout)
+        self.connect("delete-event", self.__handle_delete)
+        self.connect("key-press-event", self.__handle_key_press_event)
+
+    def present_switcher(self):
+        # The index is rebuilt each time the switcher is opened, and then answers every key stroke from memory.
+        self.__index = TabIndex(self.__collect_tabs())
+        self.__query_entry.set_text("")
+        self.__update_results()
+        self.__query_entry.grab_focus()
+        self.present()
+
+    def __update_results(self):
+        self.__result_model.clear()
+
+        for terminal, title in self.__index.search(self.__query_entry.get_text(), self.__MAXIMUM_RESULTS):
+            self.__result_model.append((terminal, title))
+
+        if len(self.__result_model) > 0:
+            self.__result_view.set_cursor(gtk.TreePath.new_first(), None, False)
+
+    def __activate(self, path):
+        terminal = self.__result_model[path][0]
+        self.hide()
+        self.__index = None
+        self.emit("activated", terminal)
+
+    def __handle_query_entry_search_changed(self, query_entry):
+        assert self.__query_entry is query_entry
+        self.__update_results()
+
+    def __handle_query_entry_activated(self, query_entry):
+        assert self.__query_entry is query_entry
+
+        path, column = self.__result_view.get_cursor()
+
+        if path is not None:
+            self.__activate(path)
+
+    def __handle_query_entry_key_press_event(self, query_entry, event):
+        assert self.__query_entry is query_entry
+
+        # The results are browsed without leaving the query.
+        if event.keyval in (gdk.KEY_Up, gdk.KEY_Down) and len(self.__result_model) > 0:
+            path, column = self.__result_view.get_cursor()
+            index        = path.get_indices()[0] if path is not None else 0
+            index        = max(0, min(index + (1 if event.keyval == gdk.KEY_Down else -1), len(self.__result_model) - 1))
+            self.__result_view.set_cursor(gtk.TreePath.new_from_indices([index]), None, False)
+            return True
+
+        return False
+
+    def __handle_result_view_row_activated(self, result_view, path, column):
+        assert self.__result_view is result_view
+        self.__activate(path)
+
+    def __handle_key_press_event(self, widget, event):
+        assert self is widget
+
+        if event.keyval == gdk.KEY_Escape:
+            self.hide()
+            self.__index = None
+            return True
+
+        return False
+
+    def __handle_delete(self, widget, event):
+        assert self is widget
+        self.__index = None
+        return self.hide_on_delete()
+
+@PROFILER.instrument
+class TabSidebar(gtk.Box):
+    def __init__(self, notebook, start_menu):
+        super(TabSidebar, self).__init__(orientation=gtk.Orientation.VERTICAL, spacing=4)
+
+        self.__notebook       = notebook
+        self.__start_menu     = start_menu
+        self.__label_handlers = {}
+
+        # Unlike the tabs of the notebook, a fixed height tree view only lays out and draws the rows that are visible.
+        self.__tab_model = gtk.ListStore(gobject.TYPE_PYOBJECT, pixbuf.Pixbuf, str)
+
+        icon_renderer  = gtk.CellRendererPixbuf()
+        title_renderer = gtk.CellRendererText()
+        title_renderer.set_property("ellipsize", pango.EllipsizeMode.END)
+
+        tab_column = gtk.TreeViewColumn("Tab")
+        tab_column.set_sizing(gtk.TreeViewColumnSizing.FIXED)
+        tab_column.pack_start(icon_renderer, False)
+        tab_column.pack_start(title_renderer, True)
+        tab_column.add_attribute(icon_renderer, "pixbuf", 1)
+        tab_column.add_attribute(title_renderer, "markup", 2)
+
+        self.__tab_view = gtk.TreeView.new_with_model(self.__tab_model)
+        self.__tab_view.set_headers_visible(False)
+        self.__tab_view.set_fixed_height_mode(True)
+        self.__tab_view.set_has_tooltip(True)
+        self.__tab_view.append_column(tab_column)
+        self.__tab_view.get_selection().connect("changed", self.__handle_tab_selection_changed)
+        self.__tab_view.connect("button-press-event", self.__handle_tab_view_button_press)
+        self.__tab_view.connect("query-tooltip", self.__handle_tab_view_query_tooltip)
+        self.__tab_view.show()
+
+        scrollbars = gtk.ScrolledWindow()
+        scrollbars.set_policy(gtk.PolicyType.NEVER, gtk.PolicyType.AUTOMATIC)
+        scrollbars.add(self.__tab_view)
+        scrollbars.show()
+
+        start_icon = gtk.Image.new_from_icon_name("tab-new", gtk.IconSize.BUTTON)
+        start_icon.show()
+
+        self.__start_button = gtk.Button.new_with_label("New Terminal")
+        self.__start_button.set_always_show_image(True)
+        self.__start_button.set_image(start_icon)
+        self.__start_button.connect("clicked", self.__handle_start_button_clicked)
+        self.__start_button.show()
+
+        self.pack_start(scrollbars, True, True, 0)
+        self.pack_start(self.__start_button, False, True, 0)
+        self.set_size_request(250, -1)
+
+        self.__notebook.connect("page-added", self.__handle_notebook_page_added)
+        self.__notebook.connect("page-removed", self.__handle_notebook_page_removed)
+        self.__notebook.connect("page-reordered", self.__handle_notebook_page_reordered)
+        self.__notebook.connect("switch-page", self.__handle_notebook_switch_page)
+
+    def __handle_notebook_page_added(self, notebook, terminal, tab_index):
+        assert self.__notebook is notebook
+
+        self.__tab_model.insert(tab_index, (terminal, terminal.get_tab_icon(), terminal.get_tab_markup()))
+        self.__label_handlers[terminal] = terminal.connect("label-changed", self.__handle_terminal_label_changed)
+
+    def __handle_notebook_page_removed(self, notebook, terminal, tab_index):
+        assert self.__notebook is notebook
+
+        del self.__tab_model[tab_index]
+        terminal.disconnect(self.__label_handlers.pop(terminal))
+
+    def __handle_notebook_page_reordered(self, notebook, terminal, tab_index):
+        assert self.__notebook is notebook
+
+        for row in self.__tab_model:
+            if row[0] is terminal:
+                self.__tab_model.remove(row.iter)
+                break
+
+        self.__tab_model.insert(tab_index, (terminal, terminal.get_tab_icon(), terminal.get_tab_markup()))
+        self.__tab_view.get_selection().select_path((self.__notebook.get_current_page(),))
+
+    def __handle_notebook_switch_page(self, notebook, terminal, tab_index):
+        assert self.__notebook is notebook
+
+        # The page may not have been added to the list yet.
+        if tab_index < len(self.__tab_model):
+            self.__tab_view.get_selection().select_path((tab_index,))
+            self.__tab_view.scroll_to_cell((tab_index,), None, False, 0.0, 0.0)
+
+    def __handle_terminal_label_changed(self, terminal):
+        tab_index = self.__notebook.page_num(terminal)
+
+        if tab_index >= 0:
+            self.__tab_model[tab_index][1] = terminal.get_tab_icon()
+            self.__tab_model[tab_index][2] = terminal.get_tab_markup()
+
+    def __handle_tab_selection_changed(self, selection):
+        tab_model, selected_tab = selection.get_selected()
+
+        if selected_tab is not None:
+            self.__notebook.set_current_page(tab_model.get_path(selected_tab).get_indices()[0])
+
+    def __handle_tab_view_button_press(self, tab_view, event):
+        assert self.__tab_view is tab_view
+
+        if event.type == gdk.EventType.BUTTON_PRESS and event.button == gdk.BUTTON_SECONDARY:
+            path_info = self.__tab_view.get_path_at_pos(int(event.x), int(event.y))
+
+            if path_info is not None:
+                self.__tab_model[path_info[0]][0].popup_tab_menu()
+                return True
+
+        return False
+
+    def __handle_tab_view_query_tooltip(self, tab_view, x, y, keyboard_mode, tooltip):
+        assert self.__tab_view is tab_view
+
+        has_row, x, y, tab_model, path, tab_iter = self.__tab_view.get_tooltip_context(x, y, keyboard_mode)
+
+        if not has_row:
+            return False
+
+        tooltip.set_text(tab_model[tab_iter][0].get_tooltip_text())
+        self.__tab_view.set_tooltip_row(tooltip, path)
+        return True
+
+    def __handle_start_button_clicked(self, start_button):
+        assert self.__start_button is start_button
+        self.__start_menu.popup_at_widget(self.__start_button, gdk.Gravity.NORTH_WEST, gdk.Gravity.SOUTH_WEST, None)
+
+@PROFILER.instrument
+class DiagnosticsPanel(gtk.Window):
+    def __init__(self, window, collect_report):
+        super(DiagnosticsPanel, self).__init__()
+
+        self.__collect_report = collect_report
+        self.__refresh_source = None
+
+        self.__main_loop_label = gtk.Label.new("")
+        self.__main_loop_label.set_xalign(0)
+        self.__main_loop_label.set_selectable(True)
+        self.__main_loop_label.show()
+
+        self.__handler_model = gtk.ListStore(str, int, float, float, float)
+
+        handler_view = gtk.TreeView.new_with_model(self.__handler_model)
+
+        for column_index, column_title in enumerate(("Handler", "Calls", "Total (ms)", "Mean (ms)", "Maximum (ms)")):
+            column = gtk.TreeViewColumn(column_title, gtk.CellRendererText(), text=column_index)
+            column.set_sort_column_id(column_index)
+            handler_view.append_column(column)
+
+        handler_view.show()
+
+        handler_scrollbars = gtk.ScrolledWindow()
+        handler_scrollbars.add(handler_view)
+        handler_scrollbars.show()
+
+        self.__tab_model = gtk.ListStore(str, str, str)
+
+        tab_view = gtk.TreeView.new_with_model(self.__tab_model)
+        tab_view.append_column(gtk.TreeViewColumn("Tab", gtk.CellRendererText(), text=0))
+        tab_view.append_column(gtk.TreeViewColumn("Output rate", gtk.CellRendererText(), text=1))
+        tab_view.append_column(gtk.TreeViewColumn("Output", gtk.CellRendererText(), text=2))
+        tab_view.show()
+
+        tab_scrollbars = gtk.ScrolledWindow()
+        tab_scrollbars.set_size_request(-1, 150)
+        tab_scrollbars.add(tab_view)
+        tab_scrollbars.show()
+
+        self.__reset_button = gtk.Button.new_with_label("Reset")
+        self.__reset_button.connect("clicked", self.__handle_reset_button_clicked)
+        self.__reset_button.show()
+
+        self.__save_button = gtk.Button.new_with_label("Save as JSON")
+        self.__save_button.connect("clicked", self.__handle_save_button_clicked)
+        self.__save_button.show()
+
+        button_layout = gtk.Box.new(gtk.Orientation.HORIZONTAL, 4)
+        button_layout.pack_end(self.__save_button, False, True, 0)
+        button_layout.pack_end(self.__reset_button, False, True, 0)
+        button_layout.show()
+
+        layout = gtk.Box.new(gtk.Orientation.VERTICAL, 4)
+        layout.set_border_width(4)
+        layout.pack_start(self.__main_loop_label, False, True, 0)
+        layout.pack_start(handler_scrollbars, True, True, 0)
+        layout.pack_start(tab_scrollbars, False, True, 0)
+        layout.pack_start(button_layout, False, True, 0)
+        layout.show()
+
+        self.set_title("Diagnostics")
+        self.set_transient_for(window)
+        self.set_default_size(900, 700)
+        self.add(layout)
+        self.connect("map", self.__handle_map)
+        self.connect("unmap", self.__handle_unmap)
+        self.connect("delete-event", self.__handle_delete)
+
+    def __refresh(self):
+        report    = self.__collect_report()
+        main_loop = report["main_loop"]
+
+        self.__main_loop_label.set_text(
+            f"Main loop latency over {main_loop['samples']:d} samples: "
+            f"mean {main_loop['mean_latency_ms']:.1f} ms, maximum {main_loop['max_latency_ms']:.1f} ms\n"
+            + ", ".join(f"{bucket:s}: {count:d}" for bucket, count in main_loop["histogram"].items()))
+
+        self.__handler_model.clear()
+
+        for name, statistics in report["handlers"].items():
+            self.__handler_model.append((name, statistics["calls"], statistics["total_ms"], statistics["mean_ms"], statistics["max_ms"]))
+
+        self.__tab_model.clear()
+
+        for tab in report["tabs"]:
+            self.__tab_model.append((tab["title"], f"{format_size(tab['output_rate'])}/s", format_size(tab["output_bytes"])))
+
+    def __handle_refresh_timeout_expiry(self):
+        self.__refresh()
+        return True
+
+    def __handle_map(self, widget):
+        assert self is widget
+
+        # The statistics are only rendered while they are being looked at.
+        self.__refresh()
+        self.__refresh_source = glib.timeout_add_seconds(1, self.__handle_refresh_timeout_expiry)
+
+    def __handle_unmap(self, widget):
+        assert self is widget
+
+        if self.__refresh_source is not None:
+            glib.source_remove(self.__refresh_source)
+            self.__refresh_source = None
+
+    def __handle_reset_button_clicked(self, reset_button):
+        assert self.__reset_button is reset_button
+
+        PROFILER.reset()
+        self.__refresh()
+
+    def __handle_save_button_clicked(self, save_button):
+        assert self.__save_button is save_button
+
+        dialog = gtk.FileChooserDialog(
+            "Save diagnostics",
+            self,
+            gtk.FileChooserAction.SAVE,
+            (gtk.STOCK_CANCEL, gtk.ResponseType.CANCEL, gtk.STOCK_SAVE, gtk.ResponseType.OK))
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name(time.strftime("diagnostics-%Y%m%d-%H%M%S.json"))
+
+        if dialog.run() == gtk.ResponseType.OK:
+            write_diagnostics(dialog.get_filename(), self.__collect_report())
+
+        dialog.destroy()
+
+    def __handle_delete(self, widget, event):
+        assert self is widget
+        return self.hide_on_delete()
+
+class PasswordIndex:
+    def __init__(self, root_group):
+        self.__records = []
+        self.__add_group(root_group, ())
+
+    def search(self, query, limit):
+        terms   = query.lower().split()
+        matches = [record for record in self.__records if all(term in record[0] for term in terms)]
+
+        # Entries whose title starts with the first term come first, followed by those whose title contains it.
+        if terms:
+            matches.sort(key=lambda record: (not record[1].lower().startswith(terms[0]), terms[0] not in record[1].lower(), record[1].lower()))
+        else:
+            matches.sort(key=lambda record: record[1].lower())
+
+        return [(entry, title, username, url, path) for _, title, username, url, path, entry in matches[:limit]]
+
+    def __add_group(self, group, path):
+        for subgroup in group.subgroups:
+            self.__add_group(subgroup, path + (subgroup.name,))
+
+        group_path = "/".join(path)
+
+        for entry in group.entries:
+            title    = entry.title or ""
+            username = entry.username or ""
+            url      = entry.url or ""
+            self.__records.append((f"{title:s}\n{username:s}\n{url:s}\n{group_path:s}".lower(), title, username, url, group_path, entry))
+
+@PROFILER.instrument
+class Vault:
+    def __init__(self, window, path, idle_timeout):
+        self.__window            = window
+        self.__path              = path
+        self.__idle_timeout      = idle_timeout
+        self.__password          = None
+        self.__database          = None
+        self.__index             = None
+        self.__modification_time = None
+        self.__unlocking         = False
+        self.__unavailable       = False
+        self.__pending_requests  = []
+        self.__eviction_timeout  = None
+
+        self.__password_entry = gtk.Entry.new()
+        self.__password_entry.set_visibility(False)
+        self.__password_entry.connect("activate", self.__handle_password_entry_activated)
+        self.__password_entry.show()
+
+        self.__password_dialog = gtk.Dialog(
+            "Password",
+            self.__window,
+            gtk.DialogFlags.MODAL | gtk.DialogFlags.DESTROY_WITH_PARENT,
+            (gtk.STOCK_CANCEL, gtk.ResponseType.CANCEL, gtk.STOCK_OK, gtk.ResponseType.OK))
+        self.__password_dialog.get_content_area().pack_start(self.__password_entry, True, True, 0)
+
+    def request(self, callback, *arguments):
+        # The callback receives the opened database and its index once they are available, which may be right away.
+        # Without the library, which has already been reported, requests are dropped like cancelled ones.
+        if self.__unavailable:
+            return
+
+        self.__pending_requests.append((callback, arguments))
+
+        if not self.__unlocking:
+            self.__open_database()
+
+    def __open_database(self):
+        try:
+            modification_time = os.stat(self.__path).st_mtime_ns
+        except OSError:
+            modification_time = None
+
+        # The database only has to be reloaded when it has been modified since it was last opened.
+        if self.__database is not None and modification_time == self.__modification_time:
+            self.__complete_requests()
+            return
+
+        if self.__password is None:
+            try:
+                if self.__password_dialog.run() != gtk.ResponseType.OK:
+                    self.__pending_requests.clear()
+                    return
+            finally:
+                self.__password_dialog.hide()
+
+            self.__password = self.__password_entry.get_text()
+
+        self.__unlocking = True
+        threading.Thread(target=self.__run_unlock, args=(self.__password, modification_time), name="Vault", daemon=True).start()
+
+    def __run_unlock(self, password, modification_time):
+        # Deriving the key is deliberately expensive, so it happens outside of the main loop. The library itself is only
+        # imported here, as most launches never touch the vault.
+        database = None
+        index    = None
+        error    = None
+
+        try:
+            import pykeepass
+            import pykeepass.exceptions
+        except ImportError as exception:
+            error = exception
+        else:
+            try:
+                database = pykeepass.PyKeePass(self.__path, password=password)
+                index    = PasswordIndex(database.root_group)
+            except pykeepass.exceptions.CredentialsError:
+                pass
+            except Exception as exception:
+                database = None
+                error    = exception
+
+        glib.idle_add(self.__handle_unlock_finished, database, index, modification_time, error)
+
+    def __handle_unlock_finished(self, database, index, modification_time, error):
+        self.__unlocking = False
+
+        if database is None:
+            self.__database = None
+            self.__index    = None
+            self.__password = None
+        else:
+            self.__database          = database
+            self.__index             = index
+            self.__modification_time = modification_time
+
+        # Only a wrong password prompts for the password again. Any other failure would fail again, so it is reported
+        # and the requests that are waiting fail.
+        if error is not None:
+            print(f"Failed to open password database '{self.__path:s}': {error}", file=sys.stderr)
+            self.__unavailable = isinstance(error, ImportError)
+            self.__pending_requests.clear()
+
+        if self.__pending_requests:
+            self.__open_database()
+
+        return False
+
+    def __complete_requests(self):
+        if self.__eviction_timeout is not None:
+            glib.source_remove(self.__eviction_timeout)
+
+        self.__eviction_timeout = glib.timeout_add_seconds(self.__idle_timeout, self.__handle_eviction_timeout_expiry)
+
+        pending_requests, self.__pending_requests = self.__pending_requests, []
+
+        for callback, arguments in pending_requests:
+            callback(self.__database, self.__index, *arguments)
+
+    def __handle_eviction_timeout_expiry(self):
+        assert self.__eviction_timeout is not None
+        self.__eviction_timeout = None
+        self.__database         = None
+        self.__index            = None
+        self.__password         = None
+        return False
+
+    def __handle_password_entry_activated(self, entry):
+        assert self.__password_entry is entry
+        self.__password_dialog.response(gtk.ResponseType.OK)
+
+class TabServices:
+    # What the application shares with all of its tabs. Everything is passed by keyword, so that the services cannot
+    # be mixed up when one is added.
+    def __init__(self, *, window, icons, snippets, variable_providers, activity_monitor, process_sampler, notification_dispatcher, vault, broadcaster, ssh_pool, spill_directory, recording_directory, snapshot_store):
+        self.window                  = window
+        self.icons                   = icons
+        self.snippets                = snippets
+        self.variable_providers      = variable_providers
+        self.activity_monitor        = activity_monitor
+        self.process_sampler         = process_sampler
+        self.notification_dispatcher = notification_dispatcher
+        self.vault                   = vault
+        self.broadcaster             = broadcaster
+        self.ssh_pool                = ssh_pool
+        self.spill_directory         = spill_directory
+        self.recording_directory     = recording_directory
+        self.snapshot_store          = snapshot_store
+
+@PROFILER.instrument
+class Terminal(gtk.Box):
+    __READ_SIZE               = 65536
+    __PCRE2_MULTILINE         = 0x00000400
+    __BRACKETED_PASTE_START   = b"\x1B[200~"
+    __BRACKETED_PASTE_END     = b"\x1B[201~"
+    __ALTERNATE_SCREEN_MODES  = (b"47", b"1047", b"1049")
+    __HIBERNATION_BUFFER_SIZE = 4 * 1024 * 1024
+    __FLOOD_BUFFER_SIZE       = 1024 * 1024
+    __FLOOD_FEED_INTERVAL     = 250
+    __MARK_QUERY              = b"\x1B[5n"
+    __MARK_RESPONSE           = "\x1B[0n"
+    __TERMINAL_QUERY          = re.compile(rb"\x1B\[(?:[>=]?0?c|\??[56]n|18t)")
+    __UNKNOWN_EXIT_CODE       = -1
+    __DEFAULT_SIZE            = (24, 80)
+    __RECENT_OUTPUT_SIZE      = 16384
+    __COLOR_PALETTE = (
+        gdk.RGBA(0.00, 0.00, 0.00), # Black
+        gdk.RGBA(0.80, 0.19, 0.19), # Red
+        gdk.RGBA(0.05, 0.74, 0.47), # Green
+        gdk.RGBA(0.90, 0.90, 0.06), # Yellow
+        gdk.RGBA(0.14, 0.45, 0.78), # Blue
+        gdk.RGBA(0.74, 0.25, 0.74), # Magenta
+        gdk.RGBA(0.07, 0.66, 0.80), # Cyan
+        gdk.RGBA(0.90, 0.90, 0.90), # White
+        gdk.RGBA(0.40, 0.40, 0.40), # Bright Black (Gray)
+        gdk.RGBA(0.95, 0.30, 0.30), # Bright Red
+        gdk.RGBA(0.14, 0.82, 0.55), # Bright Green
+        gdk.RGBA(0.96, 0.96, 0.26), # Bright Yellow
+        gdk.RGBA(0.23, 0.56, 0.92), # Bright Blue
+        gdk.RGBA(0.84, 0.44, 0.84), # Bright Magenta
+        gdk.RGBA(0.16, 0.72, 0.86), # Bright Cyan
+        gdk.RGBA(0.90, 0.90, 0.90)) # Bright White
+        #gdk.RGBA(0.20, 0.20, 0.20), # Black
+        #gdk.RGBA(0.80, 0.00, 0.00), # Red
+        #gdk.RGBA(0.00, 0.80, 0.00), # Green
+        #gdk.RGBA(0.80, 0.80, 0.00), # Yellow
+        #gdk.RGBA(0.00, 0.00, 0.93), # Blue
+        #gdk.RGBA(0.80, 0.00, 0.80), # Magenta
+        #gdk.RGBA(0.00, 0.80, 0.80), # Cyan
+        #gdk.RGBA(0.90, 0.90, 0.90), # White
+        #gdk.RGBA(0.50, 0.50, 0.50), # Bright Black (Gray)
+        #gdk.RGBA(1.00, 0.00, 0.00), # Bright Red
+        #gdk.RGBA(0.00, 1.00, 0.00), # Bright Green
+        #gdk.RGBA(1.00, 1.00, 0.00), # Bright Yellow
+        #gdk.RGBA(0.36, 0.36, 1.00), # Bright Blue
+        #gdk.RGBA(1.00, 0.00, 1.00), # Bright Magenta
+        #gdk.RGBA(0.00, 1.00, 1.00), # Bright Cyan
+        #gdk.RGBA(1.00, 1.00, 1.00)) # Bright White
+
+    __gsignals__ = {
+        "changed": (gobject.SignalFlags.RUN_LAST, gobject.TYPE_NONE, ()),
+        "label-changed": (gobject.SignalFlags.RUN_LAST, gobject.TYPE_NONE, ()),
+        "duplicated": (gobject.SignalFlags.RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_STRING, gobject.TYPE_BOOLEAN, gobject.TYPE_STRING, gobject.TYPE_PYOBJECT, gobject.TYPE_STRING, gobject.TYPE_STRING, gobject.TYPE_BOOLEAN)),
+        "closed": (gobject.SignalFlags.RUN_LAST, gobject.TYPE_NONE, ())}
+
+    def __init__(self, services, options, title, notifications_enabled, icon_name, command, working_dir, entry, recording_enabled, tab_id, spawn_on_map):
+        super(Terminal, self).__init__(orientation=gtk.Orientation.VERTICAL)
+
+        self.__window                = services.window
+        self.__icons                 = services.icons
+        self.__snippets              = services.snippets
+        self.__variable_providers    = services.variable_providers
+        self.__activity_monitor      = services.activity_monitor
+        self.__vault                 = services.vault
+        self.__broadcaster           = services.broadcaster
+        self.__process_sampler       = services.process_sampler
+        self.__notifications         = services.notification_dispatcher
+        self.__notification_priority = NotificationDispatcher.PRIORITIES.get(options.get("Notification Priority", fallback="normal").lower(), notify.Urgency.NORMAL)
+        self.__process_sample        = None
+        self.__triggers              = None
+        self.__highlighted           = False
+        self.__password_pending      = False
+        self.__command_marks         = CommandMarks() if options.getboolean("Shell Integration", fallback=True) else None
+        self.__mode_parser           = PrivateModeParser()
+        self.__mark_parser           = SemanticMarkParser()
+        self.__widget_mark_parser    = SemanticMarkParser()
+        self.__pending_marks         = collections.deque()
+        self.__typing                = False
+        self.__command_start_time    = None
+        self.__ssh_pool              = services.ssh_pool
+        self.__ssh_destination       = get_ssh_destination(command, options.getboolean("SSH Wrapper", fallback=False))
+        self.__title                 = title
+        self.__icon_name             = icon_name
+        self.__command               = command
+        self.__initial_working_dir   = os.path.expanduser(working_dir)
+        self.__entry                 = entry
+        self.__notifications_enabled = notifications_enabled
+        self.__pty                   = None
+        self.__child_pid             = None
+        self.__spawn_requested       = False
+        self.__pty_watch             = None
+        self.__input_watch           = None
+        self.__pending_input         = bytearray()
+        self.__held_input            = collections.deque()
+        self.__spill                 = None
+        self.__recording_directory   = services.recording_directory
+        self.__recording_options     = (options.getint("Record Rotate Size", fallback=64 * 1024 * 1024), options.getfloat("Record Rotate Interval", fallback=3600.0))
+        self.__recorder              = None
+        self.__bracketed_paste       = False
+        self.__alternate_screen      = False
+        self.__scrollback_lines      = options.getint("Scrollback Lines", fallback=10000)
+        self.__hibernate_after       = options.getint("Hibernate After", fallback=1800)
+        self.__flood_threshold       = options.getint("Flood Threshold", fallback=4 * 1024 * 1024)
+        self.__flood_policy          = options.get("Flood Policy", fallback="coalesce")
+        self.__flood_output          = bytearray()
+        self.__flood_dropped         = 0
+        self.__flood_source          = None
+        self.__tab_id                = tab_id or uuid.uuid4().hex
+        self.__snapshot_store        = services.snapshot_store
+        self.__snapshot_byte_count   = 0
+        self.__hibernation_source    = None
+        self.__hibernated_output     = None
+        self.__hibernated_size       = 0
+        self.__hibernated_dropped    = 0
+        self.__restored_snapshot     = None
+        self.__restore_source        = None
+        self.__pending_reveal        = None
+        self.__working_dir_uri       = None
+        self.__paste_chunk_size      = options.getint("Paste Chunk Size", fallback=4096)
+        self.__paste_queue           = collections.deque()
+        self.__paste_data            = None
+        self.__paste_position        = 0
+        self.__paste_terminator      = b""
+        self.__paste_source          = None
+        self.__output_decoder        = OutputDecoder()
+        self.__recent_output         = collections.deque()
+        self.__recent_output_size    = 0
+        self.__search_index          = ScrollbackIndex(options.getint("Search Index Size", fallback=16777216)) if options.getboolean("Search Index", fallback=True) else None
+
+        self.__activity = self.__activity_monitor.register(self.__handle_activity_state_changed, self.__handle_activity_flood_changed)
+
+        if options.get("Triggers", fallback="").strip():
+            try:
+                self.__triggers = TriggerMatcher(options.get("Triggers"))
+            except ValueError as exception:
+                print(f"Failed to compile the triggers of tab '{title:s}': {exception}", file=sys.stderr)
+
+        self.__properties_item = gtk.MenuItem.new_with_label("Properties")
+        self.__properties_item.connect("activate", self.__handle_properties_item_activated)
+        self.__properties_item.show()
+
+        self.__duplicate_item = gtk.MenuItem.new_with_label("Duplicate")
+        self.__duplicate_item.connect("activate", self.__handle_duplicate_item_activated)
+        self.__duplicate_item.show()
+
+        self.__close_item = gtk.ImageMenuItem.new_from_stock(gtk.STOCK_CLOSE)
+        self.__close_item.connect("activate", self.__handle_close_item_activated)
+        self.__close_item.show()
+
+        self.__broadcast_selection_item = gtk.CheckMenuItem.new_with_label("Select for broadcast")
+        self.__broadcast_selection_item.connect("toggled", self.__handle_broadcast_selection_item_toggled)
+        self.__broadcast_selection_item.show()
+
+        self.__broadcast_item = gtk.MenuItem.new_with_label("Broadcast input")
+        self.__broadcast_item.set_submenu(gtk.Menu.new())
+        self.__broadcast_item.show()
+
+        self.__tab_label_menu = gtk.Menu()
+        self.__tab_label_menu.append(self.__properties_item)
+        self.__tab_label_menu.append(self.__duplicate_item)
+        self.__tab_label_menu.append(self.__broadcast_selection_item)
+        self.__tab_label_menu.append(self.__broadcast_item)
+        self.__tab_label_menu.append(self.__close_item)
+
+        self.__tab_icon = gtk.Image.new_from_pixbuf(self.__icons.get(self.__icon_name))
+        self.__tab_icon.connect("notify::pixbuf", self.__handle_tab_label_notify)
+        self.__tab_icon.show()
+
+        self.__tab_title = gtk.Label.new(self.__title)
+        self.__tab_title.connect("notify::label", self.__handle_tab_label_notify)
+        self.__tab_title.show()
+
+        self.__broadcast_icon = gtk.Image.new_from_icon_name("network-transmit", gtk.IconSize.MENU)
+        self.__broadcast_icon.set_no_show_all(True)
+
+        tab_layout = gtk.Box.new(gtk.Orientation.HORIZONTAL, 4)
+        tab_layout.pack_start(self.__tab_icon, False, True, 0)
+        tab_layout.pack_start(self.__tab_title, True, True, 0)
+        tab_layout.pack_start(self.__broadcast_icon, False, True, 0)
+        tab_layout.show()
+
+        self.__tab_label = gtk.EventBox.new()
+        self.__tab_label.add(tab_layout)
+        self.__tab_label.set_has_tooltip(True)
+        self.__tab_label.connect("button-press-event", self.__handle_tab_label_button_press)
+        self.__tab_label.connect("query-tooltip", self.__handle_tab_label_query_tooltip)
+        self.__tab_label.show()
+
+        self.__copy_item = gtk.MenuItem.new_with_label("Copy")
+        self.__copy_item.connect("activate", self.__handle_copy_item_activated)
+        self.__copy_item.show()
+
+        self.__paste_item = gtk.MenuItem.new_with_label("Paste")
+        self.__paste_item.connect("activate", self.__handle_paste_item_activated)
+        self.__paste_item.show()
+
+        self.__copy_and_paste_item = gtk.MenuItem.new_with_label("Copy and paste")
+        self.__copy_and_paste_item.connect("activate", self.__handle_copy_and_paste_item_activated)
+        self.__copy_and_paste_item.show()
+
+        self.__copy_output_item = gtk.MenuItem.new_with_label("Copy last output")
+        self.__copy_output_item.connect("activate", self.__handle_copy_output_item_activated)
+        self.__copy_output_item.set_sensitive(self.__command_marks is not None)
+        self.__copy_output_item.show()
+
+        self.__insert_password_item = gtk.MenuItem.new_with_label("Insert password")
+        self.__insert_password_item.connect("activate", self.__handle_insert_password_item_activated)
+        self.__insert_password_item.show()
+
+        self.__find_password_item = gtk.MenuItem.new_with_label("Find password")
+        self.__find_password_item.connect("activate", self.__handle_find_password_item_activated)
+        self.__find_password_item.show()
+
+        self.__history_item = gtk.MenuItem.new_with_label("Older history")
+        self.__history_item.connect("activate", self.__handle_history_item_activated)
+        self.__history_item.show()
+
+        self.__terminal_menu = gtk.Menu.new()
+        self.__terminal_menu.append(self.__copy_item)
+        self.__terminal_menu.append(self.__paste_item)
+        self.__terminal_menu.append(self.__copy_and_paste_item)
+        self.__terminal_menu.append(self.__copy_output_item)
+        self.__terminal_menu.append(self.__insert_password_item)
+        self.__terminal_menu.append(self.__find_password_item)
+        self.__terminal_menu.append(self.__history_item)
+
+        # A restored tab whose scrollback was saved starts out hibernated, so that its history is only loaded once it is
+        # first shown.
+        if tab_id and self.__snapshot_store.exists(tab_id):
+            self.__terminal          = None
+            self.__hibernated_output = collections.deque()
+        else:
+            self.__terminal = self.__create_terminal_widget()
+
+        self.__paste_progress_bar = gtk.ProgressBar.new()
+        self.__paste_progress_bar.set_show_text(True)
+        self.__paste_progress_bar.show()
+
+        self.__paste_bar = gtk.InfoBar.new()
+        self.__paste_bar.add_button(gtk.STOCK_CANCEL, gtk.ResponseType.CANCEL)
+        self.__paste_bar.get_content_area().pack_start(self.__paste_progress_bar, True, True, 0)
+        self.__paste_bar.connect("response", self.__handle_paste_bar_response)
+
+        self.__broadcast_label = gtk.Label.new("")
+        self.__broadcast_label.set_xalign(0)
+        self.__broadcast_label.show()
+
+        self.__broadcast_bar = gtk.InfoBar.new()
+        self.__broadcast_bar.set_message_type(gtk.MessageType.WARNING)
+        self.__broadcast_bar.add_button("Stop broadcasting", gtk.ResponseType.CLOSE)
+        self.__broadcast_bar.get_content_area().pack_start(self.__broadcast_label, True, True, 0)
+        self.__broadcast_bar.connect("response", self.__handle_broadcast_bar_response)
+
+        self.__scrollbars = gtk.ScrolledWindow()
+        self.__scrollbars.show()
+
+        if self.__terminal is not None:
+            self.__scrollbars.add(self.__terminal)
+
+        self.pack_start(self.__broadcast_bar, False, True, 0)
+        self.pack_start(self.__paste_bar, False, True, 0)
+        self.pack_start(self.__scrollbars, True, True, 0)
+        self.connect("map", self.__handle_map)
+        self.connect("unmap", self.__handle_unmap)
+        self.connect("destroy", self.__handle_destroy)
+        self.__update_activity_watch()
+
+        # With a bounded scrollback, the complete output is also streamed to compressed segments on disk so that the
+        # history that no longer fits in memory can be paged back in. The lines that VTE drops cannot be told apart in
+        # the output itself, so everything is written, and "Spill Scrollback" turns this off for tabs that flood.
+        if self.__scrollback_lines >= 0 and options.getboolean("Spill Scrollback", fallback=True):
+            self.__spill = ScrollbackSpill(os.path.join(services.spill_directory, uuid.uuid4().hex), options.getint("Spill Size", fallback=268435456))
+
+        self.__history_item.set_sensitive(self.__spill is not None)
+        self.__set_recording_enabled(recording_enabled)
+
+        self.__paste_progress_threshold = options.getint("Paste Progress Threshold", fallback=65536)
+        self.__paste_confirm_threshold  = options.getint("Paste Confirm Threshold", fallback=1048576)
+
+        self.__broadcaster.add(self, [tag.strip() for tag in options.get("Tags", fallback="").split(",") if tag.strip()])
+
+        if not spawn_on_map:
+            self.__spawn_child()
+
+    def get_tab_label(self):
+        return self.__tab_label
+
+    def get_tab_icon(self):
+        return self.__tab_icon.get_pixbuf()
+
+    def get_tab_markup(self):
+        return self.__tab_title.get_label() if self.__tab_title.get_use_markup() else html.escape(self.__tab_title.get_text())
+
+    def get_tooltip_text(self):
+        lines = [self.__title, f"Output: {format_size(self.__activity.get_rate()):s}/s"]
+
+        if self.__process_sample is not None:
+            cpu_percent, rss, foreground_name, working_dir = self.__process_sample
+            lines.append(f"Running: {foreground_name:s}")
+            lines.append(f"CPU: {cpu_percent:.0f}%, memory: {format_size(rss):s}")
+
+        last_status = self.__command_marks.get_last_status() if self.__command_marks is not None else None
+
+        if last_status is not None:
+            exit_code, duration = last_status
+
+            if exit_code == self.__UNKNOWN_EXIT_CODE:
+                lines.append(f"Last command: finished after {duration:.1f} s")
+            else:
+                lines.append(f"Last command: exit status {exit_code:d} after {duration:.1f} s")
+
+        if self.__terminal is None:
+            lines.append("Hibernated")
+
+        return "\n".join(lines)
+
+    def popup_tab_menu(self):
+        self.__update_broadcast_menu()
+        self.__tab_label_menu.popup_at_pointer()
+
+    def get_output_rate(self):
+        return self.__activity.get_rate()
+
+    def get_output_byte_count(self):
+        return self.__activity.get_byte_count()
+
+    def get_recent_output(self):
+        return "".join(self.__recent_output)[-self.__RECENT_OUTPUT_SIZE:]
+
+    def get_search_snapshot(self):
+        if self.__search_index is None:
+            return None
+
+        return self.__search_index.get_snapshot()
+
+    def reveal_line(self, line_number, line):
+        # A hibernated tab is revealed once its scrollback has been restored.
+        if self.__terminal is None or self.__restore_source is not None:
+            self.__pending_reveal = line_number, line
+            return
+
+        # Lines are numbered by the output they were indexed from. Wrapped lines, cursor movement and hibernation make
+        # that differ from the rows of the widget, so the number is only where the widget starts to search for the line.
+        adjustment = self.__terminal.get_vadjustment()
+        adjustment.set_value(max(adjustment.get_lower(), min(line_number, adjustment.get_upper() - adjustment.get_page_size())))
+
+        if not line.strip():
+            return
+
+        self.__terminal.unselect_all()
+        self.__terminal.search_set_regex(vte.Regex.new_for_search(re.escape(line), -1, self.__PCRE2_MULTILINE), 0)
+        self.__terminal.search_set_wrap_around(True)
+
+        if self.__terminal.search_find_next():
+            return
+
+        # The index keeps more history than the widget, so the line may only be left in the spilled history.
+        HISTORY_RESPONSE = 1
+
+        dialog = gtk.MessageDialog(
+            self.__window,
+            gtk.DialogFlags.MODAL | gtk.DialogFlags.DESTROY_WITH_PARENT,
+            gtk.MessageType.INFO,
+            gtk.ButtonsType.CLOSE,
+            f"The line is no longer in the scrollback of tab '{self.__title}'.")
+
+        if self.__spill is not None and self.__history_item.get_sensitive():
+            dialog.format_secondary_text("It may still be in the older history of the tab.")
+            dialog.add_button("Older history", HISTORY_RESPONSE)
+
+        response = dialog.run()
+        dialog.destroy()
+
+        if response == HISTORY_RESPONSE:
+            self.__history_item.activate()
+
+    def get_properties(self):
+        return self.__title, self.__notifications_enabled, self.__icon_name, self.__command, self.__get_working_dir(), self.__entry, self.__recorder is not None, self.__tab_id
+
+    def write_input(self, data):
+        self.__write_typed(data)
+
+    def paste(self, data, bracketed):
+        self.__paste(data, bracketed)
+
+    def set_broadcast_groups(self, group_names):
+        if group_names:
+            self.__broadcast_label.set_text(f"Input is broadcast to {', '.join(group_names):s}")
+            self.__broadcast_icon.show()
+            self.__broadcast_bar.show()
+        else:
+            self.__broadcast_icon.hide()
+            self.__broadcast_bar.hide()
+
+    def shut_down(self):
+        # The writers of the recording and the spill are daemon threads, so they have to finish before the application
+        # exits. Otherwise the end of the recording is lost, along with the trailers of its compressed files, and the
+        # spill is never removed.
+        if self.__recorder is not None:
+            self.__recorder.close()
+            self.__recorder.join()
+            self.__recorder = None
+
+        if self.__spill is not None:
+            self.__spill.close()
+            self.__spill.join()
+            self.__spill = None
+
+    def save_snapshot(self):
+        # Only tabs with new output are written, and never while a full screen program owns the screen.
+        try:
+            if self.__terminal is None:
+                if self.__hibernated_output or self.__hibernated_dropped:
+                    self.__append_snapshot()
+            elif self.__restore_source is None and not self.__alternate_screen and self.__activity.get_byte_count() != self.__snapshot_byte_count:
+                self.__write_snapshot()
+        except glib.Error as exception:
+            print(f"Failed to save the scrollback of tab '{self.__title:s}': {exception}", file=sys.stderr)
+
+    def discard_snapshot(self):
+        self.__snapshot_store.remove(self.__tab_id)
+
+    def __set_recording_enabled(self, recording_enabled):
+        if recording_enabled and self.__recorder is None:
+            self.__recorder = SessionRecorder(self.__recording_directory, self.__title, *self.__recording_options)
+        elif not recording_enabled and self.__recorder is not None:
+            self.__recorder.close()
+            self.__recorder = None
+
+    def __create_terminal_widget(self):
+        # The widget is recreated whenever a hibernated tab is shown again, so all of its configuration lives here.
+        terminal = vte.Terminal()
+        terminal.set_events(gdk.EventMask.KEY_PRESS_MASK | gdk.EventMask.BUTTON_PRESS_MASK)
+        terminal.set_audible_bell(True)
+        terminal.set_allow_bold(True)
+        terminal.set_scroll_on_output(False)
+        terminal.set_scroll_on_keystroke(True)
+        terminal.set_rewrap_on_resize(True)
+        terminal.set_colors(gdk.RGBA(0.75, 0.75, 0.75), gdk.RGBA(0, 0, 0), self.__COLOR_PALETTE) # Do this before configuring the cursor's color
+        terminal.set_cursor_shape(vte.CursorShape.BLOCK)
+        terminal.set_cursor_blink_mode(vte.CursorBlinkMode.ON)
+        terminal.set_color_cursor(gdk.RGBA(1, 0, 0))
+        terminal.set_color_highlight(gdk.RGBA(0, 0, 1))
+        terminal.set_color_highlight_foreground(gdk.RGBA(1, 1, 1))
+        terminal.set_scrollback_lines(self.__scrollback_lines)
+        terminal.connect("commit", self.__handle_terminal_commit)
+        terminal.connect_after("size-allocate", self.__handle_terminal_size_allocate)
+        terminal.connect("key-press-event", self.__handle_terminal_key_press_event)
+        terminal.connect("selection-changed", self.__handle_terminal_selection_changed)
+        terminal.connect("button-press-event", self.__handle_terminal_button_press)
+        terminal.connect("current-directory-uri-changed", self.__handle_terminal_directory_changed)
+        terminal.show()
+        return terminal
+
+    def __feed(self, data):
+        if self.__terminal is not None and self.__flood_source is not None:
+            self.__flood_output += data
+
+            # Dropping keeps the most recent lines only, the rest remains available from the spilled history.
+            if self.__flood_policy == "drop" and len(self.__flood_output) > self.__FLOOD_BUFFER_SIZE:
+                line_start = self.__flood_output.find(b"\n", len(self.__flood_output) - self.__FLOOD_BUFFER_SIZE) + 1
+
+                if line_start == 0:
+                    line_start = len(self.__flood_output) - self.__FLOOD_BUFFER_SIZE
+
+                self.__flood_dropped += line_start
+                del self.__flood_output[:line_start]
+
+            return
+
+        if self.__terminal is not None and self.__restore_source is None:
+            self.__feed_widget(data)
+            return
+
+        # While hibernated or restoring the snapshot, output is only buffered. A tab that keeps producing output only keeps the most recent part,
+        # the rest remains available from the spilled history.
+        previous_tail = self.__hibernated_output[-1][-8:] if self.__hibernated_output else b""
+
+        self.__hibernated_output.append(data)
+        self.__hibernated_size += len(data)
+
+        while self.__hibernated_size > self.__HIBERNATION_BUFFER_SIZE:
+            dropped = self.__hibernated_output.popleft()
+            self.__hibernated_size    -= len(dropped)
+            self.__hibernated_dropped += len(dropped)
+
+        # Programs wait for the answers to queries like device attributes, cursor position and window size, which only
+        # the widget can give, so a hibernated tab that is queried is restored. It hibernates again later on.
+        if self.__terminal is None and self.__TERMINAL_QUERY.search(previous_tail + data) is not None:
+            self.__rehydrate()
+
+            if not self.get_mapped():
+                self.__schedule_hibernation()
+
+    def __flush_flood_output(self):
+        if self.__flood_dropped > 0:
+            self.__terminal.feed(f"\x1B[0m\r\n[{format_size(self.__flood_dropped):s} of output was dropped while the tab was flooding]\r\n".encode())
+            self.__flood_dropped = 0
+
+        if self.__flood_output:
+            self.__feed_widget(bytes(self.__flood_output))
+            self.__flood_output.clear()
+
+    def __feed_widget(self, data):
+        marks    = self.__widget_mark_parser.parse(data) if self.__command_marks is not None else []
+        position = 0
+
+        # The widget processes its input later on. Each mark is followed by a status request, which the widget answers
+        # right when it reaches the mark, so that the position of the mark can be read from the cursor at that moment.
+        for offset, kind, parameters in marks:
+            if kind != b"B":
+                self.__terminal.feed(data[position:offset] + self.__MARK_QUERY)
+                self.__pending_marks.append(kind)
+                position = offset
+
+        if position < len(data):
+            self.__terminal.feed(data[position:])
+
+    def __start_flood_control(self):
+        self.__flood_source = glib.timeout_add(self.__FLOOD_FEED_INTERVAL, self.__handle_flood_timeout_expiry)
+        self.__watch_pty(glib.PRIORITY_LOW)
+        self.__update_tab_title()
+
+    def __stop_flood_control(self):
+        glib.source_remove(self.__flood_source)
+        self.__flood_source = None
+        self.__flush_flood_output()
+
+        if self.__pty_watch is not None:
+            self.__watch_pty(glib.PRIORITY_DEFAULT)
+
+        self.__update_tab_title()
+
+    def __write_snapshot(self):
+        stream = gio.MemoryOutputStream.new_resizable()
+        self.__terminal.write_contents_sync(stream, vte.WriteFlags.DEFAULT, None)
+        stream.close(None)
+
+        # The widget writes plain lines, which are stored the way they are fed back: with carriage returns and without
+        # the empty rows below the last line, so that the cursor ends up after it.
+        contents = stream.steal_as_bytes().get_data().rstrip(b"\n").replace(b"\n", b"\r\n")
+
+        self.__snapshot_store.write(self.__tab_id, contents)
+        self.__snapshot_byte_count = self.__activity.get_byte_count()
+
+    def __append_snapshot(self):
+        chunks = list(self.__hibernated_output)
+
+        if self.__hibernated_dropped:
+            chunks.insert(0, self.__get_dropped_output_notice())
+
+        self.__snapshot_store.append(self.__tab_id, chunks, self.__scrollback_lines + self.__DEFAULT_SIZE[0] if self.__scrollback_lines >= 0 else None)
+
+        self.__hibernated_output.clear()
+        self.__hibernated_size     = 0
+        self.__hibernated_dropped  = 0
+        self.__snapshot_byte_count = self.__activity.get_byte_count()
+
+    def __get_dropped_output_notice(self):
+        return f"\x1B[0m\r\n[{format_size(self.__hibernated_dropped):s} of output was not kept while the tab was hibernated]\r\n".encode()
+
+    def __hibernate(self):
+        if self.__flood_source is not None:
+            self.__stop_flood_control()
+
+        try:
+            self.__write_snapshot()
+        except glib.Error as exception:
+            print(f"Failed to hibernate tab '{self.__title:s}': {exception}", file=sys.stderr)
+            return False
+
+        # The snapshot starts at the first row that is still in the scrollback, and so will the restored widget.
+        if self.__command_marks is not None:
+            self.__command_marks.shift(-int(self.__terminal.get_vadjustment().get_lower()))
+            self.__pending_marks.clear()
+
+        self.__working_dir_uri    = self.__terminal.get_current_directory_uri()
+        self.__hibernated_output  = collections.deque()
+        self.__hibernated_size    = 0
+        self.__hibernated_dropped = 0
+
+        self.__scrollbars.remove(self.__terminal)
+        self.__terminal.destroy()
+        self.__terminal = None
+        return True
+
+    def __rehydrate(self):
+        self.__terminal = self.__create_terminal_widget()
+        self.__scrollbars.add(self.__terminal)
+
+        # The snapshot is kept until it is overwritten, so that the history survives a crash after the tab is shown. It
+        # is fed a chunk per iteration of the main loop, while new output keeps being buffered behind it.
+        try:
+            self.__restored_snapshot = self.__snapshot_store.open(self.__tab_id)
+        except OSError as exception:
+            print(f"Failed to restore the scrollback of tab '{self.__title:s}': {exception}", file=sys.stderr)
+            self.__finish_rehydration()
+            return
+
+        self.__restore_source = glib.idle_add(self.__handle_restore_idle)
+
+    def __handle_restore_idle(self):
+        try:
+            chunk = self.__restored_snapshot.read(self.__READ_SIZE)
+        except (OSError, EOFError) as exception:
+            print(f"Failed to restore the scrollback of tab '{self.__title:s}': {exception}", file=sys.stderr)
+            chunk = b""
+
+        if chunk:
+            self.__terminal.feed(chunk)
+            return True
+
+        self.__restored_snapshot.close()
+        self.__restored_snapshot = None
+        self.__restore_source    = None
+        self.__finish_rehydration()
+        return False
+
+    def __finish_rehydration(self):
+        if self.__hibernated_dropped:
+            self.__terminal.feed(self.__get_dropped_output_notice())
+
+        for data in self.__hibernated_output:
+            self.__feed_widget(data)
+
+        self.__hibernated_output  = None
+        self.__hibernated_size    = 0
+        self.__hibernated_dropped = 0
+
+        if self.__pending_reveal is not None:
+            self.reveal_line(*self.__pending_reveal)
+            self.__pending_reveal = None
+
+    def __schedule_hibernation(self):
+        if self.__hibernate_after > 0 and self.__hibernation_source is None and self.__terminal is not None:
+            self.__hibernation_source = glib.timeout_add_seconds(self.__hibernate_after, self.__handle_hibernation_timeout_expiry)
+
+    def __is_shell_in_foreground(self):
+        # The child leads its own session, so it is in the foreground when the foreground process group is its own.
+        if self.__child_pid is None:
+            return True
+
+        try:
+            return os.tcgetpgrp(self.__pty.get_fd()) == self.__child_pid
+        except OSError:
+            return True
+
+    def __handle_hibernation_timeout_expiry(self):
+        # Full screen programs are left alone, as a text snapshot cannot restore their screen, and so are programs that
+        # the shell runs in the foreground, as they may query the terminal or draw on its screen at any time.
+        if self.__restore_source is not None or self.__alternate_screen or self.__paste_data is not None or not self.__is_shell_in_foreground() or not self.__hibernate():
+            return True
+
+        self.__hibernation_source = None
+        return False
+
+    def __get_child_environment(self):
+        environment = dict(os.environ)
+        environment["TERM"]        = "xterm-256color"
+        environment["COLORTERM"]   = "truecolor"
+        environment["VTE_VERSION"] = str(vte.get_major_version() * 10000 + vte.get_minor_version() * 100 + vte.get_micro_version())
+
+        # Other tabs do not share connections, not even when this terminal was itself started from a tab that does.
+        if self.__ssh_pool is not None:
+            search_path = remove_path_directory(environment.get("PATH", os.defpath), self.__ssh_pool.get_shim_directory())
+            environment["PATH"] = search_path if self.__ssh_destination is None else os.pathsep.join((self.__ssh_pool.get_shim_directory(), search_path))
+
+        return [f"{name:s}={value:s}" for name, value in environment.items()]
+
+    def __spawn_child(self):
+        self.__spawn_requested = True
+
+        # The terminal owns the PTY rather than the VTE widget, so that all output passes through this class before
+        # being fed to the widget.
+        self.__pty = vte.Pty.new_sync(vte.PtyFlags.DEFAULT, None)
+        if self.__terminal is None:
+            self.__pty.set_size(*self.__DEFAULT_SIZE)
+        else:
+            self.__pty.set_size(self.__terminal.get_row_count(), self.__terminal.get_column_count())
+
+        self.__pty.spawn_async(
+            self.__initial_working_dir, # Working directory
+            self.__command, # Argv
+            self.__get_child_environment(), # Envv
+            glib.SpawnFlags.DEFAULT, # Spawn flags
+            None, # Child setup
+            None, # Child setup data
+            -1, # Timeout
+            None, # Cancellable
+            self.__handle_spawn_finished, # Callback
+            None) # User data
+
+    def __handle_spawn_finished(self, pty, result, user_data):
+        try:
+            _, child_pid = pty.spawn_finish(result)
+        except glib.Error as error:
+            if self.__pty is pty:
+                self.__feed(f"Failed to start '{shlex.join(self.__command):s}': {error.message:s}\r\n".encode())
+
+            return
+
+        glib.child_watch_add(glib.PRIORITY_DEFAULT, child_pid, self.__handle_child_exited)
+
+        if self.__pty is not pty:
+            # The tab was closed while its child was being spawned.
+            os.kill(child_pid, signal.SIGHUP)
+            return
+
+        self.__child_pid = child_pid
+        self.__process_sampler.add(child_pid, self.__handle_process_sampled)
+
+        self.__watch_pty(glib.PRIORITY_DEFAULT)
+
+        if self.__pending_input:
+            self.__flush_pending_input()
+
+    def __watch_pty(self, priority):
+        if self.__pty_watch is not None:
+            glib.source_remove(self.__pty_watch)
+
+        # A flooding tab is read at a lower priority than drawing and input, so it cannot starve the visible tab.
+        self.__pty_watch = glib.io_add_watch(self.__pty.get_fd(), priority, glib.IOCondition.IN | glib.IOCondition.HUP | glib.IOCondition.ERR, self.__handle_pty_readable)
+
+    def __handle_child_exited(self, child_pid, exit_status):
+        # The child has already been forgotten if the tab was closed before it exited.
+        if self.__child_pid == child_pid:
+            self.__process_sampler.remove(child_pid)
+            self.__child_pid = None
+            self.emit("closed")
+
+    def __handle_pty_readable(self, fd, condition):
+        try:
+            data = os.read(fd, self.__READ_SIZE)
+        except BlockingIOError:
+            return True
+        except OSError:
+            # Reading fails with EIO once the child has closed its end of the PTY.
+            data = b""
+
+        if not data:
+            self.__pty_watch = None
+            return False
+
+        self.__activity.record(len(data))
+        self.__feed(data)
+
+        # Follow whether the child wants pastes to be framed and whether it uses the alternate screen, as the widget
+        # that tracks these does not expose them.
+        for parameter, enabled in self.__mode_parser.parse(data):
+            if parameter == b"2004":
+                self.__bracketed_paste = enabled
+            elif parameter in self.__ALTERNATE_SCREEN_MODES:
+                self.__alternate_screen = enabled
+
+        # Durations are measured as the output arrives, as a throttled or hibernated tab only processes it later on.
+        if self.__command_marks is not None:
+            for offset, kind, parameters in self.__mark_parser.parse(data):
+                self.__handle_semantic_mark(kind, parameters)
+
+        if self.__recorder is not None:
+            self.__recorder.write(data)
+
+        if self.__spill is not None:
+            self.__spill.write(data)
+
+        text = self.__output_decoder.decode(data)
+
+        # The most recent text is kept apart from the search index, which may be turned off, for the tab switcher.
+        if text:
+            self.__recent_output.append(text)
+            self.__recent_output_size += len(text)
+
+            while self.__recent_output_size - len(self.__recent_output[0]) >= self.__RECENT_OUTPUT_SIZE:
+                self.__recent_output_size -= len(self.__recent_output.popleft())
+
+        if self.__search_index is not None:
+            self.__search_index.append(text)
+
+        if self.__triggers is not None:
+            for action, argument, matched_text in self.__triggers.scan(text):
+                self.__run_trigger(action, argument, matched_text)
+
+        return True
+
+    def __handle_semantic_mark(self, kind, parameters):
+        if kind == b"C":
+            self.__command_start_time = time.monotonic()
+        elif kind == b"D" and self.__command_start_time is not None:
+            exit_code = parameters.split(b";")[1] if parameters.startswith(b";") else b""
+            self.__command_marks.add_status(int(exit_code) if exit_code.isdigit() else self.__UNKNOWN_EXIT_CODE, time.monotonic() - self.__command_start_time)
+            self.__command_start_time = None
+
+    def __run_trigger(self, action, argument, matched_text):
+        if action == "notify":
+            if not self.get_mapped():
+                self.__notifications.notify(self, self.__title, self.__notification_priority, matched_text.strip())
+        elif action == "highlight":
+            if not self.get_mapped() and not self.__highlighted:
+                self.__highlighted = True
+                self.__update_tab_title()
+        elif action == "snippet":
+            self.__variable_providers.resolve(argument.get_variables(), self.__get_variable_context(), self.__answer_trigger, argument)
+        elif action == "password":
+            # Only a prompt that is actually waiting for a password is answered, and only once, so output that merely
+            # contains the prompt text, like a log or a message from a remote host, never gets to type the password.
+            if not self.__password_pending and self.__is_echo_disabled():
+                self.__password_pending = True
+                self.__vault.request(self.__answer_trigger_with_password, argument)
+
+    def __answer_trigger(self, values, snippet):
+        # Answers go to this tab only, even while its input is being broadcast.
+        self.__write_child(snippet.render(values))
+
+    def __answer_trigger_with_password(self, password_database, password_index, entry_title):
+        self.__password_pending = False
+
+        # Unlocking the vault can take a while, during which the prompt may have gone away.
+        if not self.__is_echo_disabled():
+            return
+
+        password_entry = password_database.find_entries(title=entry_title, first=True)
+
+        if password_entry is None:
+            print(f"Failed to find password entry '{entry_title:s}' for tab '{self.__title:s}'", file=sys.stderr)
+            return
+
+        self.__paste(password_entry.password.encode(), False)
+
+    def __is_echo_disabled(self):
+        # Programs turn off echo while they read a password.
+        if self.__pty is None or self.__child_pid is None:
+            return False
+
+        try:
+            return not termios.tcgetattr(self.__pty.get_fd())[3] & termios.ECHO
+        except termios.error:
+            return False
+
+    def __write_child(self, data):
+        self.__pending_input += data
+
+        if self.__child_pid is not None and self.__input_watch is None:
+            self.__flush_pending_input()
+
+    def __flush_pending_input(self):
+        try:
+            written = os.write(self.__pty.get_fd(), self.__pending_input)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            self.__pending_input.clear()
+            return
+
+        del self.__pending_input[:written]
+
+        # Whatever the PTY could not accept right away is written as soon as it becomes writable again.
+        if self.__pending_input:
+            if self.__input_watch is None:
+                self.__input_watch = glib.io_add_watch(self.__pty.get_fd(), glib.PRIORITY_DEFAULT, glib.IOCondition.OUT, self.__handle_pty_writable)
+        elif self.__paste_data is not None:
+            self.__schedule_paste()
+
+    def __handle_pty_writable(self, fd, condition):
+        assert self.__input_watch is not None
+        self.__input_watch = None
+        self.__flush_pending_input()
+        return False
+
+    def __write_typed(self, data):
+        # Keys typed during a paste are queued behind it, without a terminator, so that they reach the child after it.
+        if self.__paste_data is not None:
+            self.__paste_queue.append((data, None))
+        else:
+            self.__write_child(data)
+
+    def __paste(self, data, bracketed):
+        terminator = b""
+
+        if bracketed and self.__bracketed_paste:
+            terminator = self.__BRACKETED_PASTE_END
+            data       = self.__BRACKETED_PASTE_START + data.replace(self.__BRACKETED_PASTE_END, b"") + terminator
+
+        self.__paste_queue.append((data, terminator))
+
+        if self.__paste_data is None:
+            self.__start_next_paste()
+
+    def __broadcast_paste(self, data, bracketed):
+        self.__paste(data, bracketed)
+        self.__broadcaster.paste(self, data, bracketed)
+
+    def __start_next_paste(self):
+        if not self.__paste_queue:
+            self.__paste_data = None
+            self.__paste_bar.hide()
+            return
+
+        self.__paste_data, self.__paste_terminator = self.__paste_queue.popleft()
+        self.__paste_position = 0
+
+        if self.__paste_terminator is not None and len(self.__paste_data) > self.__paste_progress_threshold:
+            self.__paste_progress_bar.set_fraction(0)
+            self.__paste_progress_bar.set_text(f"Pasting {format_size(len(self.__paste_data)):s}")
+            self.__paste_bar.show()
+
+        self.__schedule_paste()
+
+    def __schedule_paste(self):
+        if self.__paste_source is None:
+            self.__paste_source = glib.idle_add(self.__handle_paste_idle, priority=glib.PRIORITY_DEFAULT_IDLE)
+
+    def __handle_paste_idle(self):
+        assert self.__paste_source is not None
+        self.__paste_source = None
+
+        chunk = self.__paste_data[self.__paste_position:self.__paste_position + self.__paste_chunk_size]
+        self.__paste_position += len(chunk)
+        self.__write_child(chunk)
+
+        if self.__paste_position >= len(self.__paste_data):
+            self.__start_next_paste()
+            return False
+
+        self.__paste_progress_bar.set_fraction(self.__paste_position / len(self.__paste_data))
+
+        # The next chunk is scheduled as soon as the PTY has accepted this one; until then, writing it resumes pasting.
+        if not self.__pending_input:
+            self.__schedule_paste()
+
+        return False
+
+    def __cancel_paste(self):
+        if self.__paste_data is None:
+            return
+
+        if self.__paste_source is not None:
+            glib.source_remove(self.__paste_source)
+            self.__paste_source = None
+
+        # A bracketed paste that has been started has to be terminated, or the child keeps waiting for its end.
+        if self.__paste_terminator is None:
+            self.__write_child(self.__paste_data[self.__paste_position:])
+        elif self.__paste_position > 0 and self.__paste_position < len(self.__paste_data):
+            self.__write_child(self.__paste_terminator)
+
+        # Only the pastes are cancelled, the keys typed behind them are still written.
+        for data, terminator in self.__paste_queue:
+            if terminator is None:
+                self.__write_child(data)
+
+        self.__paste_queue.clear()
+        self.__paste_data = None
+        self.__paste_bar.hide()
+
+    def __request_paste(self, selection):
+        gtk.Clipboard.get(selection).request_text(self.__handle_clipboard_text_received, None)
+
+    def __handle_clipboard_text_received(self, clipboard, text, user_data):
+        if not text:
+            return
+
+        # Line endings are sent the way the terminal would send them for the Enter key.
+        data = text.replace("\r\n", "\r").replace("\n", "\r").encode()
+
+        if len(data) > self.__paste_confirm_threshold:
+            dialog = gtk.MessageDialog(
+                self.__window,
+                gtk.DialogFlags.MODAL | gtk.DialogFlags.DESTROY_WITH_PARENT,
+                gtk.MessageType.QUESTION,
+                gtk.ButtonsType.OK_CANCEL,
+                f"Paste {format_size(len(data)):s} into tab '{self.__title}'?")
+            response = dialog.run()
+            dialog.destroy()
+
+            if response != gtk.ResponseType.OK:
+                return
+
+        self.__broadcast_paste(data, True)
+
+    def __handle_paste_bar_response(self, paste_bar, response):
+        assert self.__paste_bar is paste_bar
+
+        if response == gtk.ResponseType.CANCEL:
+            self.__cancel_paste()
+
+    def __update_activity_watch(self):
+        self.__activity.watched         = self.__notifications_enabled and not self.get_mapped()
+        self.__activity.flood_threshold = self.__flood_threshold if self.__flood_threshold > 0 and not self.get_mapped() else None
+
+    def __get_working_dir(self):
+        working_dir_uri = self.__working_dir_uri if self.__terminal is None else self.__terminal.get_current_directory_uri()
+
+        # Shells that do not report their directory are followed through the samples of their process instead.
+        if working_dir_uri is None:
+            if self.__process_sample is not None and self.__process_sample[3] is not None:
+                return self.__process_sample[3]
+
+            return self.__initial_working_dir
+
+        return urllib.parse.unquote(urllib.parse.urlparse(working_dir_uri).path)
+
+    def __update_tab_title(self):
+        if self.__flood_source is not None:
+            self.__tab_title.set_markup(f"<span weight=\"bold\" color=\"orange\">{html.escape(self.__title)} (flooding {format_size(self.__activity.get_rate()):s}/s)</span>")
+        elif self.get_mapped():
+            self.__tab_title.set_text(self.__title)
+        elif self.__highlighted:
+            self.__tab_title.set_markup(f"<span weight=\"bold\" background=\"yellow\">{html.escape(self.__title)}</span>")
+        elif self.__activity.get_state() == Activity.ACTIVE:
+            self.__tab_title.set_markup(f"<span weight=\"bold\" style=\"italic\" color=\"magenta\">{html.escape(self.__title)}</span>")
+        elif self.__activity.get_state() == Activity.QUIET:
+            self.__tab_title.set_markup(f"<span weight=\"bold\" color=\"red\">{html.escape(self.__title)}</span>")
+        else:
+            self.__tab_title.set_text(self.__title)
+
+    def __handle_activity_state_changed(self, activity):
+        assert self.__activity is activity
+
+        self.__update_tab_title()
+
+        if activity.get_state() == Activity.QUIET:
+            self.__notifications.notify(self, self.__title, self.__notification_priority)
+
+    def __handle_activity_flood_changed(self, activity):
+        assert self.__activity is activity
+
+        # A hibernated tab already only buffers its output, and a tab without a child has nothing left to throttle.
+        if activity.is_flooding() and self.__flood_source is None and self.__terminal is not None and self.__restore_source is None and self.__pty_watch is not None:
+            self.__start_flood_control()
+        elif not activity.is_flooding() and self.__flood_source is not None:
+            self.__stop_flood_control()
+
+    def __handle_flood_timeout_expiry(self):
+        self.__flush_flood_output()
+        self.__update_tab_title()
+        return True
+
+    def __handle_tab_label_button_press(self, tab_label, event):
+        assert self.__tab_label is tab_label
+
+        if event.type == gdk.EventType.BUTTON_PRESS:
+            if event.button == gdk.BUTTON_SECONDARY:
+                self.popup_tab_menu()
+                return True
+
+        return False
+
+    def __update_broadcast_menu(self):
+        self.__broadcast_selection_item.set_active(self.__broadcaster.is_selected(self))
+
+        broadcast_menu = gtk.Menu.new()
+        groups         = self.__broadcaster.get_groups(self)
+
+        for group_name, tab_count, active in groups:
+            group_item = gtk.CheckMenuItem.new_with_label(f"{group_name:s} ({tab_count:d} tabs)")
+            group_item.set_active(active)
+            group_item.connect("toggled", self.__handle_broadcast_group_item_toggled, group_name)
+            group_item.show()
+            broadcast_menu.append(group_item)
+
+        self.__broadcast_item.set_submenu(broadcast_menu)
+        self.__broadcast_item.set_sensitive(bool(groups))
+
+    def __handle_broadcast_selection_item_toggled(self, broadcast_selection_item):
+        assert self.__broadcast_selection_item is broadcast_selection_item
+        self.__broadcaster.set_selected(self, broadcast_selection_item.get_active())
+
+    def __handle_broadcast_group_item_toggled(self, group_item, group_name):
+        self.__broadcaster.set_active(group_name, group_item.get_active())
+
+    def __handle_broadcast_bar_response(self, broadcast_bar, response):
+        assert self.__broadcast_bar is broadcast_bar
+        self.__broadcaster.stop(self)
+
+    def __handle_process_sampled(self, cpu_percent, rss, foreground_name, working_dir):
+        previous_sample       = self.__process_sample
+        self.__process_sample = (cpu_percent, rss, foreground_name, working_dir)
+
+        # Without directory reports from the shell, a changed directory is only noticed here.
+        if previous_sample is not None and previous_sample[3] != working_dir and (self.__terminal is None or self.__terminal.get_current_directory_uri() is None):
+            self.__variable_providers.prefetch(self.__get_variable_context())
+            self.emit("changed")
+
+    def __handle_tab_label_query_tooltip(self, tab_label, x, y, keyboard_mode, tooltip):
+        assert self.__tab_label is tab_label
+
+        tooltip.set_text(self.get_tooltip_text())
+        return True
+
+    def __handle_tab_label_notify(self, widget, parameter):
+        self.emit("label-changed")
+
+    def __handle_map(self, widget):
+        assert self is widget
+
+        if self.__hibernation_source is not None:
+            glib.source_remove(self.__hibernation_source)
+            self.__hibernation_source = None
+
+        if self.__terminal is None:
+            self.__rehydrate()
+
+        if self.__flood_source is not None:
+            self.__stop_flood_control()
+
+        self.__highlighted = False
+
+        if not self.__spawn_requested:
+            self.__spawn_child()
+
+        self.__activity.reset()
+        self.__update_activity_watch()
+        self.__variable_providers.prefetch(self.__get_variable_context())
+        self.__tab_title.set_text(self.__title)
+        self.__notifications.withdraw(self)
+
+    def __handle_unmap(self, widget):
+        assert self is widget
+
+        self.__activity.reset()
+        self.__update_activity_watch()
 
-        self.add(self.__terminal)
-        self.connect("map", self.__handle_map)
+        self.__schedule_hibernation()
 
-        self.__child_process = self.__terminal.spawn_sync(
-            vte.PtyFlags.DEFAULT, # PTY flags
-            self.__initial_working_dir, # Working directory
-            self.__command, # Argv
-            [], # Envv
-            glib.SpawnFlags.DEFAULT, # Spawn flags
-            None, # Child setup
-            None, # Child setup data
-            None) # Cancellable
-        self.__terminal.watch_child(self.__child_process.child_pid)
+    def __handle_destroy(self, widget):
+        assert self is widget
 
-    def get_tab_label(self):
-        return self.__tab_label
+        self.__activity_monitor.unregister(self.__activity)
+        self.__notifications.withdraw(self)
+        self.__broadcaster.remove(self)
 
-    def get_properties(self):
-        return self.__title, self.__notifications_enabled, self.__icon_name, self.__command, self.__get_working_dir()
+        for source in (self.__pty_watch, self.__input_watch):
+            if source is not None:
+                glib.source_remove(source)
 
-    def __get_working_dir(self):
-        working_dir_uri = self.__terminal.get_current_directory_uri()
+        self.__pty_watch   = None
+        self.__input_watch = None
 
-        if working_dir_uri is None:
-            return self.__initial_working_dir
+        self.__cancel_paste()
 
-        return urllib.parse.unquote(urllib.parse.urlparse(working_dir_uri).path)
+        if self.__hibernation_source is not None:
+            glib.source_remove(self.__hibernation_source)
+            self.__hibernation_source = None
 
-    def __handle_notification_timeout_expiry(self):
-        assert self.__notification_timeout is not None
-        self.__tab_title.set_markup(f"<span weight=\"bold\" color=\"red\">{html.escape(self.__title)}</span>")
-        self.__notification.update(self.__title, f"New input was received in tab '{self.__title:s}'.", "dialog-information")
-        self.__notification.show()
-        self.__notification_timeout = None
-        return False
+        if self.__flood_source is not None:
+            glib.source_remove(self.__flood_source)
+            self.__flood_source = None
 
-    def __handle_tab_label_button_press(self, tab_label, event):
-        assert self.__tab_label is tab_label
+        if self.__restore_source is not None:
+            glib.source_remove(self.__restore_source)
+            self.__restored_snapshot.close()
+            self.__restore_source    = None
+            self.__restored_snapshot = None
 
-        if event.type == gdk.EventType.BUTTON_PRESS:
-            if event.button == gdk.BUTTON_SECONDARY:
-                self.__tab_label_menu.popup_at_pointer()
-                return True
+        if self.__spill is not None:
+            self.__spill.close()
+            self.__spill = None
 
-        return False
+        self.__set_recording_enabled(False)
 
-    def __handle_map(self, widget):
-        assert self is widget
+        # Without a VTE widget owning the PTY, the child has to be hung up explicitly when its tab goes away.
+        if self.__child_pid is not None:
+            self.__process_sampler.remove(self.__child_pid)
+
+            try:
+                os.kill(self.__child_pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
 
-        if self.__notification_timeout is not None:
-            glib.source_remove(self.__notification_timeout)
-            self.__notification_timeout = None
+            self.__child_pid = None
 
-        self.__tab_title.set_text(self.__title)
-        self.__notification.close()
+        self.__pty = None
 
     def __handle_properties_item_activated(self, properties_item):
         assert self.__properties_item is properties_item
@@ -345,9 +3853,11 @@ class Terminal(gtk.ScrolledWindow):
         notifications_checkbox.set_active(self.__notifications_enabled)
         notifications_checkbox.show()
 
-        icon_model = gtk.ListStore(str, pixbuf.Pixbuf)
-        for name, icon in sorted(self.__icons.items()):
-            icon_model.append((name, icon))
+        recording_checkbox = gtk.CheckButton.new_with_label("Record session")
+        recording_checkbox.set_active(self.__recorder is not None)
+        recording_checkbox.show()
+
+        icon_model = self.__icons.get_model()
 
         icon_view = gtk.IconView(icon_model)
         icon_view.set_text_column(0)
@@ -363,6 +3873,7 @@ class Terminal(gtk.ScrolledWindow):
         layout = gtk.VBox(False, 4)
         layout.pack_start(title_entry, False, True, 0)
         layout.pack_start(notifications_checkbox, False, True, 0)
+        layout.pack_start(recording_checkbox, False, True, 0)
         layout.pack_start(scrollbars, False, True, 0)
         layout.show()
 
@@ -377,6 +3888,8 @@ class Terminal(gtk.ScrolledWindow):
             self.__title = title_entry.get_text()
             self.__notifications_enabled = notifications_checkbox.get_active()
             self.__tab_title.set_text(self.__title)
+            self.__update_activity_watch()
+            self.__set_recording_enabled(recording_checkbox.get_active())
 
             selected_icon = icon_view.get_selected_items()
             if selected_icon:
@@ -391,7 +3904,7 @@ class Terminal(gtk.ScrolledWindow):
     def __handle_duplicate_item_activated(self, duplicate_item):
         assert self.__duplicate_item is duplicate_item
 
-        self.emit("duplicated", self.__title, self.__notifications_enabled, self.__icon_name, self.__command, self.__get_working_dir())
+        self.emit("duplicated", self.__title, self.__notifications_enabled, self.__icon_name, self.__command, self.__get_working_dir(), self.__entry, self.__recorder is not None)
 
     def __handle_close_item_activated(self, close_item):
         assert self.__close_item is close_item
@@ -409,9 +3922,36 @@ class Terminal(gtk.ScrolledWindow):
         dialog.destroy()
         return True
 
-    def __handle_terminal_child_exited(self, terminal, exit_status):
+    def __handle_terminal_commit(self, terminal, text, size):
+        assert self.__terminal is terminal
+
+        # Answers to the requests that follow marks are meant for this tab, not for its child.
+        if self.__pending_marks and text == self.__MARK_RESPONSE:
+            column, row = self.__terminal.get_cursor_position()
+            self.__command_marks.add(self.__pending_marks.popleft(), row, column)
+            return
+
+        data = text.encode()
+
+        # Replies of the terminal itself, like cursor positions, focus changes and mouse reports, are meant for this child only.
+        if not self.__typing:
+            self.__write_child(data)
+            return
+
+        # Whoever types at a password prompt answers it, also when unlocking the vault was cancelled.
+        self.__password_pending = False
+
+        if self.__held_input:
+            self.__held_input.append([data])
+        else:
+            self.__write_typed(data)
+            self.__broadcaster.write(self, data)
+
+    def __handle_terminal_size_allocate(self, terminal, allocation):
         assert self.__terminal is terminal
-        self.emit("closed")
+
+        if self.__pty is not None:
+            self.__pty.set_size(self.__terminal.get_row_count(), self.__terminal.get_column_count())
 
     def __handle_terminal_key_press_event(self, terminal, event):
         assert self.__terminal is terminal
@@ -420,24 +3960,116 @@ class Terminal(gtk.ScrolledWindow):
         snippet      = self.__snippets.get((event.keyval, masked_state))
 
         if snippet is not None:
-            variables = {
-                "HOME": os.path.expanduser("~"),
-                "PWD":  self.__get_working_dir()}
+            # The snippet keeps its place in the input while its variables are resolved, and whatever is typed meanwhile waits behind it.
+            entry = [None]
+            self.__held_input.append(entry)
+            self.__variable_providers.resolve(snippet.get_variables(), self.__get_variable_context(), self.__insert_snippet, snippet, entry)
+            return True
 
-            self.__terminal.feed_child(tuple(map(ord, "".join(map(lambda part: part(lambda variable: variables.get(variable, "")), snippet)))))
+        if event.keyval == gdk.KEY_Insert and masked_state == gdk.ModifierType.SHIFT_MASK:
+            self.__request_paste(gdk.SELECTION_PRIMARY)
             return True
 
+        if self.__command_marks is not None and masked_state == gdk.ModifierType.CONTROL_MASK | gdk.ModifierType.SHIFT_MASK:
+            if event.keyval == gdk.KEY_Up:
+                self.__jump_to_prompt(True)
+                return True
+
+            if event.keyval == gdk.KEY_Down:
+                self.__jump_to_prompt(False)
+                return True
+
+            if event.keyval == gdk.KEY_O:
+                self.__select_last_output()
+                return True
+
+            if event.keyval == gdk.KEY_L:
+                self.__copy_last_output()
+                return True
+
+        # The terminal commits the text of a key while handling it, so anything committed before the next iteration of the main loop was typed.
+        if not self.__typing:
+            self.__typing = True
+            glib.idle_add(self.__handle_typing_idle, priority=glib.PRIORITY_HIGH)
+
         return False
 
-    def __handle_terminal_contents_changed(self, terminal):
-        assert self.__terminal is terminal
+    def __handle_typing_idle(self):
+        self.__typing = False
+        return False
 
-        if self.__notifications_enabled and not self.get_mapped():
-            if self.__notification_timeout is not None:
-                glib.source_remove(self.__notification_timeout)
+    def __jump_to_prompt(self, backward):
+        adjustment = self.__terminal.get_vadjustment()
+        top_row    = int(adjustment.get_value())
+        row        = self.__command_marks.get_previous_prompt(top_row) if backward else self.__command_marks.get_next_prompt(top_row)
 
-            self.__notification_timeout = glib.timeout_add(self.__NOTIFICATION_TRIGGER_TIME, self.__handle_notification_timeout_expiry)
-            self.__tab_title.set_markup(f"<span weight=\"bold\" style=\"italic\" color=\"magenta\">{html.escape(self.__title)}</span>")
+        # Prompts that have already been dropped from the scrollback cannot be shown any more.
+        if row is None or row < adjustment.get_lower():
+            self.__terminal.error_bell()
+            return
+
+        adjustment.set_value(min(row, adjustment.get_upper() - adjustment.get_page_size()))
+
+    def __get_last_output(self):
+        last_output = self.__command_marks.get_last_output()
+
+        if last_output is None:
+            return None
+
+        start_row, start_column, end_row, end_column = last_output
+        first_row = int(self.__terminal.get_vadjustment().get_lower())
+
+        if start_row < first_row:
+            start_row, start_column = first_row, 0
+
+        if end_row < start_row:
+            return None
+
+        if hasattr(self.__terminal, "get_text_range_format"):
+            text, length = self.__terminal.get_text_range_format(vte.Format.TEXT, start_row, start_column, end_row, end_column)
+        else:
+            text, attributes = self.__terminal.get_text_range(start_row, start_column, end_row, end_column, None, None)
+
+        return start_row, text
+
+    def __select_last_output(self):
+        last_output = self.__get_last_output()
+
+        if last_output is None:
+            self.__terminal.error_bell()
+            return
+
+        # The widget cannot select an arbitrary range, so the output is shown and made the primary selection instead.
+        start_row, text = last_output
+        adjustment      = self.__terminal.get_vadjustment()
+        adjustment.set_value(min(start_row, adjustment.get_upper() - adjustment.get_page_size()))
+        gtk.Clipboard.get(gdk.SELECTION_PRIMARY).set_text(text, -1)
+
+    def __copy_last_output(self):
+        last_output = self.__get_last_output()
+
+        if last_output is None:
+            self.__terminal.error_bell()
+            return
+
+        gtk.Clipboard.get(gdk.SELECTION_CLIPBOARD).set_text(last_output[1], -1)
+
+    def __get_variable_context(self):
+        last_status = self.__command_marks.get_last_status() if self.__command_marks is not None else None
+
+        return {
+            "HOME":   os.path.expanduser("~"),
+            "PWD":    self.__get_working_dir(),
+            "REMOTE": get_remote_host(self.__ssh_destination),
+            "STATUS": "" if last_status is None or last_status[0] == self.__UNKNOWN_EXIT_CODE else str(last_status[0])}
+
+    def __insert_snippet(self, values, snippet, entry):
+        entry[0] = snippet.render(values)
+
+        while self.__held_input and self.__held_input[0][0] is not None:
+            data, = self.__held_input.popleft()
+            self.__write_typed(data)
+            self.__broadcaster.write(self, data)
 
     def __handle_terminal_selection_changed(self, terminal):
         assert self.__terminal is terminal
@@ -454,12 +4086,13 @@ class Terminal(gtk.ScrolledWindow):
                 return True
 
             if event.button == gdk.BUTTON_MIDDLE:
-                self.__terminal.paste_primary()
+                self.__request_paste(gdk.SELECTION_PRIMARY)
                 return True
 
         return False
 
     def __handle_terminal_directory_changed(self, terminal):
+        self.__variable_providers.prefetch(self.__get_variable_context())
         self.emit("changed")
 
     def __handle_copy_item_activated(self, copy_item):
@@ -468,20 +4101,94 @@ class Terminal(gtk.ScrolledWindow):
 
     def __handle_paste_item_activated(self, paste_item):
         assert self.__paste_item is paste_item
-        self.__terminal.paste_clipboard()
+        self.__request_paste(gdk.SELECTION_CLIPBOARD)
 
     def __handle_copy_and_paste_item_activated(self, copy_and_paste_item):
         assert self.__copy_and_paste_item is copy_and_paste_item
         self.__terminal.copy_clipboard()
-        self.__terminal.paste_clipboard()
+        self.__request_paste(gdk.SELECTION_CLIPBOARD)
+
+    def __handle_copy_output_item_activated(self, copy_output_item):
+        assert self.__copy_output_item is copy_output_item
+        self.__copy_last_output()
+
+    def __handle_history_item_activated(self, history_item):
+        assert self.__history_item is history_item
+
+        # Sealing the segment that is being written waits for everything that is queued, so it is done by the writer.
+        self.__history_item.set_sensitive(False)
+        self.__spill.sync(self.__handle_spill_synchronized, self.__spill)
+        return True
+
+    def __handle_spill_synchronized(self, first_segment, segment_count, spill):
+        OLDER_RESPONSE = 1
+        NEWER_RESPONSE = 2
+
+        # The tab may have been closed in the meantime.
+        if self.__spill is not spill:
+            return False
+
+        self.__history_item.set_sensitive(True)
+
+        if segment_count == first_segment:
+            return False
+
+        viewer = vte.Terminal()
+        viewer.set_input_enabled(False)
+        viewer.set_scroll_on_output(False)
+        viewer.set_colors(gdk.RGBA(0.75, 0.75, 0.75), gdk.RGBA(0, 0, 0), self.__COLOR_PALETTE)
+        viewer.set_scrollback_lines(-1)
+        viewer.show()
+
+        scrollbars = gtk.ScrolledWindow()
+        scrollbars.set_size_request(800, 600)
+        scrollbars.add(viewer)
+        scrollbars.show()
+
+        dialog = gtk.Dialog(
+            f"History of tab '{self.__title}'",
+            self.__window,
+            gtk.DialogFlags.MODAL | gtk.DialogFlags.DESTROY_WITH_PARENT,
+            ("Older", OLDER_RESPONSE, "Newer", NEWER_RESPONSE, gtk.STOCK_CLOSE, gtk.ResponseType.CLOSE))
+        dialog.get_content_area().pack_start(scrollbars, True, True, 0)
+
+        # Only one segment is resident at a time; the others are decompressed when paged to.
+        segment_index = segment_count - 1
+
+        while True:
+            viewer.reset(True, True)
 
-    def __generate_password_menu(self, group):
-        menu = gtk.Menu.new()
-        menu.show()
+            # The tab keeps spilling while the history is shown, so the oldest segments can be removed meanwhile.
+            try:
+                viewer.feed(spill.read_segment(segment_index))
+            except OSError:
+                viewer.feed(b"[This part of the history has been removed to stay within the spill size]\r\n")
+
+            dialog.set_title(f"History of tab '{self.__title}' ({segment_index - first_segment + 1:d}/{segment_count - first_segment:d})")
+            dialog.set_response_sensitive(OLDER_RESPONSE, segment_index > first_segment)
+            dialog.set_response_sensitive(NEWER_RESPONSE, segment_index < segment_count - 1)
+
+            response = dialog.run()
+
+            if response == OLDER_RESPONSE:
+                segment_index -= 1
+            elif response == NEWER_RESPONSE:
+                segment_index += 1
+            else:
+                break
+
+        dialog.destroy()
+        return False
 
+    def __populate_password_menu(self, menu, group):
+        # Submenus start out empty and are only filled in when their item is selected.
         for subgroup in group.subgroups:
+            submenu = gtk.Menu.new()
+            submenu.show()
+
             item = gtk.MenuItem.new_with_label(subgroup.name)
-            item.set_submenu(self.__generate_password_menu(subgroup))
+            item.set_submenu(submenu)
+            item.connect("select", self.__handle_password_group_item_selected, subgroup)
             item.show()
 
             menu.append(item)
@@ -493,45 +4200,103 @@ class Terminal(gtk.ScrolledWindow):
 
             menu.append(item)
 
-        return menu
+    def __handle_password_group_item_selected(self, item, group):
+        submenu = item.get_submenu()
+
+        if not submenu.get_children():
+            self.__populate_password_menu(submenu, group)
 
     def __enter_password(self, password):
         def closure(item):
-            self.__terminal.feed_child(tuple(map(ord, password)))
+            self.__paste(password.encode(), False)
 
         return closure
 
-    def __handle_insert_password_item_activated(self, insert_password_item):
-        assert self.__insert_password_item is insert_password_item
+    def __show_password_menu(self, password_database, password_index, trigger_event):
+        password_menu = gtk.Menu.new()
+        password_menu.show()
 
-        while True:
-            if self.__stored_password is None:
-                try:
-                    if self.__password_dialog.run() != gtk.ResponseType.OK:
-                        break
-                finally:
-                    self.__password_dialog.hide()
+        self.__populate_password_menu(password_menu, password_database.root_group)
+        password_menu.popup_at_pointer(trigger_event)
 
-                self.__stored_password = self.__password_entry.get_text()
+    def __show_password_picker(self, password_database, password_index):
+        MAXIMUM_MATCHES = 100
 
-            try:
-                with pykeepass.PyKeePass("/home/bartsas/Documents/Passwords.kdbx", password=self.__stored_password) as password_database:
-                    password_menu = self.__generate_password_menu(password_database.root_group)
+        match_model = gtk.ListStore(gobject.TYPE_PYOBJECT, str, str, str, str)
 
-                password_menu.popup_at_pointer()
-                break
-            except Exception as exception:
-                self.__stored_password = None
+        def update_matches(query_entry):
+            match_model.clear()
 
-    def __handle_password_entry_activated(self, entry):
-        assert self.__password_entry is entry
-        self.__password_dialog.response(gtk.ResponseType.OK)
+            for match in password_index.search(query_entry.get_text(), MAXIMUM_MATCHES):
+                match_model.append(match)
+
+            if len(match_model) > 0:
+                match_view.set_cursor(gtk.TreePath.new_first(), None, False)
+
+        query_entry = gtk.SearchEntry.new()
+        query_entry.connect("search-changed", update_matches)
+        query_entry.connect("activate", lambda query_entry: dialog.response(gtk.ResponseType.OK))
+        query_entry.show()
+
+        match_view = gtk.TreeView.new_with_model(match_model)
+        match_view.append_column(gtk.TreeViewColumn("Title", gtk.CellRendererText(), text=1))
+        match_view.append_column(gtk.TreeViewColumn("Username", gtk.CellRendererText(), text=2))
+        match_view.append_column(gtk.TreeViewColumn("URL", gtk.CellRendererText(), text=3))
+        match_view.append_column(gtk.TreeViewColumn("Group", gtk.CellRendererText(), text=4))
+        match_view.connect("row-activated", lambda match_view, path, column: dialog.response(gtk.ResponseType.OK))
+        match_view.show()
+
+        scrollbars = gtk.ScrolledWindow()
+        scrollbars.set_size_request(800, 400)
+        scrollbars.add(match_view)
+        scrollbars.show()
+
+        layout = gtk.VBox(False, 4)
+        layout.pack_start(query_entry, False, True, 0)
+        layout.pack_start(scrollbars, True, True, 0)
+        layout.show()
+
+        dialog = gtk.Dialog(
+            "Find password",
+            self.__window,
+            gtk.DialogFlags.MODAL | gtk.DialogFlags.DESTROY_WITH_PARENT,
+            (gtk.STOCK_CANCEL, gtk.ResponseType.CANCEL, gtk.STOCK_OK, gtk.ResponseType.OK))
+        dialog.get_content_area().pack_start(layout, True, True, 0)
+
+        update_matches(query_entry)
+
+        if dialog.run() == gtk.ResponseType.OK:
+            selected_model, selected_match = match_view.get_selection().get_selected()
+
+            if selected_match is not None:
+                self.__paste(selected_model[selected_match][0].password.encode(), False)
 
+        dialog.destroy()
+
+    def __handle_find_password_item_activated(self, find_password_item):
+        assert self.__find_password_item is find_password_item
+        self.__vault.request(self.__show_password_picker)
+
+    def __handle_insert_password_item_activated(self, insert_password_item):
+        assert self.__insert_password_item is insert_password_item
+
+        # The menu may only be shown once the database has been unlocked in the background, so it is positioned using
+        # the event that activated this item rather than whatever event happens to be current by then.
+        self.__vault.request(self.__show_password_menu, gtk.get_current_event())
+
+@PROFILER.instrument
 class Application:
     __ICON_DIRECTORY         = "~/.terminal/icons"
+    __ICON_CACHE_DIRECTORY   = "~/.terminal/cache/icons"
     __SNIPPETS_CONFIGURATION = "~/.terminal/snippets.ini"
     __COMMANDS_CONFIGURATION = "~/.terminal/commands.ini"
     __TABS_CONFIGURATION     = "~/.terminal/tabs.csv"
+    __SPILL_DIRECTORY        = "~/.terminal/cache/scrollback"
+    __RECORDING_DIRECTORY    = "~/.terminal/recordings"
+    __SNAPSHOT_DIRECTORY     = "~/.terminal/snapshots"
+    __SSH_CONTROL_DIRECTORY  = "~/.terminal/cache/ssh"
+    __DIAGNOSTICS_DIRECTORY  = "~/.terminal/diagnostics"
+    __SETTINGS_CONFIGURATION = "~/.terminal/settings.ini"
 
     def __init__(self):
         glib.set_prgname("My Terminal")
@@ -541,45 +4306,88 @@ class Application:
         self.__application.connect("startup", self.__handle_application_startup_event)
         self.__application.connect("activate", self.__handle_application_activate_event)
         self.__application.connect("open", self.__handle_application_open_event)
+        self.__application.connect("handle-local-options", self.__handle_application_local_options)
+        self.__application.add_main_option("command", ord("c"), glib.OptionFlags.NONE, glib.OptionArg.STRING, "Open a tab for the commands.ini entry NAME", "NAME")
         self.__application.run(sys.argv)
 
+    def __handle_application_local_options(self, application, options):
+        assert application is self.__application
+
+        command_entry = options.lookup_value("command", glib.VariantType.new("s"))
+
+        if command_entry is None:
+            return -1
+
+        # Registering starts up the primary instance, or finds the running one that the action is then forwarded to.
+        self.__application.register(None)
+        self.__application.activate_action("open-command", command_entry)
+        return 0 if self.__application.get_is_remote() else -1
+
     def __handle_application_startup_event(self, application):
         assert application is self.__application
 
         notify.init("My Terminal")
 
-        icon_directory = os.path.expanduser(self.__ICON_DIRECTORY)
-        self.__icons = {os.path.splitext(icon_file.name)[0]: pixbuf.Pixbuf.new_from_file(icon_file.path) for icon_file in os.scandir(icon_directory)}
+        self.__settings = configparser.ConfigParser(interpolation=None)
+        self.__settings.read(os.path.expanduser(self.__SETTINGS_CONFIGURATION))
 
-        snippets_configuration = configparser.ConfigParser(interpolation=None)
-        snippets_configuration.read(os.path.expanduser(self.__SNIPPETS_CONFIGURATION))
-        self.__snippets = {gtk.accelerator_parse(title): compile_snippet(section["Snippet"]) for title, section in snippets_configuration.items() if title != snippets_configuration.default_section}
+        PROFILER.start_latency_probe(self.__settings.getfloat("Diagnostics", "Probe Interval", fallback=0.1))
 
-        commands_configuration = configparser.ConfigParser(interpolation=None)
-        commands_configuration.read(os.path.expanduser(self.__COMMANDS_CONFIGURATION))
+        self.__icons = IconRegistry(
+            os.path.expanduser(self.__ICON_DIRECTORY),
+            os.path.expanduser(self.__ICON_CACHE_DIRECTORY),
+            self.__settings.getint("Icons", "Size", fallback=24))
+
+        self.__notification_dispatcher = NotificationDispatcher(
+            self.__settings.getfloat("Notifications", "Batch Window", fallback=1.0),
+            self.__settings.getfloat("Notifications", "Minimum Interval", fallback=10.0),
+            self.__show_terminal)
+
+        self.__process_sampler = ProcessSampler(self.__settings.getfloat("Processes", "Sample Interval", fallback=2.0))
 
-        start_menu = gtk.Menu()
-        open_at_startup = []
+        self.__activity_monitor = ActivityMonitor(
+            self.__settings.getfloat("Activity", "Tick Interval", fallback=0.25),
+            self.__settings.getfloat("Activity", "Quiet Time", fallback=4.0))
 
-        for title, section in commands_configuration.items():
-            if title != commands_configuration.default_section:
-                icon_name   = section["Icon"]
-                command     = shlex.split(section["Command"])
-                working_dir = os.path.expanduser(section.get("Working Dir", "~"))
+        self.__variable_providers = VariableProviders()
+        self.__variable_providers.register("BRANCH", get_git_branch, "PWD", self.__settings.getfloat("Snippets", "Branch Time to Live", fallback=5.0))
 
-                if section.getboolean("Open at Startup", False):
-                    open_at_startup.append((title, icon_name, command, working_dir))
+        # The snippets are shared by all tabs, so reloading them only has to update this one dictionary.
+        self.__snippets        = {}
+        self.__snippet_sources = {}
+        self.__load_snippets()
 
-                item_icon = gtk.Image.new_from_pixbuf(self.__icons[icon_name])
-                item_icon.show()
+        self.__commands_configuration = configparser.ConfigParser(interpolation=None)
+        self.__load_commands()
 
-                start_item = gtk.ImageMenuItem.new_with_label(title)
-                start_item.set_always_show_image(True)
-                start_item.set_image(item_icon)
-                start_item.connect("activate", self.__handle_start_item_activated, title, icon_name, command, working_dir)
-                start_item.show()
+        self.__start_menu  = gtk.Menu()
+        self.__start_items = {}
+        self.__update_start_menu()
 
-                start_menu.append(start_item)
+        search_item = gtk.MenuItem.new_with_label("Search all tabs")
+        search_item.set_action_name("app.search")
+        search_item.show()
+
+        separator_item = gtk.SeparatorMenuItem.new()
+        separator_item.show()
+
+        diagnostics_item = gtk.MenuItem.new_with_label("Diagnostics")
+        diagnostics_item.set_action_name("app.diagnostics")
+        diagnostics_item.show()
+
+        switch_tab_item = gtk.MenuItem.new_with_label("Switch to tab")
+        switch_tab_item.set_action_name("app.switch-tab")
+        switch_tab_item.show()
+
+        self.__start_menu.append(separator_item)
+        self.__start_menu.append(switch_tab_item)
+        self.__start_menu.append(search_item)
+        self.__start_menu.append(diagnostics_item)
+
+        ssh_pool_item = gtk.MenuItem.new_with_label("SSH connections")
+        ssh_pool_item.set_action_name("app.ssh-pool")
+        ssh_pool_item.show()
+        self.__start_menu.append(ssh_pool_item)
 
         start_icon = gtk.Image.new_from_icon_name("tab-new", gtk.IconSize.BUTTON)
         start_icon.show()
@@ -588,31 +4396,306 @@ class Application:
         self.__start_button.set_label("\u2001\u2001New Terminal\u2001\u2001")
         self.__start_button.set_always_show_image(True)
         self.__start_button.set_image(start_icon)
-        self.__start_button.set_popup(start_menu)
+        self.__start_button.set_popup(self.__start_menu)
         self.__start_button.show()
 
         self.__notebook = gtk.Notebook()
         self.__notebook.set_tab_pos(gtk.PositionType.LEFT)
         self.__notebook.set_scrollable(True)
         self.__notebook.set_action_widget(self.__start_button, gtk.PackType.END)
+        self.__notebook.connect("page-added", self.__handle_notebook_page_added)
+        self.__notebook.connect("page-removed", self.__handle_notebook_page_removed)
+        self.__notebook.connect("switch-page", self.__handle_notebook_switch_page)
         self.__notebook.show()
 
+        # Beyond this many tabs, the tabs of the notebook are replaced by a list that only draws the visible rows.
+        self.__sidebar_threshold = self.__settings.getint("Tabs", "Sidebar Threshold", fallback=40)
+        self.__tab_sidebar       = TabSidebar(self.__notebook, self.__start_menu)
+        self.__recent_terminals  = []
+
+        main_layout = gtk.Box.new(gtk.Orientation.HORIZONTAL, 0)
+        main_layout.pack_start(self.__tab_sidebar, False, True, 0)
+        main_layout.pack_start(self.__notebook, True, True, 0)
+        main_layout.show()
+
         self.__window = gtk.ApplicationWindow.new(self.__application)
         self.__window.set_title("My Terminal")
         self.__window.set_icon_name("terminal")
         self.__window.set_wmclass("my-terminal", "My Terminal")
-        self.__window.add(self.__notebook)
+        self.__window.add(main_layout)
         self.__window.maximize()
         self.__window.connect("delete-event", self.__handle_window_deleted)
-        self.__window.show()
 
-        with open(os.path.expanduser(self.__TABS_CONFIGURATION), newline="") as tabs_configuration:
-            for title, notifications_enabled, icon_name, command, working_dir in csv.reader(tabs_configuration):
-                self.__create_terminal(title, notifications_enabled.lower() == "true", icon_name, shlex.split(command), working_dir)
+        self.__vault = Vault(
+            self.__window,
+            os.path.expanduser(self.__settings.get("Vault", "Database", fallback="~/Documents/Passwords.kdbx")),
+            self.__settings.getint("Vault", "Idle Timeout", fallback=600))
+
+        self.__broadcaster = Broadcaster()
+
+        self.__ssh_pool       = None
+        self.__ssh_prewarm    = self.__settings.getboolean("SSH", "Prewarm", fallback=True)
+        ssh_control_directory = os.path.expanduser(self.__SSH_CONTROL_DIRECTORY)
+        ssh_shim_directory    = os.path.join(ssh_control_directory, "bin")
+
+        # When this terminal runs in a tab of another one, its PATH starts with the wrapper, which must not be taken for ssh.
+        ssh_path = shutil.which(
+            self.__settings.get("SSH", "Command", fallback="ssh"),
+            path=remove_path_directory(os.environ.get("PATH", os.defpath), ssh_shim_directory))
+
+        if self.__settings.getboolean("SSH", "Multiplex", fallback=True) and ssh_path:
+            try:
+                self.__ssh_pool = SshPool(
+                    ssh_path,
+                    ssh_control_directory,
+                    ssh_shim_directory,
+                    self.__settings.getint("SSH", "Persist Time", fallback=600))
+            except (OSError, ValueError) as exception:
+                print(f"Failed to set up SSH connection sharing: {exception}", file=sys.stderr)
+
+        if self.__ssh_pool is not None:
+            self.__add_ssh_destinations()
+
+            self.__ssh_pool_panel = SshPoolPanel(self.__window, self.__ssh_pool)
+
+            ssh_pool_action = gio.SimpleAction.new("ssh-pool", None)
+            ssh_pool_action.connect("activate", self.__handle_ssh_pool_action_activated)
+            self.__application.add_action(ssh_pool_action)
+
+        self.__tab_switcher = TabSwitcher(self.__window, self.__collect_switcher_tabs)
+        self.__tab_switcher.connect("activated", self.__handle_tab_switcher_activated)
+
+        switch_tab_action = gio.SimpleAction.new("switch-tab", None)
+        switch_tab_action.connect("activate", self.__handle_switch_tab_action_activated)
+        self.__application.add_action(switch_tab_action)
+        self.__application.set_accels_for_action("app.switch-tab", ["<Control><Shift>p"])
+
+        self.__search_panel = SearchPanel(self.__window, self.__collect_search_sources)
+        self.__search_panel.connect("activated", self.__handle_search_panel_activated)
+
+        search_action = gio.SimpleAction.new("search", None)
+        search_action.connect("activate", self.__handle_search_action_activated)
+        self.__application.add_action(search_action)
+        self.__application.set_accels_for_action("app.search", ["<Control><Shift>f"])
+
+        open_command_action = gio.SimpleAction.new("open-command", glib.VariantType.new("s"))
+        open_command_action.connect("activate", self.__handle_open_command_action_activated)
+        self.__application.add_action(open_command_action)
+
+        self.__diagnostics_panel = DiagnosticsPanel(self.__window, self.__collect_diagnostics)
+
+        diagnostics_action = gio.SimpleAction.new("diagnostics", None)
+        diagnostics_action.connect("activate", self.__handle_diagnostics_action_activated)
+        self.__application.add_action(diagnostics_action)
+
+        # Scripts can request a dump over D-Bus, with an empty path selecting a timestamped file.
+        dump_diagnostics_action = gio.SimpleAction.new("dump-diagnostics", glib.VariantType.new("s"))
+        dump_diagnostics_action.connect("activate", self.__handle_dump_diagnostics_action_activated)
+        self.__application.add_action(dump_diagnostics_action)
+
+        self.__snapshot_store = SnapshotStore(
+            os.path.expanduser(self.__SNAPSHOT_DIRECTORY),
+            self.__settings.getint("Session", "Snapshot Size", fallback=8388608))
+
+        self.__tab_services = TabServices(
+            window=self.__window,
+            icons=self.__icons,
+            snippets=self.__snippets,
+            variable_providers=self.__variable_providers,
+            activity_monitor=self.__activity_monitor,
+            process_sampler=self.__process_sampler,
+            notification_dispatcher=self.__notification_dispatcher,
+            vault=self.__vault,
+            broadcaster=self.__broadcaster,
+            ssh_pool=self.__ssh_pool,
+            spill_directory=os.path.expanduser(self.__SPILL_DIRECTORY),
+            recording_directory=os.path.expanduser(self.__settings.get("Recording", "Directory", fallback=self.__RECORDING_DIRECTORY)),
+            snapshot_store=self.__snapshot_store)
+
+        self.__session_store = SessionStore(
+            os.path.expanduser(self.__TABS_CONFIGURATION),
+            self.__settings.getfloat("Session", "Flush Interval", fallback=2.0),
+            self.__collect_tabs)
+
+        self.__discard_stale_spills()
+
+        # Restore all tabs before showing the window so that only the selected tab gets mapped, which matters when
+        # spawning is deferred until a tab is first shown. The spawns themselves run concurrently.
+        for row in self.__session_store.load():
+            # Rows written by older versions lack the trailing columns.
+            title, notifications_enabled, icon_name, command, working_dir, entry, recording_enabled, tab_id = row + [""] * (8 - len(row))
+            recording_enabled = recording_enabled.lower() == "true" if recording_enabled else self.__get_command_options(entry).getboolean("Record", fallback=False)
+            self.__add_terminal(title, notifications_enabled.lower() == "true", icon_name, shlex.split(command), working_dir, entry, recording_enabled, tab_id)
 
         if self.__notebook.get_n_pages() == 0:
-            for title, icon_name, command, terminal in open_at_startup:
-                self.__create_terminal(title, True, icon_name, command, terminal)
+            for title, (start_item, (icon_name, command, working_dir)) in self.__start_items.items():
+                if self.__commands_configuration[title].getboolean("Open at Startup", False):
+                    self.__add_terminal(title, True, icon_name, command, working_dir, title, self.__get_command_options(title).getboolean("Record", fallback=False), "")
+
+        self.__discard_stale_snapshots()
+
+        snapshot_interval = self.__settings.getint("Session", "Snapshot Interval", fallback=300)
+
+        if snapshot_interval > 0:
+            glib.timeout_add_seconds(snapshot_interval, self.__handle_snapshot_timeout_expiry)
+
+        self.__notebook.set_current_page(-1)
+        self.__session_store.mark_dirty()
+        self.__window.show()
+
+        # Changes are picked up while running. Tabs that are already open keep the options they were started with.
+        debounce_time   = self.__settings.getfloat("Reload", "Debounce Time", fallback=0.5)
+        self.__watchers = []
+        watched_paths   = (
+            (self.__SNIPPETS_CONFIGURATION, self.__handle_snippets_changed),
+            (self.__COMMANDS_CONFIGURATION, self.__handle_commands_changed),
+            (self.__ICON_DIRECTORY,         self.__handle_icons_changed))
+
+        if self.__settings.getboolean("Reload", "Watch Files", fallback=True):
+            for path, changed_callback in watched_paths:
+                try:
+                    self.__watchers.append(FileWatcher(os.path.expanduser(path), debounce_time, changed_callback))
+                except glib.Error as exception:
+                    print(f"Failed to watch '{path:s}' for changes: {exception}", file=sys.stderr)
+
+    def __load_snippets(self):
+        snippets_configuration = configparser.ConfigParser(interpolation=None)
+
+        try:
+            snippets_configuration.read(os.path.expanduser(self.__SNIPPETS_CONFIGURATION))
+        except configparser.Error as exception:
+            print(f"Failed to read snippets: {exception}", file=sys.stderr)
+            return
+
+        snippets        = {}
+        snippet_sources = {}
+
+        for title, section in snippets_configuration.items():
+            if title == snippets_configuration.default_section:
+                continue
+
+            accelerator = gtk.accelerator_parse(title)
+            source      = section.get("Snippet")
+
+            # Only snippets whose text changed are compiled again, and a broken one keeps its previous version.
+            if accelerator in self.__snippets and self.__snippet_sources[accelerator] == source:
+                snippets[accelerator]        = self.__snippets[accelerator]
+                snippet_sources[accelerator] = source
+                continue
+
+            try:
+                if source is None:
+                    raise Exception("no snippet given")
+
+                snippets[accelerator]        = compile_snippet(source)
+                snippet_sources[accelerator] = source
+            except Exception as exception:
+                print(f"Failed to compile snippet '{title:s}': {exception}", file=sys.stderr)
+
+                if accelerator in self.__snippets:
+                    snippets[accelerator]        = self.__snippets[accelerator]
+                    snippet_sources[accelerator] = self.__snippet_sources[accelerator]
+
+        self.__snippets.clear()
+        self.__snippets.update(snippets)
+        self.__snippet_sources = snippet_sources
+
+    def __load_commands(self):
+        commands_configuration = configparser.ConfigParser(interpolation=None)
+
+        try:
+            commands_configuration.read(os.path.expanduser(self.__COMMANDS_CONFIGURATION))
+        except configparser.Error as exception:
+            print(f"Failed to read commands: {exception}", file=sys.stderr)
+            return False
+
+        self.__commands_configuration = commands_configuration
+        return True
+
+    def __update_start_menu(self):
+        start_items = {}
+
+        for title, section in self.__commands_configuration.items():
+            if title == self.__commands_configuration.default_section:
+                continue
+
+            try:
+                start_command = (section["Icon"], shlex.split(section["Command"]), os.path.expanduser(section.get("Working Dir", "~")))
+            except (KeyError, ValueError) as exception:
+                print(f"Failed to read command entry '{title:s}': {exception}", file=sys.stderr)
+                continue
+
+            # Entries that did not change keep their menu item, only new and edited ones are created.
+            start_item, previous_start_command = self.__start_items.pop(title, (None, None))
+
+            if start_item is None or previous_start_command != start_command:
+                if start_item is not None:
+                    start_item.destroy()
+
+                start_item = self.__create_start_item(title, *start_command)
+
+            if start_item.get_parent() is None:
+                self.__start_menu.insert(start_item, len(start_items))
+            else:
+                self.__start_menu.reorder_child(start_item, len(start_items))
+
+            start_items[title] = (start_item, start_command)
+
+        for start_item, start_command in self.__start_items.values():
+            start_item.destroy()
+
+        self.__start_items = start_items
+
+    def __create_start_item(self, title, icon_name, command, working_dir):
+        item_icon = gtk.Image.new_from_pixbuf(self.__icons.get(icon_name))
+        item_icon.show()
+
+        start_item = gtk.ImageMenuItem.new_with_label(title)
+        start_item.set_always_show_image(True)
+        start_item.set_image(item_icon)
+        start_item.connect("activate", self.__handle_start_item_activated, title, icon_name, command, working_dir)
+        start_item.show()
+        return start_item
+
+    def __add_ssh_destinations(self):
+        for title, section in self.__commands_configuration.items():
+            try:
+                ssh_destination = get_ssh_destination(shlex.split(section.get("Command", "")), section.getboolean("SSH Wrapper", fallback=False))
+            except ValueError:
+                continue
+
+            if ssh_destination is not None:
+                self.__ssh_pool.add(ssh_destination)
+
+    def __handle_snippets_changed(self, changed_paths):
+        self.__load_snippets()
+
+    def __handle_commands_changed(self, changed_paths):
+        if self.__load_commands():
+            self.__update_start_menu()
+
+            if self.__ssh_pool is not None:
+                self.__add_ssh_destinations()
+
+    def __handle_icons_changed(self, changed_paths):
+        icon_names = set()
+
+        for path in changed_paths:
+            try:
+                icon_name = self.__icons.update(path)
+            except glib.Error as exception:
+                print(f"Failed to load icon '{path:s}': {exception}", file=sys.stderr)
+                continue
+
+            if icon_name is not None:
+                icon_names.add(icon_name)
+
+        for start_item, (icon_name, command, working_dir) in self.__start_items.values():
+            if icon_name in icon_names:
+                try:
+                    start_item.get_image().set_from_pixbuf(self.__icons.get(icon_name))
+                except glib.Error as exception:
+                    print(f"Failed to load icon '{icon_name:s}': {exception}", file=sys.stderr)
 
     def __handle_application_activate_event(self, application):
         assert application is self.__application
@@ -626,53 +4709,230 @@ class Application:
             directory_path = file_to_open
             while directory_path is not None:
                 if directory_path.query_info(gio.FILE_ATTRIBUTE_STANDARD_TYPE, gio.FileQueryInfoFlags.NONE, None).get_file_type() == gio.FileType.DIRECTORY:
-                    self.__create_terminal(file_to_open.get_basename(), True, "Blue Folder", ["/usr/bin/fish"], directory_path.get_path()) # TODO make configurable
+                    self.__create_terminal(file_to_open.get_basename(), True, "Blue Folder", ["/usr/bin/fish"], directory_path.get_path(), "", self.__get_command_options("").getboolean("Record", fallback=False)) # TODO make configurable
                     break
                 directory_path = directory_path.get_parent()
 
         self.__window.present()
 
-    def __save_tabs(self):
-        with open(os.path.expanduser(self.__TABS_CONFIGURATION), "w") as tabs_configuration:
-            writer = csv.writer(tabs_configuration)
-            tab_count = self.__notebook.get_n_pages()
+    def __collect_tabs(self):
+        rows = []
+
+        for tab_index in range(self.__notebook.get_n_pages()):
+            terminal = self.__notebook.get_nth_page(tab_index)
+            title, notifications_enabled, icon_name, command, working_dir, entry, recording_enabled, tab_id = terminal.get_properties()
+            rows.append((title, "true" if notifications_enabled else "false", icon_name, " ".join(map(shlex.quote, command)), working_dir, entry, "true" if recording_enabled else "false", tab_id))
+
+        return rows
+
+    def __collect_search_sources(self):
+        sources = []
+
+        for tab_index in range(self.__notebook.get_n_pages()):
+            terminal = self.__notebook.get_nth_page(tab_index)
+            snapshot = terminal.get_search_snapshot()
+
+            if snapshot is not None:
+                sources.append((terminal, terminal.get_properties()[0], snapshot))
+
+        return sources
+
+    def __collect_switcher_tabs(self):
+        # Tabs are ranked by how recently they were shown, with tabs that were never shown last.
+        terminals = self.__recent_terminals + [terminal for terminal in self.__notebook.get_children() if terminal not in self.__recent_terminals]
+        tabs      = []
+
+        for terminal in terminals:
+            title, notifications_enabled, icon_name, command, working_dir, entry, recording_enabled, tab_id = terminal.get_properties()
+            tabs.append((terminal, title, " ".join(command), working_dir, terminal.get_recent_output()))
+
+        return tabs
+
+    def __collect_diagnostics(self):
+        report = PROFILER.get_report()
+        report["tabs"] = []
+
+        for tab_index in range(self.__notebook.get_n_pages()):
+            terminal = self.__notebook.get_nth_page(tab_index)
+            report["tabs"].append({"title": terminal.get_properties()[0], "output_rate": terminal.get_output_rate(), "output_bytes": terminal.get_output_byte_count()})
+
+        return report
+
+    def __handle_diagnostics_action_activated(self, diagnostics_action, parameter):
+        self.__diagnostics_panel.present()
+
+    def __handle_dump_diagnostics_action_activated(self, dump_diagnostics_action, parameter):
+        path = parameter.get_string() or os.path.join(os.path.expanduser(self.__DIAGNOSTICS_DIRECTORY), time.strftime("diagnostics-%Y%m%d-%H%M%S.json"))
+        write_diagnostics(os.path.expanduser(path), self.__collect_diagnostics())
+
+    def __handle_open_command_action_activated(self, open_command_action, parameter):
+        title = parameter.get_string()
+
+        if not self.__commands_configuration.has_section(title):
+            print(f"Unknown command entry '{title:s}'", file=sys.stderr)
+            return
+
+        section = self.__commands_configuration[title]
+        self.__create_terminal(title, True, section["Icon"], shlex.split(section["Command"]), os.path.expanduser(section.get("Working Dir", "~")), title, section.getboolean("Record", fallback=False))
+        self.__window.present()
+
+    def __handle_switch_tab_action_activated(self, switch_tab_action, parameter):
+        self.__tab_switcher.present_switcher()
+
+    def __handle_tab_switcher_activated(self, tab_switcher, terminal):
+        assert self.__tab_switcher is tab_switcher
+        self.__show_terminal(terminal)
+
+    def __handle_notebook_page_added(self, notebook, terminal, tab_index):
+        assert self.__notebook is notebook
+        self.__update_tab_strip()
+
+    def __handle_notebook_page_removed(self, notebook, terminal, tab_index):
+        assert self.__notebook is notebook
+
+        if terminal in self.__recent_terminals:
+            self.__recent_terminals.remove(terminal)
+
+        self.__update_tab_strip()
+
+    def __handle_notebook_switch_page(self, notebook, terminal, tab_index):
+        assert self.__notebook is notebook
+
+        if terminal in self.__recent_terminals:
+            self.__recent_terminals.remove(terminal)
+
+        self.__recent_terminals.insert(0, terminal)
+
+    def __update_tab_strip(self):
+        sidebar_visible = 0 < self.__sidebar_threshold < self.__notebook.get_n_pages()
+
+        if self.__tab_sidebar.get_visible() != sidebar_visible:
+            self.__notebook.set_show_tabs(not sidebar_visible)
+            self.__tab_sidebar.set_visible(sidebar_visible)
+
+    def __handle_ssh_pool_action_activated(self, ssh_pool_action, parameter):
+        self.__ssh_pool_panel.present()
 
-            for tab_index in range(tab_count):
-                terminal = self.__notebook.get_nth_page(tab_index)
-                title, notifications_enabled, icon_name, command, working_dir = terminal.get_properties()
-                writer.writerow((title, "true" if notifications_enabled else "false", icon_name, " ".join(map(shlex.quote, command)), working_dir))
+    def __handle_search_action_activated(self, search_action, parameter):
+        self.__search_panel.present_query()
+
+    def __show_terminal(self, terminal):
+        tab_index = self.__notebook.page_num(terminal)
+
+        # The tab may have been closed since it was reported.
+        if tab_index >= 0:
+            self.__notebook.set_current_page(tab_index)
+            self.__window.present()
+
+    def __handle_search_panel_activated(self, search_panel, terminal, line_number, line):
+        assert self.__search_panel is search_panel
+
+        tab_index = self.__notebook.page_num(terminal)
+
+        # The tab may have been closed since the search ran.
+        if tab_index >= 0:
+            self.__notebook.set_current_page(tab_index)
+            terminal.reveal_line(line_number, line)
+            self.__window.present()
+
+    def __save_snapshots(self):
+        for tab_index in range(self.__notebook.get_n_pages()):
+            self.__notebook.get_nth_page(tab_index).save_snapshot()
+
+    def __discard_stale_snapshots(self):
+        # Snapshots of tabs that are no longer part of the session are left behind by crashes.
+        snapshot_directory = os.path.expanduser(self.__SNAPSHOT_DIRECTORY)
+        snapshot_names     = {f"{self.__notebook.get_nth_page(tab_index).get_properties()[7]:s}.gz" for tab_index in range(self.__notebook.get_n_pages())}
+
+        try:
+            snapshot_files = list(os.scandir(snapshot_directory))
+        except FileNotFoundError:
+            return
+
+        for snapshot_file in snapshot_files:
+            if snapshot_file.name not in snapshot_names:
+                try:
+                    os.remove(snapshot_file.path)
+                except OSError:
+                    pass
+
+    def __discard_stale_spills(self):
+        # Every tab removes its spill when it is closed or the application quits, so what is left was left behind by a
+        # crash. None of it belongs to a tab of this session, as tabs are only restored after this.
+        shutil.rmtree(os.path.expanduser(self.__SPILL_DIRECTORY), ignore_errors=True)
+
+    def __handle_snapshot_timeout_expiry(self):
+        self.__save_snapshots()
+        return True
 
     def __close_application(self):
-        self.__save_tabs()
+        self.__save_snapshots()
+        self.__snapshot_store.wait()
+        self.__session_store.flush()
+
+        for tab_index in range(self.__notebook.get_n_pages()):
+            self.__notebook.get_nth_page(tab_index).shut_down()
+
         self.__application.quit()
 
-    def __create_terminal(self, title, notifications_enabled, icon_name, command, working_dir):
-        terminal = Terminal(self.__window, self.__icons, self.__snippets, title, notifications_enabled, icon_name, command, working_dir)
+    def __get_command_options(self, entry):
+        # Tabs that were not started from a command entry only get the defaults of commands.ini.
+        if self.__commands_configuration.has_section(entry):
+            return self.__commands_configuration[entry]
+
+        return self.__commands_configuration[self.__commands_configuration.default_section]
+
+    def __add_terminal(self, title, notifications_enabled, icon_name, command, working_dir, entry, recording_enabled, tab_id):
+        spawn_on_map    = self.__settings.getboolean("Tabs", "Spawn on First Map", fallback=False)
+        ssh_destination = get_ssh_destination(command, self.__get_command_options(entry).getboolean("SSH Wrapper", fallback=False))
+
+        # The master connection is opened while the tab starts, so that it and any duplicates can attach to it.
+        if self.__ssh_pool is not None and self.__ssh_prewarm and ssh_destination is not None:
+            self.__ssh_pool.connect(ssh_destination)
+
+        terminal = Terminal(
+            self.__tab_services,
+            self.__get_command_options(entry),
+            title,
+            notifications_enabled,
+            icon_name,
+            command,
+            working_dir,
+            entry,
+            recording_enabled,
+            tab_id,
+            spawn_on_map)
         terminal.connect("changed", self.__handle_terminal_changed)
         terminal.connect("duplicated", self.__handle_terminal_duplicated)
         terminal.connect("closed", self.__handle_terminal_closed)
         terminal.show()
 
-        self.__notebook.set_current_page(self.__notebook.append_page(terminal, terminal.get_tab_label()))
+        tab_index = self.__notebook.append_page(terminal, terminal.get_tab_label())
         self.__notebook.set_tab_reorderable(terminal, True)
-        self.__save_tabs()
+        return tab_index
+
+    def __create_terminal(self, title, notifications_enabled, icon_name, command, working_dir, entry, recording_enabled):
+        self.__notebook.set_current_page(self.__add_terminal(title, notifications_enabled, icon_name, command, working_dir, entry, recording_enabled, ""))
+        self.__session_store.mark_dirty()
 
     def __handle_start_item_activated(self, start_item, title, icon_name, command, working_dir):
-        self.__create_terminal(title, True, icon_name, command, working_dir)
+        self.__create_terminal(title, True, icon_name, command, working_dir, title, self.__get_command_options(title).getboolean("Record", fallback=False))
 
     def __handle_terminal_changed(self, terminal):
-        self.__save_tabs()
+        self.__session_store.mark_dirty()
 
-    def __handle_terminal_duplicated(self, terminal, title, notifications_enabled, icon_name, command, working_dir):
-        self.__create_terminal(title, notifications_enabled, icon_name, command, working_dir)
+    def __handle_terminal_duplicated(self, terminal, title, notifications_enabled, icon_name, command, working_dir, entry, recording_enabled):
+        self.__create_terminal(title, notifications_enabled, icon_name, command, working_dir, entry, recording_enabled)
 
     def __handle_terminal_closed(self, terminal):
         self.__notebook.remove_page(self.__notebook.page_num(terminal))
+        terminal.discard_snapshot()
+        terminal.destroy()
 
         if self.__notebook.get_n_pages() == 0:
             self.__close_application()
         else:
-            self.__save_tabs()
+            self.__session_store.mark_dirty()
 
     def __handle_window_deleted(self, window, event):
         assert self.__window is window